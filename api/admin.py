@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Sensor, Departamento, Usuario, Evento, Barrera
+from .models import Sensor, Departamento, Usuario, Evento, Barrera, ResumenEvento, MarcaAgua
 
 @admin.register(Departamento)
 class DepartamentoAdmin(admin.ModelAdmin):
@@ -31,3 +31,12 @@ class EventoAdmin(admin.ModelAdmin):
     list_filter = ['tipo', 'timestamp']
     search_fields = ['descripcion']
     date_hierarchy = 'timestamp'
+
+@admin.register(ResumenEvento)
+class ResumenEventoAdmin(admin.ModelAdmin):
+    list_display = ['granularidad', 'periodo', 'tipo', 'sensor_id', 'barrera_id', 'departamento_id', 'total']
+    list_filter = ['granularidad', 'tipo']
+
+@admin.register(MarcaAgua)
+class MarcaAguaAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'valor', 'updated_at']
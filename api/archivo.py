@@ -0,0 +1,366 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import pagination, particiones, shards
+from .campos import FilaSerializada, columnas_de_lectura, rutas_de_lectura, serializar_filas
+from .filters import entero_param, fecha_param, lista_enteros_param, metadata_params, tipos_param
+from .models import Evento
+from .serializers import EventoSerializer
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+_cargar_json = orjson.loads if orjson is not None else json.loads
+
+INDICE = 'indice.json'
+
+# Indice leido por proceso; se recarga cuando cambia el archivo (ruta y mtime)
+_indice = (None, [])
+
+
+def directorio():
+    return Path(getattr(settings, 'ARCHIVO_EVENTOS_DIR', Path(settings.BASE_DIR) / 'archivo_eventos'))
+
+
+def entradas():
+    """
+    Meses archivados, del mas nuevo al mas antiguo. Cada entrada tiene mes, archivo,
+    desde y hasta (ISO, UTC), filas, min_id, max_id y bloques (ver buscar). Cuesta un
+    stat por llamada.
+    """
+    global _indice
+    ruta = directorio() / INDICE
+    try:
+        version = (ruta, ruta.stat().st_mtime_ns)
+    except FileNotFoundError:
+        return []
+    if _indice[0] != version:
+        datos = json.loads(ruta.read_text())
+        for entrada in datos:
+            entrada['desde'] = datetime.fromisoformat(entrada['desde'])
+            entrada['hasta'] = datetime.fromisoformat(entrada['hasta'])
+        _indice = (version, sorted(datos, key=lambda entrada: entrada['desde'], reverse=True))
+    return _indice[1]
+
+
+def limite():
+    """Fin del ultimo mes archivado: los eventos anteriores se leen del archivo, o None"""
+    archivadas = entradas()
+    return archivadas[0]['hasta'] if archivadas else None
+
+
+def sin_archivados(queryset):
+    """
+    Excluye de un queryset de eventos los meses archivados. Normalmente ya no estan en
+    la tabla; el filtro evita duplicados si archivar_mes se interrumpio antes de borrarlos.
+    """
+    hasta = limite()
+    return queryset.filter(timestamp__gte=hasta) if hasta is not None else queryset
+
+
+def _guardar_indice(datos):
+    ruta = directorio() / INDICE
+    temporal = ruta.with_suffix('.tmp')
+    temporal.write_text(json.dumps([
+        {**entrada, 'desde': entrada['desde'].isoformat(), 'hasta': entrada['hasta'].isoformat()}
+        for entrada in sorted(datos, key=lambda entrada: entrada['desde'])
+    ], indent=2))
+    os.replace(temporal, ruta)
+
+
+def _fsync_directorio(ruta):
+    descriptor = os.open(ruta, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def archivar_mes(mes, chunk_size=2000):
+    """
+    Copia los eventos del mes (UTC) a <ARCHIVO_EVENTOS_DIR>/eventos-AAAA-MM.ndjson.gz y
+    los quita de la tabla (particiones.eliminar_mes). Cada linea es la representacion de
+    EventoSerializer mas el departamento del sensor, en orden (timestamp, id) descendente.
+    Cada bloque de chunk_size filas es un miembro gzip aparte; eventos-AAAA-MM.bloques.json
+    guarda [posicion, bytes, min_id, max_id] de cada uno.
+
+    El archivo y el indice se escriben y sincronizan antes de borrar; si el proceso se
+    interrumpe, volver a ejecutarlo termina de borrar sin reescribir el archivo.
+    Con SHARDS el archivo reune los eventos de todos los shards y se borra en cada uno.
+    Devuelve la entrada del indice, o None si el mes no tenia eventos.
+    """
+    desde, hasta = mes, particiones.mes_siguiente(mes)
+    nombre = f'eventos-{mes:%Y-%m}.ndjson.gz'
+    nombre_bloques = f'eventos-{mes:%Y-%m}.bloques.json'
+    archivadas = [entrada for entrada in entradas() if entrada['desde'] != desde]
+    existente = next((entrada for entrada in entradas() if entrada['desde'] == desde), None)
+    if existente is not None:
+        _eliminar_mes(mes, existente.get('por_shard', {shards.todos()[0]: existente['filas']}))
+        return existente
+
+    serializer = EventoSerializer()
+    rutas = rutas_de_lectura(serializer)
+    columnas = columnas_de_lectura(rutas, ('sensor__departamento_id',))
+    queryset = shards.repartir(Evento.objects.filter(timestamp__gte=desde, timestamp__lt=hasta)).values(*columnas)
+    filas_db = pagination.iterar_por_keyset(queryset, 'timestamp', chunk_size)
+
+    directorio().mkdir(parents=True, exist_ok=True)
+    ruta = directorio() / nombre
+    temporal = ruta.with_suffix('.tmp')
+    filas = 0
+    bloques = []
+    por_shard = {}
+    with open(temporal, 'wb') as destino:
+        while True:
+            bloque = list(islice(filas_db, chunk_size))
+            if not bloque:
+                break
+            lineas = []
+            for fila, representacion in zip(bloque, serializar_filas(bloque, serializer, rutas)):
+                representacion['departamento'] = fila['sensor__departamento_id']
+                lineas.append(json.dumps(representacion, cls=DjangoJSONEncoder).encode() + b'\n')
+            # Los miembros concatenados se leen como un solo gzip (ver leer)
+            comprimido = gzip.compress(b''.join(lineas), mtime=0)
+            bloques.append([
+                destino.tell(), len(comprimido),
+                min(fila['id'] for fila in bloque), max(fila['id'] for fila in bloque),
+            ])
+            destino.write(comprimido)
+            filas += len(bloque)
+            for fila in bloque:
+                alias = shards.alias_de_id(fila['id'])
+                por_shard[alias] = por_shard.get(alias, 0) + 1
+        destino.flush()
+        os.fsync(destino.fileno())
+
+    if not filas:
+        temporal.unlink()
+        return None
+    os.replace(temporal, ruta)
+    ruta_bloques = directorio() / nombre_bloques
+    with open(ruta_bloques.with_suffix('.tmp'), 'w') as destino:
+        json.dump(bloques, destino)
+        destino.flush()
+        os.fsync(destino.fileno())
+    os.replace(ruta_bloques.with_suffix('.tmp'), ruta_bloques)
+
+    entrada = {
+        'mes': f'{mes:%Y-%m}',
+        'archivo': nombre,
+        'desde': desde,
+        'hasta': hasta,
+        'filas': filas,
+        'min_id': min(bloque[2] for bloque in bloques),
+        'max_id': max(bloque[3] for bloque in bloques),
+        'bytes': ruta.stat().st_size,
+        'bloques': nombre_bloques,
+    }
+    if shards.activos():
+        entrada['por_shard'] = por_shard
+    _guardar_indice(archivadas + [entrada])
+    _fsync_directorio(directorio())
+
+    _eliminar_mes(mes, por_shard)
+    return entrada
+
+
+def _eliminar_mes(mes, por_shard):
+    # Filas archivadas por shard: eliminar_mes las compara antes de hacer DROP PARTITION
+    for alias in shards.todos():
+        with shards.usar(alias):
+            particiones.eliminar_mes(mes, por_shard.get(alias, 0))
+
+
+def leer(entrada):
+    """Filas de un mes archivado (con 'departamento'), en orden (timestamp, id) descendente"""
+    with gzip.open(directorio() / entrada['archivo'], 'rb') as origen:
+        for linea in origen:
+            yield _cargar_json(linea)
+
+
+def _condiciones(params):
+    """
+    Equivalente en Python de filters.filtrar_eventos para filas archivadas, salvo
+    desde/hasta. departamento es el del sensor al momento de archivar.
+    """
+    condiciones = []
+    tipo = params.get('tipo')
+    if tipo:
+        condiciones.append(lambda fila: fila['tipo'] == tipo)
+    tipos = tipos_param(params, 'tipo__in')
+    if tipos is not None:
+        condiciones.append(lambda fila: fila['tipo'] in tipos)
+    for campo in ('sensor', 'barrera', 'departamento'):
+        valor = entero_param(params, campo)
+        if valor is not None:
+            condiciones.append(lambda fila, campo=campo, valor=valor: fila.get(campo) == valor)
+    sensores = lista_enteros_param(params, 'sensor__in')
+    if sensores is not None:
+        sensores = set(sensores)
+        condiciones.append(lambda fila: fila['sensor'] in sensores)
+    for clave, valor in metadata_params(params):
+        condiciones.append(
+            lambda fila, clave=clave, valor=valor:
+                (fila.get('metadata') or {}).get(clave) == valor
+        )
+    return condiciones
+
+
+def _rango(params):
+    return fecha_param(params, 'desde'), fecha_param(params, 'hasta')
+
+
+def _entradas_en_rango(desde, hasta):
+    return [
+        entrada for entrada in entradas()
+        if (hasta is None or entrada['desde'] < hasta) and (desde is None or entrada['hasta'] > desde)
+    ]
+
+
+def consultar(params):
+    """
+    True si la consulta de eventos pide algun mes archivado: solo con desde anterior
+    a limite(). Sin desde se consulta solo la tabla y no se lee ningun archivo.
+    """
+    if not entradas():
+        return False
+    desde, hasta = _rango(params)
+    return desde is not None and desde < limite() and bool(_entradas_en_rango(desde, hasta))
+
+
+def _filas_de(entrada, desde, hasta, condiciones, antes=None):
+    # Solo hace falta leer el timestamp si el mes no cae entero en el rango y el cursor
+    completo = (
+        (desde is None or entrada['desde'] >= desde)
+        and (hasta is None or entrada['hasta'] <= hasta)
+        and (antes is None or entrada['hasta'] <= antes[0])
+    )
+    for fila in leer(entrada):
+        if not completo:
+            timestamp = datetime.fromisoformat(fila['timestamp'])
+            if hasta is not None and timestamp >= hasta:
+                continue
+            if desde is not None and timestamp < desde:
+                return
+            if antes is not None and (timestamp, fila['id']) >= antes:
+                continue
+        if all(condicion(fila) for condicion in condiciones):
+            del fila['departamento']
+            yield FilaSerializada(fila)
+
+
+def filas(params, antes=None):
+    """
+    Eventos archivados que cumplen los filtros de params, en orden (timestamp, id)
+    descendente y, con antes=(timestamp, id), solo los posteriores a ese cursor.
+    Devuelve FilaSerializada sin el campo departamento.
+    """
+    desde, hasta = _rango(params)
+    condiciones = _condiciones(params)
+    for entrada in _entradas_en_rango(desde, hasta):
+        if antes is None or entrada['desde'] <= antes[0]:
+            yield from _filas_de(entrada, desde, hasta, condiciones, antes)
+
+
+def contar(params):
+    """
+    Cantidad de eventos archivados que cumplen los filtros. Los meses que caen enteros
+    en el rango sin otros filtros usan el total del indice; el resto se cuenta leyendo
+    el archivo y se guarda en cache ARCHIVO_EVENTOS_CONTEO_TTL segundos.
+    """
+    desde, hasta = _rango(params)
+    condiciones = _condiciones(params)
+    filtros = sorted(
+        (clave, valor) for clave, valor in params.items()
+        if clave not in ('desde', 'hasta', 'page', 'page_size', 'cursor', 'fields', 'omit', 'format')
+    )
+    total = 0
+    for entrada in _entradas_en_rango(desde, hasta):
+        desde_mes = desde if desde is not None and desde > entrada['desde'] else None
+        hasta_mes = hasta if hasta is not None and hasta < entrada['hasta'] else None
+        if not condiciones and desde_mes is None and hasta_mes is None:
+            total += entrada['filas']
+            continue
+
+        huella = hashlib.md5(json.dumps([filtros, str(desde_mes), str(hasta_mes)]).encode()).hexdigest()
+        clave = f'archivo_eventos:{entrada["archivo"]}:{entrada["filas"]}:{huella}'
+        cantidad = cache.get(clave)
+        if cantidad is None:
+            cantidad = sum(1 for _ in _filas_de(entrada, desde_mes, hasta_mes, condiciones))
+            cache.set(clave, cantidad, timeout=settings.ARCHIVO_EVENTOS_CONTEO_TTL)
+        total += cantidad
+    return total
+
+
+@lru_cache(maxsize=32)
+def _bloques(ruta, version):
+    return json.loads(Path(ruta).read_text())
+
+
+def buscar(pk):
+    """
+    Evento archivado por id, o None. Descomprime solo los bloques cuyo rango de ids
+    incluye pk. Los meses archivados sin indice de bloques no se buscan.
+    """
+    for entrada in entradas():
+        if entrada['min_id'] <= pk <= entrada['max_id'] and 'bloques' in entrada:
+            ruta = directorio() / entrada['bloques']
+            bloques = _bloques(str(ruta), ruta.stat().st_mtime_ns)
+            with open(directorio() / entrada['archivo'], 'rb') as origen:
+                for posicion, longitud, min_id, max_id in bloques:
+                    if not min_id <= pk <= max_id:
+                        continue
+                    origen.seek(posicion)
+                    for linea in gzip.decompress(origen.read(longitud)).splitlines():
+                        fila = _cargar_json(linea)
+                        if fila['id'] == pk:
+                            del fila['departamento']
+                            return FilaSerializada(fila)
+    return None
+
+
+class ConArchivo:
+    """
+    Secuencia para el Paginator de Django: primero las filas del queryset (eventos en
+    la tabla) y a continuacion las archivadas, que siempre son mas antiguas.
+    Las paginas profundas dentro del archivo leen los meses desde el principio; para
+    recorrer historicos largos conviene ?cursor= (ver KeysetPagination).
+    """
+
+    def __init__(self, queryset, params):
+        self.queryset = queryset
+        self.params = params
+        self._en_tabla = None
+
+    def en_tabla(self):
+        if self._en_tabla is None:
+            self._en_tabla = self.queryset.count()
+        return self._en_tabla
+
+    def count(self):
+        return self.en_tabla() + contar(self.params)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, indice):
+        if not isinstance(indice, slice):
+            raise TypeError('ConArchivo solo admite slices')
+        inicio, fin = indice.start or 0, indice.stop
+        en_tabla = self.en_tabla()
+        resultado = list(self.queryset[inicio:min(fin, en_tabla)]) if inicio < en_tabla else []
+        if fin > en_tabla:
+            resultado += islice(filas(self.params), max(0, inicio - en_tabla), fin - en_tabla)
+        return resultado
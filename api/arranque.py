@@ -0,0 +1,84 @@
+import inspect
+import time
+
+from django.conf import settings
+from django.urls import get_resolver, resolve, reverse
+from django.utils import translation
+from rest_framework import serializers as drf_serializers
+from rest_framework.settings import api_settings
+
+from . import serializers
+from .authentication import StatelessJWTAuthentication
+from .campos import rutas_de_lectura
+from .urls import router
+
+ACCIONES = ('list', 'retrieve', 'create', 'update', 'partial_update', 'destroy')
+
+
+def _urls():
+    # Indices de reverse() (se arman una vez por idioma) y regex de las rutas de cada recurso
+    get_resolver().reverse_dict
+    for _, _, basename in router.registry:
+        resolve(reverse(f'{basename}-list'))
+
+
+def _serializers():
+    # fields construye el mapeo modelo -> campo de cada ModelSerializer y llena los
+    # caches de _meta de los modelos
+    for _, clase in inspect.getmembers(serializers, inspect.isclass):
+        if issubclass(clase, drf_serializers.Serializer) and clase.__module__ == serializers.__name__:
+            serializer = clase()
+            serializer.fields
+            if isinstance(serializer, drf_serializers.ModelSerializer):
+                rutas_de_lectura(serializer)
+
+
+def _permisos():
+    # get_permissions importa e instancia las clases de permiso de cada accion
+    for _, viewset, _ in router.registry:
+        for accion in ACCIONES:
+            vista = viewset()
+            vista.action = accion
+            vista.get_permissions()
+        viewset().get_authenticators()
+    for renderer in api_settings.DEFAULT_RENDERER_CLASSES:
+        renderer()
+
+
+def _jwt():
+    # Algoritmo, clave y clases de token de SimpleJWT con un token descartable
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    token = AccessToken()
+    token['user_id'] = 0
+    StatelessJWTAuthentication().get_validated_token(str(token).encode())
+
+
+def _traducciones():
+    # Los catalogos de gettext se cargan la primera vez que se traduce en el idioma
+    with translation.override(settings.LANGUAGE_CODE):
+        str(drf_serializers.Field.default_error_messages['required'])
+
+
+PASOS = {
+    'urls': _urls,
+    'serializers': _serializers,
+    'permisos': _permisos,
+    'jwt': _jwt,
+    'traducciones': _traducciones,
+}
+
+
+def calentar():
+    """
+    Inicializa lo que de otro modo paga la primera peticion de cada worker: resolver
+    de URLs, campos de los serializers, permisos, SimpleJWT y traducciones. No
+    consulta la base, asi que se puede llamar en el master de gunicorn antes del fork.
+    Devuelve los milisegundos de cada paso.
+    """
+    tiempos = {}
+    for nombre, paso in PASOS.items():
+        inicio = time.perf_counter()
+        paso()
+        tiempos[nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+    return tiempos
@@ -0,0 +1,105 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+def _cache():
+    return caches[getattr(settings, 'TOKENS_REVOCADOS_CACHE_ALIAS', 'default')]
+
+
+def _clave_revocacion(user_id):
+    return f'tokens:revocados:{user_id}'
+
+
+def _emitido(token):
+    # 'emitido' (SmartTokenObtainPairSerializer) tiene fraccion de segundo; iat no
+    return token.get('emitido', token.get('iat', 0))
+
+
+def revocar_tokens(user_id):
+    """
+    Invalida los tokens del usuario emitidos hasta ahora (al confirmar la transaccion):
+    sus claims (is_superuser, rol, activo) pueden haber cambiado. Los refresh tokens
+    anteriores tambien dejan de servir, asi que el usuario debe volver a autenticarse.
+    """
+    def revocar():
+        _cache().set(
+            _clave_revocacion(user_id), time.time(),
+            timeout=int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+        )
+    transaction.on_commit(revocar)
+
+
+def token_revocado(token):
+    revocado = _cache().get(_clave_revocacion(token.get(api_settings.USER_ID_CLAIM)))
+    return revocado is not None and _emitido(token) < revocado
+
+
+async def atoken_revocado(token):
+    revocado = await _cache().aget(_clave_revocacion(token.get(api_settings.USER_ID_CLAIM)))
+    return revocado is not None and _emitido(token) < revocado
+
+
+class SmartTokenUser(TokenUser):
+    """
+    Usuario construido desde los claims del token (id, username, is_superuser,
+    rol, departamento). El User completo se carga solo si una vista accede a
+    un atributo que el token no trae.
+    """
+
+    @cached_property
+    def rol(self):
+        return self.token.get('rol')
+
+    @cached_property
+    def departamento_id(self):
+        return self.token.get('departamento')
+
+    @cached_property
+    def user(self):
+        return User.objects.get(pk=self.id)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.user, attr)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Autenticacion JWT sin consulta de usuario por peticion.
+    Los tokens emitidos antes de incluir los claims de usuario siguen el camino con BD.
+    Los tokens revocados (ver revocar_tokens) se rechazan con una lectura de cache.
+    """
+
+    def get_user(self, validated_token):
+        if token_revocado(validated_token):
+            raise InvalidToken('Token revocado')
+        if 'username' not in validated_token:
+            return super().get_user(validated_token)
+        return SmartTokenUser(validated_token)
+
+    async def aauthenticate(self, request):
+        """Variante async de authenticate; solo consulta la BD para tokens sin claims de usuario"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if await atoken_revocado(validated_token):
+            raise InvalidToken('Token revocado')
+        if 'username' in validated_token:
+            return SmartTokenUser(validated_token), validated_token
+        return await sync_to_async(self.get_user)(validated_token), validated_token
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+# Recursos cuyo contenido cacheado depende de cada modelo
+# (p. ej. sensores muestra departamento_nombre, departamentos muestra total_sensores)
+DEPENDENCIAS = {
+    'Departamento': ['departamentos', 'sensores', 'barreras'],
+    'Sensor': ['sensores', 'departamentos', 'barreras'],
+    'Barrera': ['barreras'],
+}
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPUESTAS_CACHE_ALIAS', 'default')]
+
+
+def _clave_version(recurso):
+    return f'respuestas:{recurso}:version'
+
+
+def _version(cache, recurso):
+    # Version aleatoria: si la clave se expulsa de la cache se abre un espacio nuevo
+    # en lugar de reutilizar una version anterior con respuestas viejas
+    clave = _clave_version(recurso)
+    version = cache.get(clave)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(clave, version, timeout=None):
+            version = cache.get(clave, version)
+    return version
+
+
+def invalidar(*recursos, using=None):
+    """
+    Descarta las respuestas cacheadas de los recursos indicados al confirmar la
+    transaccion en curso de la base using (de inmediato fuera de una transaccion).
+    Antes del COMMIT una lectura concurrente veria la fila anterior y la guardaria
+    con la version nueva.
+    """
+    def incrementar():
+        cache = _cache()
+        for recurso in recursos:
+            cache.set(_clave_version(recurso), uuid.uuid4().hex, timeout=None)
+
+    transaction.on_commit(incrementar, using=using)
+
+
+def invalidar_modelo(modelo, using=None):
+    invalidar(*DEPENDENCIAS.get(modelo.__name__, []), using=using or router.db_for_write(modelo))
+
+
+def calcular_etag(data):
+    contenido = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    return '"' + hashlib.md5(contenido).hexdigest() + '"'
+
+
+class RespuestaCacheadaMixin:
+    """
+    Cachea las respuestas de list y retrieve por recurso, usuario y query params,
+    y responde 304 cuando If-None-Match coincide con el ETag.
+    Las escrituras invalidan el recurso incrementando su version (ver api.signals).
+    """
+    cache_recurso = None
+
+    def list(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().retrieve, request, *args, **kwargs)
+
+    def cache_scope(self, request):
+        return request.user.pk
+
+    def _respuesta_cacheada(self, vista, request, *args, **kwargs):
+        cache = _cache()
+        version = _version(cache, self.cache_recurso)
+        ruta = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        clave = f'respuestas:{self.cache_recurso}:{version}:{self.cache_scope(request)}:{ruta}'
+
+        guardada = cache.get(clave)
+        if guardada is None:
+            response = vista(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            guardada = (response.data, calcular_etag(response.data))
+            cache.set(clave, guardada, timeout=getattr(settings, 'RESPUESTAS_CACHE_TTL', 300))
+
+        data, etag = guardada
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -0,0 +1,174 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.response import Response
+
+from . import metricas
+
+
+class FilaSerializada(dict):
+    """
+    Fila que ya esta en su representacion final (p. ej. leida del archivo de eventos).
+    Los serializers solo le quitan los campos no pedidos.
+    """
+
+
+def podar_fila(fila, serializer):
+    return {nombre: fila[nombre] for nombre, campo in serializer.fields.items()
+            if not campo.write_only and nombre in fila}
+
+
+def campos_de_peticion(query_params):
+    """Devuelve (fields, omit) de ?fields=a,b&omit=c; fields es None si no se indico"""
+    fields = query_params.get('fields')
+    omit = query_params.get('omit')
+    return (
+        {nombre for nombre in fields.split(',') if nombre} if fields else None,
+        {nombre for nombre in omit.split(',') if nombre} if omit else set(),
+    )
+
+
+def podar_campos(campos, fields, omit):
+    """Quita de un dict de campos de serializer los no pedidos o excluidos"""
+    for nombre in list(campos):
+        if (fields is not None and nombre not in fields) or nombre in omit:
+            campos.pop(nombre)
+
+
+def _ruta_de_campo(modelo, campo):
+    """Ruta ORM ('departamento__nombre') que alimenta un campo, o None si no es una columna"""
+    if isinstance(campo, (serializers.SerializerMethodField, serializers.BaseSerializer)):
+        return None
+    if campo.source == '*':
+        return None
+
+    actual = modelo
+    ultimo = len(campo.source_attrs) - 1
+    for i, parte in enumerate(campo.source_attrs):
+        try:
+            field = actual._meta.get_field(parte)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.many_to_many:
+            return None
+        if i < ultimo:
+            if not field.is_relation:
+                return None
+            actual = field.related_model
+        elif field.is_relation and not isinstance(campo, serializers.PrimaryKeyRelatedField):
+            return None
+    return '__'.join(campo.source_attrs)
+
+
+def rutas_de_lectura(serializer):
+    """
+    {nombre del campo: ruta ORM} para los campos legibles del serializer, o None si
+    alguno no sale directo de una columna (SerializerMethodField, serializers anidados).
+    """
+    modelo = serializer.Meta.model
+    rutas = {}
+    for nombre, campo in serializer.fields.items():
+        if campo.write_only:
+            continue
+        ruta = _ruta_de_campo(modelo, campo)
+        if ruta is None:
+            return None
+        rutas[nombre] = ruta
+    return rutas
+
+
+def _relaciones(ruta):
+    partes = ruta.split('__')
+    return ['__'.join(partes[:i]) for i in range(1, len(partes))]
+
+
+def columnas_de_lectura(rutas, extra=()):
+    """Columnas a leer: las de los campos, las FK que recorren y 'id'"""
+    columnas = {'id', *extra}
+    for ruta in rutas.values():
+        columnas.add(ruta)
+        columnas.update(_relaciones(ruta))
+    return columnas
+
+
+def podar_queryset(queryset, rutas, extra=()):
+    """Restringe el queryset a las columnas y joins de los campos elegidos"""
+    relaciones = {relacion for ruta in rutas.values() for relacion in _relaciones(ruta)}
+    return queryset.select_related(None).select_related(*relaciones).only(
+        *columnas_de_lectura(rutas, extra)
+    )
+
+
+def serializar_filas(filas, serializer, rutas):
+    """
+    Serializa filas de .values() con el mismo resultado que serializer(many=True),
+    usando to_representation de cada campo pero sin instanciar modelos.
+    """
+    campos = []
+    for nombre, ruta in rutas.items():
+        campo = serializer.fields[nombre]
+        # Las FK llegan como id, que es lo que devuelve PrimaryKeyRelatedField
+        representar = None if isinstance(campo, serializers.RelatedField) else campo.to_representation
+        campos.append((nombre, ruta, _relaciones(ruta), representar, campo))
+
+    datos = []
+    for fila in filas:
+        if isinstance(fila, FilaSerializada):
+            datos.append(podar_fila(fila, serializer))
+            continue
+        item = {}
+        for nombre, ruta, relaciones, representar, campo in campos:
+            valor = fila[ruta]
+            if valor is None:
+                if any(fila[relacion] is None for relacion in relaciones):
+                    # Igual que DRF cuando la relacion intermedia es nula: sin default
+                    # ni allow_null el campo se omite
+                    if campo.default is not empty:
+                        item[nombre] = campo.get_default()
+                    elif campo.allow_null:
+                        item[nombre] = None
+                    continue
+                item[nombre] = None
+            else:
+                item[nombre] = representar(valor) if representar else valor
+        datos.append(item)
+    return datos
+
+
+class CamposDinamicosViewMixin:
+    """
+    Aplica ?fields= / ?omit= tambien a la consulta: list y retrieve leen solo las
+    columnas y joins de los campos elegidos. Si todos los campos salen de columnas
+    del modelo, list serializa filas de .values() sin instanciar modelos.
+    """
+
+    def _columnas_extra(self):
+        # La paginacion keyset necesita su campo para armar el cursor
+        campo = getattr(self.paginator, 'keyset_field', None)
+        return (campo,) if campo else ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve') or self.request.method != 'GET':
+            return queryset
+        fields, omit = campos_de_peticion(self.request.query_params)
+        if fields is None and not omit:
+            return queryset
+        rutas = rutas_de_lectura(self.get_serializer())
+        if rutas is None:
+            return queryset
+        return podar_queryset(queryset, rutas, self._columnas_extra())
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        rutas = rutas_de_lectura(serializer)
+        if rutas is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        filas = queryset.values(*columnas_de_lectura(rutas, self._columnas_extra()))
+        page = self.paginate_queryset(filas)
+        if page is not None:
+            data = metricas.medir_serializacion(serializar_filas, page, serializer, rutas)
+            return self.get_paginated_response(data)
+        return Response(metricas.medir_serializacion(serializar_filas, filas, serializer, rutas))
@@ -0,0 +1,536 @@
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import (
+    IntegrityError, InterfaceError, OperationalError, close_old_connections, connections, router, transaction
+)
+from django.utils import timezone
+
+from . import metricas, shards, tiempo_real
+from .models import Evento, MarcaAgua
+from .resumenes import registrar_eventos
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = ('tipo', 'descripcion', 'sensor_id', 'barrera_id', 'usuario_id', 'metadata')
+
+# Marca (MarcaAgua.nombre, unico) que se inserta con cada lote en la misma transaccion.
+# El lote empieza con el id del diario: las marcas de un diario se reconocen aunque
+# varios compartan la base (ver DiarioEventos._barrer_marcas)
+PREFIJO_MARCA = 'diario:'
+# Marca que guardar_eventos inserta en la transaccion de la accion: si existe, la
+# accion se confirmo (ver DiarioEventos._sin_confirmar)
+PREFIJO_TRANSACCION = 'diario-tx:'
+
+# Errores de la base no disponible: el lote se reintenta sin contar intentos
+ERRORES_TRANSITORIOS = (OperationalError, InterfaceError)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS pendientes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lote TEXT,
+    reclamado REAL,
+    datos TEXT NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    transaccion TEXT,
+    confirmado INTEGER NOT NULL DEFAULT 1,
+    agregado REAL
+);
+CREATE INDEX IF NOT EXISTS pendientes_lote ON pendientes (lote, reclamado);
+CREATE TABLE IF NOT EXISTS descartados (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    datos TEXT NOT NULL,
+    error TEXT NOT NULL,
+    descartado REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+"""
+INDICES_POSTERIORES = """
+CREATE INDEX IF NOT EXISTS pendientes_confirmado ON pendientes (confirmado, agregado);
+"""
+
+# Columnas agregadas despues de la primera version del diario
+COLUMNAS_POSTERIORES = {
+    'intentos': 'INTEGER NOT NULL DEFAULT 0',
+    'transaccion': 'TEXT',
+    'confirmado': 'INTEGER NOT NULL DEFAULT 1',
+    'agregado': 'REAL',
+}
+
+
+def _a_fila(evento):
+    datos = {campo: getattr(evento, campo) for campo in CAMPOS}
+    # isoformat propio: DjangoJSONEncoder recorta a milisegundos
+    datos['timestamp'] = evento.timestamp.isoformat()
+    return (json.dumps(datos, cls=DjangoJSONEncoder),)
+
+
+def _a_evento(datos):
+    datos = json.loads(datos)
+    datos['timestamp'] = datetime.fromisoformat(datos['timestamp'])
+    return Evento(**datos)
+
+
+class DiarioEventos:
+    """
+    Diario local (SQLite en modo WAL) de eventos aceptados y todavia no insertados en
+    la base. agregar() confirma con fsync antes de volver, por lo que un evento
+    aceptado sobrevive a la caida del proceso o del servidor; un hilo por proceso los
+    inserta por lotes con bulk_create. Varios procesos pueden compartir el archivo.
+
+    Cada lote se reclama en el diario con un identificador y se inserta junto con una
+    MarcaAgua 'diario:<lote>'. Si el proceso cae entre insertar y borrar el lote del
+    diario, la marca indica que ya esta en la base y no se duplica (exactamente una vez).
+
+    Un lote que falla por otro motivo que la base no disponible (p. ej. un sensor
+    borrado) suma un intento; a los `intentos` se parte en lotes de una fila, y la
+    fila que agota sus intentos pasa a la tabla descartados, asi una fila invalida
+    no frena al resto del diario.
+    """
+
+    def __init__(self, ruta, maximo=100000, lote=500, intervalo=0.5, abandono=60, intentos=5):
+        self.ruta = Path(ruta)
+        self.maximo = maximo
+        self.lote = lote
+        self.intervalo = intervalo
+        self.abandono = abandono
+        self.intentos = intentos
+        self._local = threading.local()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._id = None
+        self._barrido = 0
+
+    @property
+    def id(self):
+        """Identificador de este archivo de diario (8 caracteres hex, se crea con el archivo)"""
+        self._conexion()
+        return self._id
+
+    def _nuevo_lote(self):
+        return self.id + uuid.uuid4().hex[:24]
+
+    def _conexion(self):
+        # sqlite3 no permite compartir conexiones entre hilos
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            self.ruta.parent.mkdir(parents=True, exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            # FULL: cada COMMIT sincroniza el WAL en disco
+            conexion.execute('PRAGMA synchronous=FULL')
+            conexion.executescript(ESQUEMA)
+            self._migrar(conexion)
+            conexion.execute("INSERT OR IGNORE INTO meta (clave, valor) VALUES ('id', ?)", [uuid.uuid4().hex[:8]])
+            self._id = conexion.execute("SELECT valor FROM meta WHERE clave = 'id'").fetchone()[0]
+            self._local.conexion = conexion
+        return conexion
+
+    def _migrar(self, conexion):
+        # Diarios creados por versiones anteriores
+        columnas = {fila[1] for fila in conexion.execute('PRAGMA table_info(pendientes)')}
+        for columna, tipo in COLUMNAS_POSTERIORES.items():
+            if columna not in columnas:
+                try:
+                    conexion.execute(f'ALTER TABLE pendientes ADD COLUMN {columna} {tipo}')
+                except sqlite3.OperationalError:
+                    # Otro proceso la agrego primero
+                    pass
+        conexion.executescript(INDICES_POSTERIORES)
+
+    @contextmanager
+    def _transaccion(self):
+        conexion = self._conexion()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            yield conexion
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        conexion.execute('COMMIT')
+
+    def pendientes(self, conexion=None):
+        """Eventos en el diario (cota superior: los ids son consecutivos y se borran en orden)"""
+        conexion = conexion or self._conexion()
+        return conexion.execute('SELECT COALESCE(MAX(id) - MIN(id) + 1, 0) FROM pendientes').fetchone()[0]
+
+    def descartados(self):
+        """Eventos que agotaron sus intentos: [(datos, error)]"""
+        return list(self._conexion().execute('SELECT datos, error FROM descartados ORDER BY id'))
+
+    def reencolar_descartados(self):
+        """Devuelve los descartados a pendientes, con los intentos en cero. Devuelve la cantidad"""
+        with self._transaccion() as conexion:
+            conexion.execute('INSERT INTO pendientes (datos) SELECT datos FROM descartados ORDER BY id')
+            return conexion.execute('DELETE FROM descartados').rowcount
+
+    def agregar(self, eventos, transaccion=None):
+        """
+        Guarda en el diario eventos sin insertar (asigna timestamp si no lo tienen).
+        Devuelve False sin guardar nada si el diario esta lleno; en ese caso el
+        llamador debe insertarlos directamente.
+
+        Con transaccion los eventos quedan sin confirmar hasta confirmar(transaccion):
+        se guardan (con fsync) antes del COMMIT de la accion, pero no se escriben en
+        la base mientras la accion pueda hacer rollback.
+        """
+        for evento in eventos:
+            if evento.timestamp is None:
+                evento.timestamp = timezone.now()
+        confirmado = int(transaccion is None)
+        agregado = time.time()
+        filas = [(*_a_fila(evento), transaccion, confirmado, agregado) for evento in eventos]
+        with self._transaccion() as conexion:
+            pendientes = self.pendientes(conexion)
+            if pendientes + len(filas) > self.maximo:
+                metricas.registro.incrementar('api_diario_directos_total', len(filas))
+                return False
+            conexion.executemany(
+                'INSERT INTO pendientes (datos, transaccion, confirmado, agregado) VALUES (?, ?, ?, ?)', filas
+            )
+        if confirmado and pendientes + len(filas) >= self.lote:
+            self._despertar.set()
+        return True
+
+    def confirmar(self, transaccion):
+        """La accion de agregar(..., transaccion) hizo COMMIT: sus eventos ya se pueden escribir"""
+        with self._transaccion() as conexion:
+            conexion.execute('UPDATE pendientes SET confirmado = 1 WHERE transaccion = ?', [transaccion])
+
+    def _sin_confirmar(self):
+        """
+        Resuelve los eventos cuya confirmacion no llego en self.abandono segundos
+        (proceso caido entre el COMMIT de la accion y confirmar, o rollback): si la
+        marca de su transaccion esta en la base la accion confirmo y se escriben; si
+        no, la accion hizo rollback y se descartan.
+        """
+        filas = list(self._conexion().execute(
+            'SELECT transaccion, datos FROM pendientes WHERE confirmado = 0 AND agregado <= ?',
+            [time.time() - self.abandono]
+        ))
+        if not filas:
+            return
+        por_shard = {}
+        for transaccion, datos in filas:
+            alias = shards.alias_de_id(json.loads(datos)['sensor_id'])
+            por_shard.setdefault(alias, set()).add(PREFIJO_TRANSACCION + transaccion)
+        confirmadas = set()
+        for alias, marcas in por_shard.items():
+            with shards.usar(alias):
+                confirmadas.update(
+                    nombre[len(PREFIJO_TRANSACCION):]
+                    for nombre in MarcaAgua.objects.filter(nombre__in=marcas).values_list('nombre', flat=True)
+                )
+        descartadas = {transaccion for transaccion, _ in filas} - confirmadas
+        with self._transaccion() as conexion:
+            conexion.executemany(
+                'UPDATE pendientes SET confirmado = 1 WHERE transaccion = ?', [(t,) for t in confirmadas]
+            )
+            conexion.executemany(
+                'DELETE FROM pendientes WHERE transaccion = ? AND confirmado = 0', [(t,) for t in descartadas]
+            )
+        if descartadas:
+            logger.warning('%d transacciones sin COMMIT descartadas del diario', len(descartadas))
+
+    def _reclamar(self):
+        lote = self._nuevo_lote()
+        with self._transaccion() as conexion:
+            conexion.execute(
+                'UPDATE pendientes SET lote = ?, reclamado = ? WHERE id IN '
+                '(SELECT id FROM pendientes WHERE lote IS NULL AND confirmado = 1 ORDER BY id LIMIT ?)',
+                [lote, time.time(), self.lote]
+            )
+            filas = conexion.execute(
+                'SELECT id, datos, transaccion FROM pendientes WHERE lote = ? ORDER BY id', [lote]
+            )
+            return lote, list(filas)
+
+    def _abandonados(self):
+        """Lotes reclamados que no terminaron (proceso caido o error), reclamados de nuevo"""
+        with self._transaccion() as conexion:
+            lotes = [lote for lote, in conexion.execute(
+                'SELECT DISTINCT lote FROM pendientes WHERE lote IS NOT NULL AND reclamado < ?',
+                [time.time() - self.abandono]
+            )]
+            conexion.executemany(
+                'UPDATE pendientes SET reclamado = ? WHERE lote = ?', [(time.time(), lote) for lote in lotes]
+            )
+        for lote in lotes:
+            filas = self._conexion().execute(
+                'SELECT id, datos, transaccion FROM pendientes WHERE lote = ? ORDER BY id', [lote]
+            )
+            yield lote, list(filas)
+
+    def _escribir(self, lote, filas):
+        """
+        Inserta un lote reclamado [(id, datos, transaccion)]. Si la base no esta disponible libera
+        el lote y relanza el error; otro error cuenta un intento del lote (ver
+        _fallido) y devuelve 0 para seguir con los demas.
+        """
+        inicio = time.perf_counter()
+        marca = PREFIJO_MARCA + lote
+        grupos = {}
+        creados = {}
+        try:
+            eventos = [(pk, _a_evento(datos), transaccion) for pk, datos, transaccion in filas]
+            # Con SHARDS una transaccion (y una marca) por shard del lote
+            grupos = shards.agrupar(eventos, lambda item: shards.alias_de_id(item[1].sensor_id))
+            for alias, items in grupos.items():
+                with shards.usar(alias):
+                    creados[alias] = self._escribir_en_shard(
+                        marca,
+                        [evento for _, (_, evento, _) in items],
+                        {transaccion for _, (_, _, transaccion) in items if transaccion is not None}
+                    )
+        except ERRORES_TRANSITORIOS:
+            self._liberar(lote)
+            raise
+        except Exception as exc:
+            metricas.registro.incrementar('api_diario_errores_total')
+            logger.exception('No se pudo escribir el lote %s del diario (%d eventos)', lote, len(filas))
+            escritas = {pk for alias in creados for _, (pk, _, _) in grupos[alias]}
+            if self._fallido(lote, filas, escritas, exc):
+                self._borrar_marcas(marca, creados)
+            return 0
+        except BaseException:
+            self._liberar(lote)
+            raise
+
+        with self._transaccion() as conexion:
+            conexion.execute('DELETE FROM pendientes WHERE lote = ?', [lote])
+        self._borrar_marcas(marca, creados)
+        for alias, creados_shard in creados.items():
+            with shards.usar(alias):
+                tiempo_real.publicar_eventos(creados_shard)
+
+        total = sum(len(creados_shard) for creados_shard in creados.values())
+        metricas.registro.observar_interno('api_diario_vaciado_segundos', time.perf_counter() - inicio)
+        metricas.registro.incrementar('api_diario_eventos_total', total)
+        return total
+
+    def _liberar(self, lote):
+        # Se reintenta en el proximo ciclo con el mismo lote (y la misma marca);
+        # los shards ya escritos lo saltean por la marca
+        with self._transaccion() as conexion:
+            conexion.execute('UPDATE pendientes SET reclamado = 0 WHERE lote = ?', [lote])
+
+    def _fallido(self, lote, filas, escritas, exc):
+        """
+        Suma un intento al lote y lo libera. Al llegar a self.intentos, un lote de
+        varias filas se parte en lotes de una sin las filas ya escritas (de shards
+        que si confirmaron) y devuelve True; una fila sola pasa a descartados.
+        """
+        with self._transaccion() as conexion:
+            conexion.execute(
+                'UPDATE pendientes SET reclamado = 0, intentos = intentos + 1 WHERE lote = ?', [lote]
+            )
+            intentos = conexion.execute(
+                'SELECT MAX(intentos) FROM pendientes WHERE lote = ?', [lote]
+            ).fetchone()[0]
+            if intentos is None or intentos < self.intentos:
+                return False
+            if len(filas) > 1:
+                conexion.executemany('DELETE FROM pendientes WHERE id = ?', [(pk,) for pk in escritas])
+                conexion.executemany(
+                    'UPDATE pendientes SET lote = ?, reclamado = 0, intentos = 0 WHERE id = ?',
+                    [(self._nuevo_lote(), pk) for pk, *_ in filas if pk not in escritas]
+                )
+                logger.warning('Lote %s del diario partido en filas tras %d intentos', lote, intentos)
+                return True
+            conexion.execute(
+                'INSERT INTO descartados (datos, error, descartado) '
+                'SELECT datos, ?, ? FROM pendientes WHERE lote = ?',
+                [repr(exc), time.time(), lote]
+            )
+            conexion.execute('DELETE FROM pendientes WHERE lote = ?', [lote])
+        metricas.registro.incrementar('api_diario_descartados_total')
+        logger.error('Evento descartado del diario tras %d intentos: %s', intentos, filas[0][1])
+        return False
+
+    def _borrar_marcas(self, marca, creados):
+        for alias in creados:
+            with shards.usar(alias):
+                MarcaAgua.objects.filter(nombre=marca).delete()
+
+    def _barrer_marcas(self):
+        """
+        Borra las marcas de lotes de este diario que ya no estan en pendientes: el
+        proceso cayo entre borrar el lote del diario y borrar sus marcas. Las marcas
+        se leen antes que los lotes, asi un lote reclamado entre ambas lecturas no
+        pierde la suya. Devuelve la cantidad de marcas borradas.
+        """
+        prefijo = PREFIJO_MARCA + self.id
+        marcas = {}
+        for alias in shards.todos():
+            with shards.usar(alias):
+                marcas[alias] = list(
+                    MarcaAgua.objects.filter(nombre__startswith=prefijo).values_list('nombre', flat=True)
+                )
+        if not any(marcas.values()):
+            return 0
+        lotes = {
+            PREFIJO_MARCA + lote
+            for lote, in self._conexion().execute('SELECT DISTINCT lote FROM pendientes WHERE lote IS NOT NULL')
+        }
+        borradas = 0
+        for alias, nombres in marcas.items():
+            huerfanas = [nombre for nombre in nombres if nombre not in lotes]
+            if huerfanas:
+                with shards.usar(alias):
+                    borradas += MarcaAgua.objects.filter(nombre__in=huerfanas).delete()[0]
+        if borradas:
+            logger.warning('%d marcas de lotes huerfanas borradas', borradas)
+        return borradas
+
+    def _escribir_en_shard(self, marca, eventos, transacciones):
+        try:
+            with transaction.atomic(using=router.db_for_write(Evento)):
+                # La marca va primero: si otro proceso ya inserto (o esta insertando)
+                # el lote, el indice unico hace fallar esta transaccion sin duplicar
+                MarcaAgua.objects.create(nombre=marca, valor=timezone.now())
+                # Las marcas de las acciones ya no hacen falta (ver _sin_confirmar)
+                if transacciones:
+                    MarcaAgua.objects.filter(
+                        nombre__in=[PREFIJO_TRANSACCION + transaccion for transaccion in transacciones]
+                    ).delete()
+                # Cada evento lleva el timestamp de la accion (ver Evento.timestamp)
+                creados = Evento.objects.bulk_create(eventos, batch_size=self.lote)
+                registrar_eventos(creados)
+        except IntegrityError:
+            if not MarcaAgua.objects.filter(nombre=marca).exists():
+                raise
+            return []
+        return creados
+
+    def vaciar(self):
+        """Inserta en la base todo lo pendiente, incluidos lotes abandonados. Devuelve la cantidad"""
+        total = 0
+        self._sin_confirmar()
+        # Las marcas huerfanas solo ocupan lugar: se barren cada self.abandono segundos
+        if time.time() - self._barrido >= self.abandono:
+            self._barrer_marcas()
+            self._barrido = time.time()
+        for lote, filas in self._abandonados():
+            total += self._escribir(lote, filas)
+        while True:
+            lote, filas = self._reclamar()
+            if not filas:
+                return total
+            total += self._escribir(lote, filas)
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._ejecutar, name='diario-eventos', daemon=True)
+        self._hilo.start()
+
+    def _ejecutar(self):
+        espera = self.intervalo
+        while not self._detener.is_set():
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            try:
+                close_old_connections()
+                self.vaciar()
+                espera = self.intervalo
+            except Exception:
+                metricas.registro.incrementar('api_diario_errores_total')
+                logger.exception('No se pudo vaciar el diario de eventos')
+                connections.close_all()
+                # Espera creciente mientras la base no responde
+                espera = min(espera * 2, 30)
+
+    def detener(self, timeout=10):
+        """Detiene el hilo y escribe lo pendiente; si la base no responde queda en el diario"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+        try:
+            return self.vaciar()
+        except Exception:
+            logger.exception('Eventos pendientes en %s; se escriben al reiniciar', self.ruta)
+            return 0
+
+
+_diario = None
+_lock = threading.Lock()
+
+
+def get_diario():
+    """Diario del proceso (inicia su hilo la primera vez), o None si EVENTOS_DIARIO no esta definido"""
+    global _diario
+    if not getattr(settings, 'EVENTOS_DIARIO', None):
+        return None
+    if _diario is None:
+        with _lock:
+            if _diario is None:
+                diario = DiarioEventos(
+                    settings.EVENTOS_DIARIO,
+                    maximo=getattr(settings, 'EVENTOS_DIARIO_MAX', 100000),
+                    lote=getattr(settings, 'EVENTOS_DIARIO_LOTE', 500),
+                    intervalo=getattr(settings, 'EVENTOS_DIARIO_INTERVALO', 0.5),
+                    intentos=getattr(settings, 'EVENTOS_DIARIO_INTENTOS', 5),
+                )
+                diario.iniciar()
+                atexit.register(diario.detener)
+                metricas.registro.indicador(
+                    'api_diario_pendientes', 'Eventos en el diario sin insertar en la base', diario.pendientes
+                )
+                _diario = diario
+    return _diario
+
+
+def guardar_eventos(eventos):
+    """
+    Registra eventos nuevos de una accion: al diario si EVENTOS_DIARIO esta activo y
+    tiene lugar, y si no los inserta en el momento (con resumenes y tiempo real).
+
+    Dentro de una transaccion los eventos se guardan en el diario (con fsync) antes
+    del COMMIT, sin confirmar, junto con una marca de la transaccion en la base; al
+    confirmar se habilitan para el vaciado. Si el proceso cae despues del COMMIT la
+    marca indica que la accion confirmo; si la accion hace rollback la marca no
+    existe y el vaciado los descarta.
+    """
+    diario = get_diario()
+    if diario is None:
+        return _insertar(eventos)
+    alias = router.db_for_write(Evento)
+    transaccion = uuid.uuid4().hex if transaction.get_connection(alias).in_atomic_block else None
+    if not diario.agregar(eventos, transaccion):
+        return _insertar(eventos)
+    if transaccion is not None:
+        MarcaAgua.objects.create(nombre=PREFIJO_TRANSACCION + transaccion, valor=timezone.now())
+        transaction.on_commit(lambda: _confirmar(diario, transaccion), using=alias)
+    return eventos
+
+
+def _confirmar(diario, transaccion):
+    # La accion ya confirmo: un error aqui no debe convertirse en un 500
+    try:
+        diario.confirmar(transaccion)
+    except Exception:
+        logger.exception('No se pudo confirmar %s en el diario; se resuelve al vaciar', transaccion)
+
+
+def _insertar(eventos):
+    if len(eventos) == 1:
+        # save() emite post_save, que actualiza resumenes y publica el evento
+        eventos[0].save(force_insert=True)
+        return eventos
+    creados = Evento.objects.bulk_create(eventos, batch_size=500)
+    registrar_eventos(creados)
+    tiempo_real.publicar_eventos(creados)
+    return creados
@@ -0,0 +1,53 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .pagination import iterar_por_keyset
+
+# Columnas exportadas y su origen (los *_nombre se leen por JOIN)
+COLUMNAS_EVENTO = [
+    ('id', 'id'),
+    ('tipo', 'tipo'),
+    ('descripcion', 'descripcion'),
+    ('sensor', 'sensor_id'),
+    ('sensor_nombre', 'sensor__nombre'),
+    ('barrera', 'barrera_id'),
+    ('barrera_nombre', 'barrera__nombre'),
+    ('usuario', 'usuario_id'),
+    ('usuario_nombre', 'usuario__user__username'),
+    ('timestamp', 'timestamp'),
+    ('metadata', 'metadata'),
+]
+
+
+class _Eco:
+    """Pseudo-buffer para csv.writer: devuelve la linea en lugar de acumularla"""
+
+    def write(self, valor):
+        return valor
+
+
+def _filas(queryset, chunk_size, archivados=()):
+    campos = [campo for _, campo in COLUMNAS_EVENTO]
+    for fila in iterar_por_keyset(queryset.values(*campos), 'timestamp', chunk_size):
+        fila = {nombre: fila[campo] for nombre, campo in COLUMNAS_EVENTO}
+        fila['timestamp'] = timezone.localtime(fila['timestamp']).isoformat()
+        yield fila
+    # Filas ya serializadas del archivo de eventos (mas antiguas que las de la tabla)
+    for fila in archivados:
+        yield {nombre: fila.get(nombre) for nombre, _ in COLUMNAS_EVENTO}
+
+
+def eventos_csv(queryset, chunk_size=2000, archivados=()):
+    writer = csv.writer(_Eco())
+    yield writer.writerow([nombre for nombre, _ in COLUMNAS_EVENTO])
+    for fila in _filas(queryset, chunk_size, archivados):
+        fila['metadata'] = json.dumps(fila['metadata'], cls=DjangoJSONEncoder)
+        yield writer.writerow(fila.values())
+
+
+def eventos_ndjson(queryset, chunk_size=2000, archivados=()):
+    for fila in _filas(queryset, chunk_size, archivados):
+        yield json.dumps(fila, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,125 @@
+import re
+
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.lookups import Exact
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Sensor, Evento
+
+TIPOS_EVENTO = {tipo for tipo, _ in Evento.TIPO_CHOICES}
+# Solo claves simples (metadata__x__regex no es un filtro valido). El nombre siempre es
+# una clave: metadata__isnull o metadata__contains filtran las claves isnull y contains
+METADATA_PARAM = re.compile(r'^metadata__([A-Za-z0-9]+(?:_[A-Za-z0-9]+)*)$')
+
+
+def fecha_param(params, nombre):
+    valor = params.get(nombre)
+    if not valor:
+        return None
+    try:
+        fecha = parse_datetime(valor)
+    except ValueError:
+        # Bien formada pero fuera de rango (mes 13, dia 32, ...)
+        fecha = None
+    if fecha is None:
+        raise ValidationError({nombre: 'Fecha invalida, use ISO 8601'})
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+def entero_param(params, nombre):
+    valor = params.get(nombre)
+    if not valor:
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValidationError({nombre: 'Debe ser un entero'})
+
+
+def lista_enteros_param(params, nombre):
+    valor = params.get(nombre)
+    if not valor:
+        return None
+    try:
+        return [int(v) for v in valor.split(',') if v]
+    except ValueError:
+        raise ValidationError({nombre: 'Debe ser una lista de enteros separada por comas'})
+
+
+def tipos_param(params, nombre):
+    valor = params.get(nombre)
+    if not valor:
+        return None
+    tipos = [t for t in valor.split(',') if t]
+    invalidos = set(tipos) - TIPOS_EVENTO
+    if invalidos:
+        raise ValidationError({nombre: f'Tipos invalidos: {", ".join(sorted(invalidos))}'})
+    return tipos
+
+
+def metadata_params(params):
+    """[(clave, valor)] de los params metadata__<clave>=<valor>; 400 si la clave no es simple"""
+    filtros = []
+    for param in params:
+        if not param.startswith('metadata__'):
+            continue
+        clave = METADATA_PARAM.match(param)
+        if clave is None:
+            raise ValidationError({param: 'Clave de metadata invalida (letras, numeros y _)'})
+        filtros.append((clave.group(1), params.get(param)))
+    return filtros
+
+
+def filtrar_eventos(queryset, params):
+    """
+    Aplica los filtros de query params sobre un queryset de Evento.
+
+    Soporta tipo, tipo__in, sensor, sensor__in, barrera, departamento,
+    desde/hasta (timestamp ISO 8601) y metadata__<clave>=<valor>.
+    """
+    tipo = params.get('tipo')
+    if tipo:
+        queryset = queryset.filter(tipo=tipo)
+
+    tipos = tipos_param(params, 'tipo__in')
+    if tipos is not None:
+        queryset = queryset.filter(tipo__in=tipos)
+
+    sensor_id = entero_param(params, 'sensor')
+    if sensor_id is not None:
+        queryset = queryset.filter(sensor_id=sensor_id)
+
+    sensores = lista_enteros_param(params, 'sensor__in')
+    if sensores is not None:
+        queryset = queryset.filter(sensor_id__in=sensores)
+
+    barrera_id = entero_param(params, 'barrera')
+    if barrera_id is not None:
+        queryset = queryset.filter(barrera_id=barrera_id)
+
+    departamento_id = entero_param(params, 'departamento')
+    if departamento_id is not None:
+        # Subconsulta sobre sensores(departamento_id, estado) en lugar de un JOIN,
+        # para que eventos siga usando el indice (sensor_id, timestamp)
+        queryset = queryset.filter(
+            sensor_id__in=Sensor.objects.filter(departamento_id=departamento_id).values('id')
+        )
+
+    desde = fecha_param(params, 'desde')
+    if desde is not None:
+        queryset = queryset.filter(timestamp__gte=desde)
+
+    hasta = fecha_param(params, 'hasta')
+    if hasta is not None:
+        queryset = queryset.filter(timestamp__lt=hasta)
+
+    for clave, valor in metadata_params(params):
+        # Con filter(metadata__<clave>=...) una clave con nombre de lookup del JSONField
+        # (isnull, contains, has_key, gt, regex, ...) se aplicaria como lookup
+        queryset = queryset.filter(Exact(KeyTextTransform(clave, 'metadata'), valor))
+
+    return queryset
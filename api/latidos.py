@@ -0,0 +1,134 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import cache, shards, tiempo_real
+from .models import Sensor
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def escribir_latidos(pendientes):
+    """
+    Aplica latidos acumulados {mac_address: (estado o None, timestamp)}.
+
+    Los sensores que solo reportan latido se actualizan con un bulk_update de
+    ultima_lectura y los que cambian de estado con otro que incluye estado, asi
+    un latido nunca pisa un cambio de estado hecho por otra via.
+    Devuelve la cantidad de sensores actualizados. Con SHARDS se aplican en todos los
+    shards en paralelo (cada MAC esta en uno solo).
+    """
+    actualizados = sum(shards.en_todos(lambda: _escribir_latidos(pendientes)))
+    if actualizados:
+        # bulk_update no emite post_save
+        cache.invalidar_modelo(Sensor)
+    if actualizados < len(pendientes):
+        logger.warning('Latidos descartados de %d MAC desconocidas', len(pendientes) - actualizados)
+    return actualizados
+
+
+def _escribir_latidos(pendientes):
+    filas = Sensor.objects.filter(mac_address__in=list(pendientes)).values_list(
+        'id', 'mac_address', 'estado', 'departamento_id'
+    )
+    ahora = timezone.now()
+    solo_latido = []
+    con_estado = []
+    cambios = []
+    for pk, mac_address, estado_actual, departamento_id in filas:
+        estado, timestamp = pendientes[mac_address]
+        if estado is None or estado == estado_actual:
+            solo_latido.append(Sensor(pk=pk, ultima_lectura=timestamp))
+        else:
+            con_estado.append(Sensor(pk=pk, ultima_lectura=timestamp, estado=estado, updated_at=ahora))
+            cambios.append((pk, departamento_id, estado, estado_actual))
+
+    with transaction.atomic(using=router.db_for_write(Sensor)):
+        if solo_latido:
+            Sensor.objects.bulk_update(solo_latido, ['ultima_lectura'], batch_size=BATCH_SIZE)
+        if con_estado:
+            Sensor.objects.bulk_update(
+                con_estado, ['ultima_lectura', 'estado', 'updated_at'], batch_size=BATCH_SIZE
+            )
+        for pk, departamento_id, estado, estado_anterior in cambios:
+            tiempo_real.publicar_estado('sensor', pk, departamento_id, estado, estado_anterior)
+
+    return len(solo_latido) + len(con_estado)
+
+
+class BufferLatidos:
+    """
+    Acumula latidos en memoria del proceso y los escribe juntos cada `ventana`
+    segundos (o al llegar a `maximo` sensores pendientes). Varios latidos del mismo
+    sensor dentro de la ventana cuestan una sola fila del UPDATE, por lo que las
+    escrituras dependen de la cantidad de sensores y no de la frecuencia de latido.
+
+    Con ventana 0 cada registro se escribe de inmediato. Los latidos pendientes
+    se pierden si el proceso termina de forma abrupta.
+    """
+
+    def __init__(self, ventana=2, maximo=5000):
+        self.ventana = ventana
+        self.maximo = maximo
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def registrar(self, latidos):
+        """latidos: iterable de (mac_address, estado o None, timestamp)"""
+        with self._lock:
+            for mac_address, estado, timestamp in latidos:
+                previo = self._pendientes.get(mac_address)
+                if previo is not None:
+                    # Gana el estado mas reciente informado y la lectura mas nueva
+                    estado = estado or previo[0]
+                    timestamp = max(timestamp, previo[1])
+                self._pendientes[mac_address] = (estado, timestamp)
+
+            lleno = len(self._pendientes) >= self.maximo
+            if not lleno and self.ventana and self._timer is None:
+                self._timer = threading.Timer(self.ventana, self._vaciar_en_segundo_plano)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if lleno or not self.ventana:
+            self.vaciar()
+
+    def vaciar(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pendientes:
+            return 0
+        return escribir_latidos(pendientes)
+
+    def _vaciar_en_segundo_plano(self):
+        try:
+            self.vaciar()
+        except Exception:
+            logger.exception('No se pudieron escribir los latidos')
+        finally:
+            # El timer corre en su propio hilo con su propia conexion
+            connections.close_all()
+
+
+_buffer = None
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        _buffer = BufferLatidos(
+            getattr(settings, 'LATIDOS_VENTANA', 2),
+            getattr(settings, 'LATIDOS_MAX_PENDIENTES', 5000),
+        )
+        atexit.register(_buffer.vaciar)
+    return _buffer
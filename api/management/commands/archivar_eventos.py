@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import archivo, particiones, shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Mueve los meses de eventos mas antiguos que --dias a archivos NDJSON comprimidos '
+        '(ARCHIVO_EVENTOS_DIR) y los quita de la tabla; la API los sigue sirviendo desde '
+        'el archivo. En MariaDB tambien crea las particiones mensuales de los proximos meses.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=365, help='Antiguedad minima de los meses a archivar')
+        parser.add_argument(
+            '--meses-adelante', type=int, default=2,
+            help='Particiones mensuales a mantener creadas por adelantado (MariaDB)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Solo listar los meses a archivar')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            creadas = [
+                nombre for creadas_shard in shards.en_todos(
+                    lambda: particiones.asegurar_particiones(options['meses_adelante'])
+                ) for nombre in creadas_shard
+            ]
+            if creadas:
+                self.stdout.write(f'Particiones creadas: {", ".join(creadas)}')
+
+        # Solo meses completos: el mes que contiene el corte queda en la tabla
+        corte = particiones.inicio_mes(timezone.now() - timedelta(days=options['dias']))
+        meses = sorted({
+            mes for meses_shard in shards.en_todos(lambda: particiones.meses_con_eventos(antes_de=corte))
+            for mes in meses_shard
+        })
+        if not meses:
+            self.stdout.write(f'No hay eventos anteriores a {corte:%Y-%m} para archivar')
+            return
+
+        # Del mas antiguo al mas nuevo: si uno falla los archivados quedan contiguos
+        for mes in meses:
+            if options['dry_run']:
+                self.stdout.write(f'{mes:%Y-%m}')
+                continue
+            inicio = time.perf_counter()
+            entrada = archivo.archivar_mes(mes, chunk_size=options['chunk_size'])
+            if entrada is None:
+                continue
+            self.stdout.write(
+                f'{entrada["mes"]}: {entrada["filas"]} eventos -> {entrada["archivo"]} '
+                f'({entrada["bytes"] / 1e6:.1f} MB) en {time.perf_counter() - inicio:.1f} s'
+            )
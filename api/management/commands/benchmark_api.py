@@ -0,0 +1,201 @@
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api import cache
+from api.models import Departamento, Sensor, Usuario, Barrera, Evento
+from api.tokens import SmartTokenObtainPairSerializer
+from api.management.commands.prueba_carga import percentil
+
+LINEA_BASE = Path(settings.BASE_DIR) / 'benchmarks' / 'linea_base.json'
+
+# nombre: (metodo, ruta, datos, estado previo de la barrera)
+# Las rutas usan los ids de la primera fila de cada modelo con el prefijo elegido
+ESCENARIOS = {
+    'departamentos-list': ('GET', '/api/departamentos/', None, None),
+    'departamentos-detail': ('GET', '/api/departamentos/{departamento}/', None, None),
+    'departamentos-sensores': ('GET', '/api/departamentos/{departamento}/sensores/', None, None),
+    'sensores-list': ('GET', '/api/sensores/', None, None),
+    'sensores-detail': ('GET', '/api/sensores/{sensor}/', None, None),
+    'sensores-cambiar_estado': ('POST', '/api/sensores/{sensor}/cambiar_estado/', 'estado', None),
+    'usuarios-list': ('GET', '/api/usuarios/', None, None),
+    'usuarios-detail': ('GET', '/api/usuarios/{usuario}/', None, None),
+    'barreras-list': ('GET', '/api/barreras/', None, None),
+    'barreras-detail': ('GET', '/api/barreras/{barrera}/', None, None),
+    'barreras-abrir': ('POST', '/api/barreras/{barrera}/abrir/', None, 'cerrada'),
+    'barreras-cerrar': ('POST', '/api/barreras/{barrera}/cerrar/', None, 'abierta'),
+    'eventos-list': ('GET', '/api/eventos/', None, None),
+    'eventos-detail': ('GET', '/api/eventos/{evento}/', None, None),
+    'eventos-barrera': ('GET', '/api/eventos/?barrera={barrera}', None, None),
+    'eventos-departamento': ('GET', '/api/eventos/?departamento={departamento}', None, None),
+    'eventos-estadisticas': ('GET', '/api/eventos/estadisticas/?granularidad=hora&agrupar=barrera', None, None),
+}
+
+ESTADOS_SENSOR = ['mantenimiento', 'activo']
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta cada endpoint del router y las acciones abrir/cerrar/cambiar_estado con '
+        'el cliente de pruebas sobre los datos de sembrar_datos, reporta percentiles de '
+        'latencia y consultas por peticion, y los compara con una linea base guardada. '
+        'Las escrituras se revierten al terminar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=50)
+        parser.add_argument('--calentamiento', type=int, default=5, help='Peticiones sin medir por escenario')
+        parser.add_argument('--prefijo', default='sim', help='Prefijo de los datos de sembrar_datos')
+        parser.add_argument('--escenario', action='append', help='Ejecutar solo estos escenarios')
+        parser.add_argument('--base', default=str(LINEA_BASE), help='Archivo JSON de la linea base')
+        parser.add_argument('--guardar', action='store_true', help='Guardar el resultado como linea base')
+        parser.add_argument(
+            '--tolerancia', type=float, default=0.5,
+            help='Aumento relativo del p50 aceptado frente a la linea base (0.5 = 50%%)'
+        )
+        parser.add_argument(
+            '--umbral-ms', type=float, default=2.0,
+            help='Diferencias de p50 menores a esto no cuentan como regresion'
+        )
+
+    def handle(self, *args, **options):
+        nombres = options['escenario'] or list(ESCENARIOS)
+        desconocidos = set(nombres) - set(ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f'Escenarios desconocidos: {", ".join(sorted(desconocidos))}')
+
+        ids = self.ids_de_prueba(options['prefijo'])
+        datos = {
+            'vendor': connection.vendor,
+            'eventos': Evento.objects.count(),
+            'sensores': Sensor.objects.count(),
+        }
+        self.stdout.write(
+            f'{connection.vendor}: {datos["eventos"]} eventos, {datos["sensores"]} sensores, '
+            f'{options["iteraciones"]} iteraciones por escenario'
+        )
+
+        with transaction.atomic():
+            client = self.cliente()
+            resultados = {
+                nombre: self.medir(client, nombre, ids, options['iteraciones'], options['calentamiento'])
+                for nombre in nombres
+            }
+            transaction.set_rollback(True)
+        for modelo in (Departamento, Sensor, Barrera):
+            cache.invalidar_modelo(modelo)
+
+        base = self.cargar_base(options['base'])
+        regresiones = self.reportar(resultados, base, options['tolerancia'], options['umbral_ms'])
+
+        if options['guardar']:
+            ruta = Path(options['base'])
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            ruta.write_text(json.dumps({'datos': datos, 'escenarios': resultados}, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Linea base guardada en {ruta}'))
+        elif base is not None:
+            if base.get('datos') != datos:
+                self.stdout.write(self.style.WARNING(
+                    f'La linea base se midio con otros datos: {base.get("datos")}'
+                ))
+            if regresiones:
+                raise CommandError('Regresiones: ' + '; '.join(regresiones))
+
+    def ids_de_prueba(self, prefijo):
+        barrera = Barrera.objects.filter(
+            nombre__startswith=f'{prefijo}-', sensor__isnull=False
+        ).order_by('id').values('id', 'sensor_id', 'departamento_id').first()
+        usuario = Usuario.objects.filter(
+            user__username__startswith=f'{prefijo}-'
+        ).order_by('id').values_list('id', flat=True).first()
+        if barrera is None or usuario is None:
+            raise CommandError(f'No hay datos con prefijo {prefijo!r}; ejecutar antes sembrar_datos')
+        evento = Evento.objects.filter(barrera_id=barrera['id']).values_list('id', flat=True).first()
+        if evento is None:
+            raise CommandError('La barrera de prueba no tiene eventos; sembrar con --eventos > 0')
+        return {
+            'departamento': barrera['departamento_id'],
+            'sensor': barrera['sensor_id'],
+            'usuario': usuario,
+            'barrera': barrera['id'],
+            'evento': evento,
+        }
+
+    def cliente(self):
+        """Cliente autenticado con un JWT real de un superusuario (se revierte con el resto)"""
+        user = User.objects.create_superuser('benchmark-admin', 'benchmark@example.com', None)
+        token = SmartTokenObtainPairSerializer.get_token(user).access_token
+        # SERVER_NAME dentro de ALLOWED_HOSTS sin setup_test_environment()
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    def medir(self, client, nombre, ids, iteraciones, calentamiento):
+        metodo, ruta, campo, estado_previo = ESCENARIOS[nombre]
+        ruta = ruta.format(**ids)
+        latencias = []
+        consultas = 0
+        for i in range(calentamiento + iteraciones):
+            # Sin cache de respuestas: se mide el costo real de cada peticion
+            cache.invalidar(*{recurso for recursos in cache.DEPENDENCIAS.values() for recurso in recursos})
+            if estado_previo is not None:
+                Barrera.objects.filter(pk=ids['barrera']).update(estado=estado_previo)
+            data = {campo: ESTADOS_SENSOR[i % 2]} if campo else None
+
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                if metodo == 'GET':
+                    response = client.get(ruta)
+                else:
+                    response = client.post(ruta, data, format='json')
+                duracion = time.perf_counter() - inicio
+            if response.status_code >= 400:
+                raise CommandError(f'{nombre}: {metodo} {ruta} respondio {response.status_code}')
+            if i >= calentamiento:
+                latencias.append(duracion)
+                consultas = max(consultas, len(ctx.captured_queries))
+
+        return {
+            'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+            'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+            'consultas': consultas,
+        }
+
+    def cargar_base(self, ruta):
+        ruta = Path(ruta)
+        if not ruta.exists():
+            return None
+        return json.loads(ruta.read_text())
+
+    def reportar(self, resultados, base, tolerancia, umbral_ms):
+        """Imprime la tabla y devuelve la lista de regresiones frente a la linea base"""
+        escenarios_base = base['escenarios'] if base else {}
+        regresiones = []
+        self.stdout.write(
+            f'{"escenario":<26} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"consultas":>9} {"vs base":>12}'
+        )
+        for nombre, resultado in resultados.items():
+            anterior = escenarios_base.get(nombre)
+            comparacion = ''
+            if anterior is not None:
+                comparacion = f'{(resultado["p50_ms"] / anterior["p50_ms"] - 1) * 100:+.0f}%' if anterior['p50_ms'] else ''
+                if resultado['consultas'] > anterior['consultas']:
+                    regresiones.append(f'{nombre} {anterior["consultas"]} -> {resultado["consultas"]} consultas')
+                    comparacion += ' Q!'
+                limite = max(anterior['p50_ms'] * (1 + tolerancia), anterior['p50_ms'] + umbral_ms)
+                if resultado['p50_ms'] > limite:
+                    regresiones.append(f'{nombre} p50 {anterior["p50_ms"]} -> {resultado["p50_ms"]} ms')
+                    comparacion += ' T!'
+            self.stdout.write(
+                f'{nombre:<26} {resultado["p50_ms"]:>8.2f} {resultado["p95_ms"]:>8.2f} '
+                f'{resultado["p99_ms"]:>8.2f} {resultado["consultas"]:>9} {comparacion:>12}'
+            )
+        return regresiones
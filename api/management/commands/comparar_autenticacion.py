@@ -0,0 +1,52 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.tokens import SmartTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compara el costo por peticion de las clases de autenticacion JWT'
+
+    clases = [
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.StatelessJWTAuthentication',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Usuario para emitir el token (por defecto el primero activo)')
+        parser.add_argument('--iteraciones', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        usuarios = User.objects.filter(is_active=True)
+        if options['username']:
+            usuarios = usuarios.filter(username=options['username'])
+        user = usuarios.first()
+        if user is None:
+            raise CommandError('No hay un usuario activo para emitir el token')
+
+        token = SmartTokenObtainPairSerializer.get_token(user).access_token
+        factory = APIRequestFactory()
+        iteraciones = options['iteraciones']
+
+        for ruta in self.clases:
+            autenticacion = import_string(ruta)()
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                for _ in range(iteraciones):
+                    request = Request(factory.get('/api/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+                    usuario, _ = autenticacion.authenticate(request)
+                    usuario.is_superuser
+                total = time.perf_counter() - inicio
+
+            self.stdout.write(
+                f'{ruta}\n'
+                f'    {total / iteraciones * 1e6:.1f} us/peticion, '
+                f'{len(ctx.captured_queries) / iteraciones:.2f} consultas/peticion'
+            )
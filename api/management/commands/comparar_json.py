@@ -0,0 +1,90 @@
+import io
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.models import Evento
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmark de los renderers y parsers JSON: bytes por segundo al '
+        'serializar y parsear una pagina de eventos'
+    )
+
+    renderers = [
+        'rest_framework.renderers.JSONRenderer',
+        'api.renderers.RapidoJSONRenderer',
+    ]
+    parsers = [
+        'rest_framework.parsers.JSONParser',
+        'api.parsers.RapidoJSONParser',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=100, help='Eventos por pagina')
+        parser.add_argument('--iteraciones', type=int, default=500)
+
+    def handle(self, *args, **options):
+        pagina = self.pagina(options['filas'])
+        iteraciones = options['iteraciones']
+
+        self.stdout.write(f'{options["filas"]} eventos por pagina, {iteraciones} iteraciones')
+        contenido = None
+        for ruta in self.renderers:
+            renderer = import_string(ruta)()
+            inicio = time.perf_counter()
+            for _ in range(iteraciones):
+                contenido = renderer.render(pagina)
+            self.reportar('render', ruta, len(contenido) * iteraciones, time.perf_counter() - inicio)
+
+        for ruta in self.parsers:
+            parser = import_string(ruta)()
+            inicio = time.perf_counter()
+            for _ in range(iteraciones):
+                parser.parse(io.BytesIO(contenido), parser_context={})
+            self.reportar('parse', ruta, len(contenido) * iteraciones, time.perf_counter() - inicio)
+
+    def reportar(self, operacion, ruta, total_bytes, segundos):
+        self.stdout.write(
+            f'{operacion:<6} {ruta:<45} {total_bytes / segundos / 1e6:8.1f} MB/s'
+        )
+
+    def pagina(self, filas):
+        """
+        Pagina con la forma de la respuesta de /api/eventos/, con metadata anidada.
+        Incluye datetime y Decimal sin convertir, como los que llegan desde
+        .values() o anotaciones, ademas de los campos ya serializados.
+        """
+        ahora = timezone.now()
+        tipos = [tipo for tipo, _ in Evento.TIPO_CHOICES]
+        return {
+            'count': filas * 10,
+            'next': 'http://localhost/api/eventos/?page=2',
+            'previous': None,
+            'results': [
+                {
+                    'id': i,
+                    'tipo': tipos[i % len(tipos)],
+                    'descripcion': f'Barrera acceso-{i} abierta',
+                    'sensor': i % 50,
+                    'sensor_nombre': f'sensor-{i % 50}',
+                    'barrera': i % 20,
+                    'barrera_nombre': f'acceso-{i % 20}',
+                    'usuario': None,
+                    'timestamp': (ahora - timedelta(seconds=i)).isoformat(),
+                    'registrado': ahora - timedelta(seconds=i),
+                    'metadata': {
+                        'estado_anterior': 'cerrada',
+                        'lecturas': [i, i + 1, i + 2],
+                        'temperatura': Decimal('21.5'),
+                        'origen': {'ip': '10.0.0.1', 'firmware': '1.4.2'},
+                    },
+                }
+                for i in range(filas)
+            ],
+        }
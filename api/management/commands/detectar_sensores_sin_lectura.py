@@ -0,0 +1,75 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from api import shards
+from api.models import Departamento, Sensor
+from api.services import alertar_sensores_sin_lectura
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea eventos de alerta para los sensores activos sin lecturas recientes. '
+        'Cada ejecucion revisa solo los sensores que dejaron de reportar desde la anterior.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--umbral', type=int, default=300,
+            help='Segundos sin lectura para considerar un sensor caido'
+        )
+        parser.add_argument(
+            '--intervalo', type=int, default=0,
+            help='Repetir cada N segundos (0 = ejecutar una vez)'
+        )
+        parser.add_argument(
+            '--reiniciar', action='store_true',
+            help='Ignorar la marca de agua y revisar todos los sensores caidos'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Cantidad de sensores sinteticos a crear antes de medir'
+        )
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.sembrar(options['seed'], options['umbral'])
+
+        umbral = timedelta(seconds=options['umbral'])
+        reiniciar = options['reiniciar']
+        while True:
+            inicio = time.perf_counter()
+            # Cada shard tiene sus sensores y su marca de agua
+            creadas = sum(shards.en_todos(lambda: alertar_sensores_sin_lectura(umbral, reiniciar=reiniciar)))
+            duracion = time.perf_counter() - inicio
+            self.stdout.write(f'{timezone.localtime():%H:%M:%S} {creadas} alertas en {duracion * 1000:.1f} ms')
+
+            if not options['intervalo']:
+                return
+            reiniciar = False
+            close_old_connections()
+            time.sleep(options['intervalo'])
+
+    @transaction.atomic
+    def sembrar(self, total, umbral):
+        """Sensores con ultima_lectura repartida en la ultima hora; una fraccion queda caida"""
+        departamento, _ = Departamento.objects.get_or_create(nombre='bench-latidos')
+        ahora = timezone.now()
+        existentes = Sensor.objects.filter(nombre__startswith='bench-latido-').count()
+        Sensor.objects.bulk_create(
+            (
+                Sensor(
+                    mac_address=f'02:5E:00:{i >> 16:02X}:{(i >> 8) & 0xFF:02X}:{i & 0xFF:02X}',
+                    nombre=f'bench-latido-{i}',
+                    departamento=departamento,
+                    ultima_lectura=ahora - timedelta(seconds=random.uniform(0, umbral * 12)),
+                )
+                for i in range(existentes, existentes + total)
+            ),
+            batch_size=1000
+        )
+        self.stdout.write(f'Sembrados {total} sensores')
@@ -0,0 +1,96 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Se ejecuta en un proceso nuevo: lo que importa este command no cuenta
+CODIGO = '''
+import json, resource, sys, time
+inicio = time.perf_counter()
+import {modulo}
+cargado = time.perf_counter()
+from api import arranque
+pasos = arranque.calentar()
+sys.stdout.write(json.dumps({{
+    'carga_ms': round((cargado - inicio) * 1000, 1),
+    'calentamiento_ms': pasos,
+    'rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+}}))
+'''
+
+# import time: self [us] | cumulative | imported package
+LINEA = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def leer_importtime(salida):
+    """{modulo: (propio_ms, acumulado_ms)} de la salida de python -X importtime"""
+    modulos = {}
+    for linea in salida.splitlines():
+        coincidencia = LINEA.match(linea)
+        if coincidencia:
+            propio, acumulado, _, modulo = coincidencia.groups()
+            modulos.setdefault(modulo, (int(propio) / 1000, int(acumulado) / 1000))
+    return modulos
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa la aplicacion (config.wsgi o config.asgi) en un proceso nuevo con '
+        'python -X importtime y reporta el tiempo de importacion por modulo, el del '
+        'calentamiento (api.arranque) y la memoria maxima del proceso, para seguir el '
+        'arranque en frio y la memoria por worker'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--asgi', action='store_true', help='Importar config.asgi en lugar de config.wsgi')
+        parser.add_argument('--top', type=int, default=25, help='Modulos a listar')
+        parser.add_argument(
+            '--orden', choices=['acumulado', 'propio'], default='acumulado',
+            help='acumulado incluye los modulos que importa cada uno'
+        )
+        parser.add_argument('--por-paquete', action='store_true', help='Sumar el tiempo propio por paquete raiz')
+        parser.add_argument('--json', action='store_true', help='Salida JSON (para guardar y comparar)')
+
+    def handle(self, *args, **options):
+        modulo = 'config.asgi' if options['asgi'] else 'config.wsgi'
+        proceso = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CODIGO.format(modulo=modulo)],
+            cwd=settings.BASE_DIR, env=os.environ, capture_output=True, text=True,
+        )
+        if proceso.returncode:
+            raise CommandError(f'No se pudo importar {modulo}:\n{proceso.stderr[-2000:]}')
+        resumen = json.loads(proceso.stdout)
+        modulos = leer_importtime(proceso.stderr)
+
+        if options['por_paquete']:
+            paquetes = defaultdict(float)
+            for nombre, (propio, _) in modulos.items():
+                paquetes[nombre.partition('.')[0]] += propio
+            filas = sorted(((nombre, propio, propio) for nombre, propio in paquetes.items()), key=lambda f: -f[1])
+        else:
+            indice = 2 if options['orden'] == 'acumulado' else 1
+            filas = sorted(
+                ((nombre, propio, acumulado) for nombre, (propio, acumulado) in modulos.items()),
+                key=lambda fila: -fila[indice]
+            )
+        filas = filas[:options['top']]
+
+        if options['json']:
+            resumen['modulos'] = {nombre: {'propio_ms': round(propio, 1), 'acumulado_ms': round(acumulado, 1)}
+                                  for nombre, propio, acumulado in filas}
+            self.stdout.write(json.dumps(resumen, indent=2))
+            return
+
+        self.stdout.write(f'{"modulo":<50} {"propio ms":>10} {"acumulado ms":>13}')
+        for nombre, propio, acumulado in filas:
+            self.stdout.write(f'{nombre:<50} {propio:>10.1f} {acumulado:>13.1f}')
+        self.stdout.write(
+            f'\nImportar {modulo}: {resumen["carga_ms"]:.0f} ms ({len(modulos)} modulos); '
+            f'calentamiento: {sum(resumen["calentamiento_ms"].values()):.0f} ms {resumen["calentamiento_ms"]}; '
+            f'memoria maxima: {resumen["rss_mb"]} MB'
+        )
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import Max
+
+from api import shards
+from api.models import Departamento, Sensor, Usuario, Barrera, Evento
+
+# En orden de dependencias
+DIRECTORIO = (User, Departamento, Usuario)
+
+# Modelos cuyo id indica el shard (ver shards.alias_de_id)
+CON_ID_GLOBAL = (Sensor, Barrera, Evento)
+
+
+class Command(BaseCommand):
+    help = (
+        'Prepara los shards de SHARDS: aplica las migraciones, hace que sus ids empiecen '
+        'en numero_de_shard << 40 y copia el directorio (usuarios y departamentos) desde '
+        'default. Se puede ejecutar de nuevo; despues de agregar un shard es obligatorio.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sin-migrar', action='store_true', help='No ejecutar migrate en los shards')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not shards.activos():
+            raise CommandError('SHARDS esta vacio; definir DB_SHARDS (o SQLITE_SHARDS con SQLITE_PATH)')
+
+        for alias in settings.SHARDS:
+            if not options['sin_migrar']:
+                call_command('migrate', database=alias, interactive=False, verbosity=0)
+            for modelo in CON_ID_GLOBAL:
+                self.fijar_secuencia(alias, modelo)
+            copiadas = sum(self.copiar(alias, modelo, options['batch_size']) for modelo in DIRECTORIO)
+            self.stdout.write(
+                f'{alias}: ids desde {shards.primer_id(alias)}, {copiadas} filas de directorio copiadas'
+            )
+        self.stdout.write(self.style.SUCCESS(f'{len(settings.SHARDS)} shards listos'))
+
+    def fijar_secuencia(self, alias, modelo):
+        """Proximo id de la tabla en el shard: al menos primer_id(alias)"""
+        primero = shards.primer_id(alias)
+        maximo = modelo.objects.using(alias).aggregate(maximo=Max('id'))['maximo'] or 0
+        if maximo >= primero + (1 << shards.BITS_ID):
+            raise CommandError(f'{alias}: {modelo._meta.db_table} tiene ids de otro shard ({maximo})')
+
+        conexion = connections[alias]
+        tabla = modelo._meta.db_table
+        with conexion.cursor() as cursor:
+            if conexion.vendor == 'mysql':
+                # Si ya hay ids mayores MariaDB mantiene el siguiente al maximo
+                cursor.execute(f'ALTER TABLE {conexion.ops.quote_name(tabla)} AUTO_INCREMENT = {primero}')
+            elif conexion.vendor == 'sqlite':
+                siguiente = max(primero, maximo + 1)
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [siguiente - 1, tabla])
+                if not cursor.rowcount:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [tabla, siguiente - 1])
+            else:
+                raise CommandError(f'Motor no soportado para shards: {conexion.vendor}')
+
+    def copiar(self, alias, modelo, batch_size):
+        """Copia la tabla de default al shard (inserta o actualiza) y borra las filas que ya no existen"""
+        ids = []
+        with transaction.atomic(using=alias):
+            for fila in modelo.objects.using(DEFAULT_DB_ALIAS).order_by('pk').iterator(chunk_size=batch_size):
+                # raw: mismos valores, incluidos created_at/updated_at (bulk_create los pisaria)
+                models.Model.save_base(fila, using=alias, raw=True)
+                ids.append(fila.pk)
+            # delete() aplica CASCADE/SET_NULL sobre los datos del shard
+            modelo.objects.using(alias).exclude(pk__in=ids).delete()
+        return len(ids)
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga contra un servidor en ejecucion: mezcla lecturas de eventos '
+        'con abrir/cerrar barreras y reporta p50/p99 y throughput. Ejecutar contra el '
+        'stack WSGI y el ASGI con la misma cantidad de cores para compararlos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--username')
+        parser.add_argument('--password')
+        parser.add_argument('--token', help='Access token JWT (alternativa a usuario y clave)')
+        parser.add_argument('--barrera', type=int, required=True, help='Id de la barrera a abrir/cerrar')
+        parser.add_argument('--concurrencia', type=int, default=20)
+        parser.add_argument('--duracion', type=float, default=30, help='Segundos')
+        parser.add_argument(
+            '--escrituras', type=float, default=0.2,
+            help='Fraccion de peticiones que son abrir/cerrar (el resto lista eventos)'
+        )
+
+    def handle(self, *args, **options):
+        self.base = options['url'].rstrip('/')
+        self.token = options['token'] or self.obtener_token(options['username'], options['password'])
+
+        latencias = defaultdict(list)
+        errores = defaultdict(int)
+        lock = threading.Lock()
+        fin = time.monotonic() + options['duracion']
+        cada = max(1, round(1 / options['escrituras'])) if options['escrituras'] else 0
+
+        def trabajador(numero):
+            i = numero
+            while time.monotonic() < fin:
+                i += 1
+                if cada and i % cada == 0:
+                    nombre = 'abrir' if (i // cada) % 2 else 'cerrar'
+                    ruta, metodo = f'/api/barreras/{options["barrera"]}/{nombre}/', 'POST'
+                else:
+                    nombre, ruta, metodo = 'eventos', '/api/eventos/', 'GET'
+
+                inicio = time.perf_counter()
+                ok = self.peticion(metodo, ruta)
+                duracion = time.perf_counter() - inicio
+                with lock:
+                    latencias[nombre].append(duracion)
+                    if not ok:
+                        errores[nombre] += 1
+
+        hilos = [threading.Thread(target=trabajador, args=(n,)) for n in range(options['concurrencia'])]
+        inicio = time.monotonic()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        total = time.monotonic() - inicio
+
+        self.stdout.write(f'{"endpoint":<10} {"peticiones":>10} {"errores":>8} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8}')
+        for nombre, valores in sorted(latencias.items()):
+            self.stdout.write(
+                f'{nombre:<10} {len(valores):>10} {errores[nombre]:>8} '
+                f'{percentil(valores, 50) * 1000:>8.1f} {percentil(valores, 99) * 1000:>8.1f} '
+                f'{len(valores) / total:>8.1f}'
+            )
+        todas = [v for valores in latencias.values() for v in valores]
+        self.stdout.write(
+            f'{"total":<10} {len(todas):>10} {sum(errores.values()):>8} '
+            f'{percentil(todas, 50) * 1000:>8.1f} {percentil(todas, 99) * 1000:>8.1f} '
+            f'{len(todas) / total:>8.1f}'
+        )
+
+    def obtener_token(self, username, password):
+        if not username or not password:
+            raise CommandError('Indica --token o --username y --password')
+        cuerpo = json.dumps({'username': username, 'password': password}).encode()
+        request = Request(
+            f'{self.base}/api/token/', data=cuerpo, headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urlopen(request) as response:
+                return json.load(response)['access']
+        except (HTTPError, URLError) as exc:
+            raise CommandError(f'No se pudo obtener el token: {exc}')
+
+    def peticion(self, metodo, ruta):
+        request = Request(
+            f'{self.base}{ruta}', method=metodo, data=b'' if metodo == 'POST' else None,
+            headers={'Authorization': f'Bearer {self.token}'}
+        )
+        try:
+            with urlopen(request, timeout=30) as response:
+                response.read()
+                return response.status < 400
+        except (HTTPError, URLError, TimeoutError):
+            return False
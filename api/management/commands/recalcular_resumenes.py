@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api import archivo, resumenes, shards
+from api.filters import fecha_param
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los resumenes de eventos (minuto, hora, dia) a partir de la tabla eventos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--desde',
+            help='Recalcular solo desde esta fecha ISO 8601 (se redondea al inicio del dia)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = fecha_param(options, 'desde')
+            except ValidationError:
+                raise CommandError('--desde debe ser una fecha ISO 8601')
+
+        # Los resumenes de meses archivados ya no se pueden reconstruir desde la tabla
+        limite = archivo.limite()
+        if limite is not None and (
+            desde is None or resumenes.TRUNCADORES['dia'](timezone.localtime(desde)) < limite
+        ):
+            raise CommandError(
+                f'Los eventos anteriores a {timezone.localtime(limite):%Y-%m-%d %H:%M} estan archivados; '
+                'indicar --desde a partir del dia siguiente'
+            )
+
+        # Los resumenes de cada shard salen de sus propios eventos
+        creadas = sum(shards.en_todos(lambda: resumenes.recalcular(desde=desde, batch_size=options['batch_size'])))
+        self.stdout.write(self.style.SUCCESS(f'{creadas} filas de resumen creadas'))
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import sinteticos
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea datos sinteticos reproducibles (departamentos, sensores, barreras, usuarios '
+        'y eventos) para pruebas de carga y benchmarks. Las cantidades de sensores, '
+        'barreras y usuarios son por departamento.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departamentos', type=int, default=5)
+        parser.add_argument('--sensores', type=int, default=20)
+        parser.add_argument('--barreras', type=int, default=5)
+        parser.add_argument('--usuarios', type=int, default=3)
+        parser.add_argument('--eventos', type=int, default=100000)
+        parser.add_argument('--dias', type=int, default=30, help='Antiguedad maxima de los eventos')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefijo', default='sim', help='Prefijo de los nombres creados')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--limpiar', action='store_true',
+            help='Borrar antes los datos sinteticos con el mismo prefijo'
+        )
+        parser.add_argument(
+            '--sin-resumenes', action='store_true',
+            help='No recalcular los resumenes de eventos al terminar'
+        )
+
+    def handle(self, *args, **options):
+        if options['limpiar']:
+            sinteticos.limpiar(options['prefijo'])
+
+        total = options['eventos']
+        paso = max(total // 10, options['batch_size'])
+
+        def progreso(creados):
+            if creados % paso < options['batch_size'] or creados == total:
+                self.stdout.write(f'  {creados}/{total} eventos')
+
+        inicio = time.perf_counter()
+        try:
+            creados = sinteticos.sembrar(
+                departamentos=options['departamentos'],
+                sensores=options['sensores'],
+                barreras=options['barreras'],
+                usuarios=options['usuarios'],
+                eventos=total,
+                dias=options['dias'],
+                seed=options['seed'],
+                prefijo=options['prefijo'],
+                batch_size=options['batch_size'],
+                recalcular_resumenes=not options['sin_resumenes'],
+                progreso=progreso,
+            )
+        except ValueError as exc:
+            raise CommandError(f'{exc} (usar --limpiar u otro --prefijo)')
+
+        resumen = ', '.join(f'{cantidad} {modelo}' for modelo, cantidad in creados.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Creados {resumen} en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.diario import DiarioEventos
+
+
+class Command(BaseCommand):
+    help = (
+        'Inserta en la base los eventos pendientes del diario local (EVENTOS_DIARIO), '
+        'p. ej. antes de retirar un servidor o si los workers no van a volver a iniciar'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ruta', help='Archivo del diario (por defecto EVENTOS_DIARIO)')
+        parser.add_argument(
+            '--reencolar-descartados', action='store_true',
+            help='Devuelve a pendientes los eventos descartados tras agotar sus intentos (p. ej. ya corregida la causa)'
+        )
+
+    def handle(self, *args, **options):
+        ruta = options['ruta'] or getattr(settings, 'EVENTOS_DIARIO', None)
+        if not ruta:
+            raise CommandError('EVENTOS_DIARIO no esta definido; indicar --ruta')
+        # abandono=0: tambien los lotes reclamados por procesos que ya no existen
+        diario = DiarioEventos(ruta, abandono=0, intentos=getattr(settings, 'EVENTOS_DIARIO_INTENTOS', 5))
+        if options['reencolar_descartados']:
+            self.stdout.write(f'{diario.reencolar_descartados()} descartados devueltos a pendientes')
+        escritos = diario.vaciar()
+        self.stdout.write(self.style.SUCCESS(
+            f'{escritos} eventos escritos; {diario.pendientes()} pendientes; {len(diario.descartados())} descartados'
+        ))
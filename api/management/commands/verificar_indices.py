@@ -0,0 +1,134 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import sinteticos
+from api.models import Sensor, Barrera, Evento
+from api.views import SensorViewSet, EventoViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta EXPLAIN sobre los querysets reales de los viewsets y falla '
+        'si el planificador recurre a un full scan o a un ordenamiento en memoria'
+    )
+
+    # (nombre, viewset, query params). Los valores None se reemplazan por ids reales.
+    casos = [
+        ('eventos', EventoViewSet, {}),
+        ('eventos?cursor', EventoViewSet, {'cursor': ''}),
+        ('eventos?tipo', EventoViewSet, {'tipo': 'alerta'}),
+        ('eventos?sensor', EventoViewSet, {'sensor': None}),
+        ('eventos?sensor__in', EventoViewSet, {'sensor__in': None}),
+        ('eventos?tipo__in', EventoViewSet, {'tipo__in': 'apertura,cierre'}),
+        ('eventos?barrera', EventoViewSet, {'barrera': None}),
+        ('eventos?departamento', EventoViewSet, {'departamento': None}),
+        ('eventos?sensor&desde&hasta', EventoViewSet, {
+            'sensor': None, 'desde': '2000-01-01T00:00:00', 'hasta': '2100-01-01T00:00:00',
+        }),
+        ('sensores', SensorViewSet, {}),
+        ('sensores?cursor', SensorViewSet, {'cursor': ''}),
+    ]
+
+    # Un IN sobre sensor_id recorre varios rangos de (sensor_id, timestamp) y debe
+    # ordenar el resultado acotado; se tolera el ordenamiento pero no el full scan
+    ordenamiento_tolerado = {'eventos?sensor__in', 'eventos?departamento'}
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Cantidad de eventos sinteticos a crear antes de medir'
+        )
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.sembrar(options['seed'])
+        self.analizar_tablas()
+
+        sensor = Sensor.objects.exclude(departamento=None).first()
+        barrera = Barrera.objects.first()
+        if sensor is None or barrera is None:
+            raise CommandError('No hay datos; ejecuta con --seed N')
+        ids = {
+            'sensor': sensor.pk,
+            'sensor__in': f'{sensor.pk},{sensor.pk + 1}',
+            'barrera': barrera.pk,
+            'departamento': sensor.departamento_id,
+        }
+
+        fallos = []
+        for nombre, viewset, params in self.casos:
+            params = {k: ids[k] if v is None else v for k, v in params.items()}
+            queryset = self.queryset_de(viewset, params)
+            plan = self.plan(queryset)
+            problemas = self.problemas(plan)
+            if nombre in self.ordenamiento_tolerado:
+                problemas = [p for p in problemas if not p.startswith(('filesort', 'ordenamiento'))]
+
+            estado = self.style.ERROR('FALLA') if problemas else self.style.SUCCESS('OK')
+            self.stdout.write(f'{estado} {nombre}')
+            for linea in plan:
+                self.stdout.write(f'    {linea}')
+            if problemas:
+                fallos.append(f'{nombre}: {", ".join(problemas)}')
+
+        if fallos:
+            raise CommandError('Planes sin indice:\n' + '\n'.join(fallos))
+
+    def queryset_de(self, viewset, params):
+        """Reproduce el queryset paginado que ejecuta el endpoint de lista"""
+        request = Request(APIRequestFactory().get('/', params))
+        view = viewset(request=request, action='list', format_kwarg=None, kwargs={})
+        queryset = view.get_queryset()
+        paginator = view.paginator
+        if paginator is not None and 'cursor' in params:
+            queryset = queryset.order_by(f'-{paginator.keyset_field}', '-id')
+        return queryset[:20]
+
+    def plan(self, queryset):
+        if connection.vendor == 'mysql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}', params)
+                columnas = [col[0] for col in cursor.description]
+                return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+        return queryset.explain().splitlines()
+
+    def problemas(self, plan):
+        problemas = []
+        if connection.vendor == 'mysql':
+            for fila in plan:
+                if fila.get('type') == 'ALL':
+                    problemas.append(f'full scan en {fila.get("table")}')
+                if 'filesort' in (fila.get('Extra') or ''):
+                    problemas.append(f'filesort en {fila.get("table")}')
+            return problemas
+
+        for linea in plan:
+            tabla = re.search(r'\bSCAN (\w+)$', linea.strip())
+            if tabla:
+                problemas.append(f'full scan en {tabla.group(1)}')
+            if 'USE TEMP B-TREE FOR ORDER BY' in linea:
+                problemas.append('ordenamiento en memoria')
+        return problemas
+
+    def analizar_tablas(self):
+        tablas = [Sensor._meta.db_table, Evento._meta.db_table]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute(f'ANALYZE TABLE {", ".join(tablas)}')
+                cursor.fetchall()
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+
+    def sembrar(self, total_eventos):
+        # Mismos datos en cada ejecucion (seed fija); reemplaza los de una anterior
+        sinteticos.limpiar(prefijo='bench')
+        sinteticos.sembrar(
+            departamentos=10, sensores=10, barreras=10, usuarios=1, eventos=total_eventos,
+            prefijo='bench', recalcular_resumenes=False
+        )
+        self.stdout.write(f'Sembrados {total_eventos} eventos')
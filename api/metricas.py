@@ -0,0 +1,336 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# metrica: (ayuda, buckets)
+HISTOGRAMAS = {
+    'api_peticion_segundos': ('Latencia total de la peticion', BUCKETS_SEGUNDOS),
+    'api_db_consultas': ('Consultas SQL por peticion', BUCKETS_CONSULTAS),
+    'api_db_segundos': ('Tiempo en la base de datos por peticion', BUCKETS_SEGUNDOS),
+    'api_serializacion_segundos': ('Tiempo en serializers por peticion, sin sus consultas SQL', BUCKETS_SEGUNDOS),
+    'api_render_segundos': ('Tiempo de render JSON del Response', BUCKETS_SEGUNDOS),
+}
+
+# Metricas de tareas en segundo plano, sin etiquetas de vista. metrica: (ayuda, buckets)
+HISTOGRAMAS_INTERNOS = {
+    'api_diario_vaciado_segundos': ('Duracion de cada lote escrito desde el diario de eventos', BUCKETS_SEGUNDOS),
+}
+CONTADORES_INTERNOS = {
+    'api_diario_eventos_total': 'Eventos escritos en la base desde el diario',
+    'api_diario_directos_total': 'Eventos insertados en la peticion por diario lleno',
+    'api_diario_errores_total': 'Vaciados o lotes del diario fallidos (se reintentan)',
+    'api_diario_descartados_total': 'Eventos del diario descartados tras agotar sus intentos',
+}
+
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0
+        self.total = 0
+
+    def observar(self, valor):
+        self.conteos[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+def _etiquetas(**etiquetas):
+    partes = []
+    for nombre, valor in etiquetas.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+class Registro:
+    """
+    Metricas en memoria del proceso. Con varios workers cada uno expone las suyas
+    y todas las series llevan la etiqueta pid del worker que atendio el scrape, asi
+    los contadores de workers distintos no se mezclan en una serie que sube y baja
+    (sum without (pid) (rate(...)) los agrega en Prometheus).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._peticiones = Counter()
+        self._consultas_lentas = Counter()
+        self._internos = {}
+        self._contadores = Counter()
+        self._indicadores = {}
+
+    def observar(self, vista, metodo, estado, valores):
+        with self._lock:
+            self._peticiones[(vista, metodo, estado)] += 1
+            for metrica, valor in valores.items():
+                histograma = self._histogramas.get((metrica, vista, metodo))
+                if histograma is None:
+                    histograma = Histograma(HISTOGRAMAS[metrica][1])
+                    self._histogramas[(metrica, vista, metodo)] = histograma
+                histograma.observar(valor)
+
+    def consulta_lenta(self, vista):
+        with self._lock:
+            self._consultas_lentas[vista] += 1
+
+    def observar_interno(self, metrica, valor):
+        with self._lock:
+            histograma = self._internos.get(metrica)
+            if histograma is None:
+                histograma = self._internos[metrica] = Histograma(HISTOGRAMAS_INTERNOS[metrica][1])
+            histograma.observar(valor)
+
+    def incrementar(self, metrica, cantidad=1):
+        with self._lock:
+            self._contadores[metrica] += cantidad
+
+    def indicador(self, metrica, ayuda, funcion):
+        """Gauge que se calcula con funcion() al exportar (p. ej. la profundidad de una cola)"""
+        with self._lock:
+            self._indicadores[metrica] = (ayuda, funcion)
+
+    def exportar(self):
+        """Texto en el formato de exposicion de Prometheus"""
+        with self._lock:
+            peticiones = sorted(self._peticiones.items())
+            lentas = sorted(self._consultas_lentas.items())
+            histogramas = sorted(
+                (clave, list(h.conteos), h.suma, h.total, h.buckets)
+                for clave, h in self._histogramas.items()
+            )
+            internos = {
+                metrica: (list(h.conteos), h.suma, h.total, h.buckets)
+                for metrica, h in self._internos.items()
+            }
+            contadores = dict(self._contadores)
+            indicadores = sorted(self._indicadores.items())
+        pid = os.getpid()
+
+        lineas = [
+            '# HELP api_peticiones_total Peticiones atendidas',
+            '# TYPE api_peticiones_total counter',
+        ]
+        for (vista, metodo, estado), total in peticiones:
+            lineas.append(f'api_peticiones_total{_etiquetas(vista=vista, metodo=metodo, estado=estado, pid=pid)} {total}')
+
+        lineas += [
+            '# HELP api_db_consultas_lentas_total Consultas SQL sobre METRICAS_CONSULTA_LENTA_MS',
+            '# TYPE api_db_consultas_lentas_total counter',
+        ]
+        for vista, total in lentas:
+            lineas.append(f'api_db_consultas_lentas_total{_etiquetas(vista=vista, pid=pid)} {total}')
+
+        for metrica, (ayuda, _) in HISTOGRAMAS.items():
+            lineas += [f'# HELP {metrica} {ayuda}', f'# TYPE {metrica} histogram']
+            for (nombre, vista, metodo), conteos, suma, total, buckets in histogramas:
+                if nombre != metrica:
+                    continue
+                acumulado = 0
+                for limite, conteo in zip((*buckets, '+Inf'), conteos):
+                    acumulado += conteo
+                    etiquetas = _etiquetas(vista=vista, metodo=metodo, pid=pid, le=limite)
+                    lineas.append(f'{metrica}_bucket{etiquetas} {acumulado}')
+                etiquetas = _etiquetas(vista=vista, metodo=metodo, pid=pid)
+                lineas.append(f'{metrica}_sum{etiquetas} {suma}')
+                lineas.append(f'{metrica}_count{etiquetas} {total}')
+
+        solo_pid = _etiquetas(pid=pid)
+        for metrica, ayuda in CONTADORES_INTERNOS.items():
+            if metrica in contadores:
+                lineas += [
+                    f'# HELP {metrica} {ayuda}', f'# TYPE {metrica} counter',
+                    f'{metrica}{solo_pid} {contadores[metrica]}'
+                ]
+        for metrica, (conteos, suma, total, buckets) in sorted(internos.items()):
+            lineas += [f'# HELP {metrica} {HISTOGRAMAS_INTERNOS[metrica][0]}', f'# TYPE {metrica} histogram']
+            acumulado = 0
+            for limite, conteo in zip((*buckets, '+Inf'), conteos):
+                acumulado += conteo
+                lineas.append(f'{metrica}_bucket{_etiquetas(pid=pid, le=limite)} {acumulado}')
+            lineas += [f'{metrica}_sum{solo_pid} {suma}', f'{metrica}_count{solo_pid} {total}']
+        for metrica, (ayuda, funcion) in indicadores:
+            try:
+                valor = funcion()
+            except Exception:
+                logger.exception('No se pudo calcular %s', metrica)
+                continue
+            lineas += [f'# HELP {metrica} {ayuda}', f'# TYPE {metrica} gauge', f'{metrica}{solo_pid} {valor}']
+
+        return '\n'.join(lineas) + '\n'
+
+    def reiniciar(self):
+        with self._lock:
+            self._histogramas.clear()
+            self._peticiones.clear()
+            self._consultas_lentas.clear()
+            self._internos.clear()
+            self._contadores.clear()
+
+
+registro = Registro()
+
+# Medicion de la peticion en curso. Es una ContextVar para que las consultas que
+# las vistas async ejecutan en hilos de sync_to_async se sumen a su peticion.
+_medicion_actual = ContextVar('medicion_actual', default=None)
+
+
+class Medicion:
+    def __init__(self, request, umbral_lenta):
+        self.request = request
+        self.umbral_lenta = umbral_lenta
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.db = 0.0
+        self.serializacion = 0.0
+        self.serializando = False
+        self.render = None
+
+    def vista(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match is not None else 'sin_ruta'
+
+    def consulta(self, sql, duracion):
+        self.consultas += 1
+        self.db += duracion
+        if self.umbral_lenta is not None and duracion >= self.umbral_lenta:
+            vista = self.vista()
+            registro.consulta_lenta(vista)
+            logger.warning('Consulta lenta (%.1f ms) en %s: %s', duracion * 1000, vista, sql)
+
+
+def medir_serializacion(funcion, *args):
+    """
+    Ejecuta funcion(*args) y suma su duracion a la serializacion de la peticion en
+    curso, descontando el tiempo de las consultas que haga (relaciones perezosas),
+    que ya cuentan en api_db_segundos. Las llamadas anidadas (un serializer dentro
+    de otro) se miden una sola vez.
+    """
+    medicion = _medicion_actual.get()
+    if medicion is None or medicion.serializando:
+        return funcion(*args)
+    medicion.serializando = True
+    inicio = time.perf_counter()
+    db = medicion.db
+    try:
+        return funcion(*args)
+    finally:
+        medicion.serializando = False
+        medicion.serializacion += time.perf_counter() - inicio - (medicion.db - db)
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.consulta(sql, time.perf_counter() - inicio)
+
+
+def _instalar_en_conexion(connection, **kwargs):
+    if _medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_consulta)
+
+
+def _instalar_en_conexiones_abiertas(**kwargs):
+    # Las conexiones son por hilo; request_started se emite en el hilo que ejecuta
+    # las consultas de la peticion (tambien bajo ASGI), asi se cubren conexiones
+    # abiertas antes de cargar el middleware
+    for connection in connections.all(initialized_only=True):
+        _instalar_en_conexion(connection)
+
+
+class MetricasMiddleware:
+    """
+    Mide por vista la latencia total, la cantidad y el tiempo de consultas SQL, el
+    tiempo en serializers (ver medir_serializacion) y el render del Response, y
+    registra las consultas mas lentas que METRICAS_CONSULTA_LENTA_MS. Se expone en
+    /api/metrics/.
+
+    Si METRICAS_ACTIVAS es False y no hay umbral de consultas lentas el middleware
+    se descarta al iniciar (MiddlewareNotUsed) y no agrega costo.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.activas = getattr(settings, 'METRICAS_ACTIVAS', False)
+        umbral = getattr(settings, 'METRICAS_CONSULTA_LENTA_MS', None)
+        if not self.activas and umbral is None:
+            raise MiddlewareNotUsed()
+        self.umbral_lenta = umbral / 1000 if umbral is not None else None
+
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        connection_created.connect(_instalar_en_conexion, dispatch_uid='api.metricas')
+        request_started.connect(_instalar_en_conexiones_abiertas, dispatch_uid='api.metricas')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        medicion = Medicion(request, self.umbral_lenta)
+        token = _medicion_actual.set(medicion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        self.registrar(medicion, request, response)
+        return response
+
+    async def __acall__(self, request):
+        medicion = Medicion(request, self.umbral_lenta)
+        token = _medicion_actual.set(medicion)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        self.registrar(medicion, request, response)
+        return response
+
+    def process_template_response(self, request, response):
+        # Se llama justo antes de render(); el callback corre al terminar
+        medicion = _medicion_actual.get()
+        if medicion is not None:
+            inicio = time.perf_counter()
+
+            def fin_render(response):
+                medicion.render = time.perf_counter() - inicio
+
+            response.add_post_render_callback(fin_render)
+        return response
+
+    def registrar(self, medicion, request, response):
+        if not self.activas:
+            return
+        valores = {
+            'api_peticion_segundos': time.perf_counter() - medicion.inicio,
+            'api_db_consultas': medicion.consultas,
+            'api_db_segundos': medicion.db,
+            'api_serializacion_segundos': medicion.serializacion,
+        }
+        if medicion.render is not None:
+            valores['api_render_segundos'] = medicion.render
+        registro.observar(medicion.vista(), request.method, response.status_code, valores)
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['timestamp', 'id'], name='eventos_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['sensor', 'timestamp'], name='eventos_sensor_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['tipo', 'timestamp'], name='eventos_tipo_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='evento',
+            index=models.Index(fields=['barrera', 'timestamp'], name='eventos_barrera_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensor',
+            index=models.Index(fields=['departamento', 'estado'], name='sensores_depto_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensor',
+            index=models.Index(fields=['created_at', 'id'], name='sensores_created_id_idx'),
+        ),
+    ]
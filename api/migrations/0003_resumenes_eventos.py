@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_indices_compuestos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenEvento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularidad', models.CharField(choices=[('minuto', 'Minuto'), ('hora', 'Hora'), ('dia', 'Dia')], max_length=10)),
+                ('periodo', models.DateTimeField()),
+                ('tipo', models.CharField(choices=[('apertura', 'Apertura'), ('cierre', 'Cierre'), ('alerta', 'Alerta'), ('acceso_denegado', 'Acceso Denegado')], max_length=30)),
+                ('sensor_id', models.BigIntegerField()),
+                ('barrera_id', models.BigIntegerField(default=0)),
+                ('departamento_id', models.BigIntegerField(default=0)),
+                ('total', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'resumenes_eventos',
+                'ordering': ['granularidad', 'periodo'],
+                'indexes': [models.Index(fields=['granularidad', 'sensor_id', 'periodo'], name='resumenes_sensor_idx'), models.Index(fields=['granularidad', 'barrera_id', 'periodo'], name='resumenes_barrera_idx'), models.Index(fields=['granularidad', 'departamento_id', 'periodo'], name='resumenes_depto_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='resumenevento',
+            constraint=models.UniqueConstraint(fields=('granularidad', 'periodo', 'tipo', 'sensor_id', 'barrera_id', 'departamento_id'), name='resumenes_eventos_clave_uniq'),
+        ),
+    ]
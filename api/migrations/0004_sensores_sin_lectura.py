@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_resumenes_eventos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaAgua',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('valor', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'marcas_agua',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='sensor',
+            index=models.Index(fields=['estado', 'ultima_lectura'], name='sensores_estado_lectura_idx'),
+        ),
+    ]
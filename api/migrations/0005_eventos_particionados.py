@@ -0,0 +1,76 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:27
+
+from datetime import datetime, timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+MESES_ADELANTE = 2
+
+
+def _mes_siguiente(mes):
+    return mes.replace(year=mes.year + mes.month // 12, month=mes.month % 12 + 1)
+
+
+def particionar(apps, schema_editor):
+    """
+    MariaDB: particion mensual (UTC) de eventos por RANGE(TO_DAYS(timestamp)).
+    La clave primaria debe incluir la columna de particion, por eso pasa a (id, timestamp).
+    Reescribe la tabla: en produccion aplicar en una ventana de mantenimiento.
+    """
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(`timestamp`) FROM `eventos`')
+        primero, = cursor.fetchone()
+    ahora = datetime.now(timezone.utc)
+    mes = datetime((primero or ahora).year, (primero or ahora).month, 1)
+    hasta = datetime(ahora.year, ahora.month, 1)
+    for _ in range(MESES_ADELANTE):
+        hasta = _mes_siguiente(hasta)
+
+    definiciones = []
+    while mes <= hasta:
+        definiciones.append(
+            f"PARTITION p{mes:%Y%m} VALUES LESS THAN (TO_DAYS('{_mes_siguiente(mes):%Y-%m-%d}'))"
+        )
+        mes = _mes_siguiente(mes)
+    definiciones.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+
+    schema_editor.execute('ALTER TABLE `eventos` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `timestamp`)')
+    schema_editor.execute(
+        f'ALTER TABLE `eventos` PARTITION BY RANGE (TO_DAYS(`timestamp`)) ({", ".join(definiciones)})'
+    )
+
+
+def desparticionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('ALTER TABLE `eventos` REMOVE PARTITIONING')
+    schema_editor.execute('ALTER TABLE `eventos` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_sensores_sin_lectura'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='evento',
+            name='barrera',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.barrera'),
+        ),
+        migrations.AlterField(
+            model_name='evento',
+            name='sensor',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='eventos', to='api.sensor'),
+        ),
+        migrations.AlterField(
+            model_name='evento',
+            name='usuario',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.usuario'),
+        ),
+        migrations.RunPython(particionar, desparticionar),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_eventos_particionados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='departamento',
+            name='shard',
+            field=models.CharField(blank=True, default='', max_length=30),
+        ),
+    ]
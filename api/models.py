@@ -1,10 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Departamento(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     descripcion = models.TextField(blank=True)
     activo = models.BooleanField(default=True)
+    # Alias de la base con sus sensores, barreras y eventos (ver api.shards); '' es default
+    shard = models.CharField(max_length=30, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -34,6 +37,11 @@ class Sensor(models.Model):
     class Meta:
         db_table = 'sensores'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['departamento', 'estado'], name='sensores_depto_estado_idx'),
+            models.Index(fields=['created_at', 'id'], name='sensores_created_id_idx'),
+            models.Index(fields=['estado', 'ultima_lectura'], name='sensores_estado_lectura_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} ({self.mac_address})"
@@ -93,15 +101,76 @@ class Evento(models.Model):
     
     tipo = models.CharField(max_length=30, choices=TIPO_CHOICES)
     descripcion = models.TextField()
-    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='eventos')
-    barrera = models.ForeignKey(Barrera, on_delete=models.SET_NULL, null=True, blank=True)
-    usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Sin FOREIGN KEY en la base: InnoDB no las admite en tablas particionadas
+    # (ver migracion 0005). CASCADE y SET_NULL los sigue aplicando Django.
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='eventos', db_constraint=False)
+    barrera = models.ForeignKey(Barrera, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False)
+    usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False)
+    # default y no auto_now_add: el diario y los datos sinteticos insertan la hora
+    # real del evento
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     metadata = models.JSONField(default=dict, blank=True)
 
     class Meta:
         db_table = 'eventos'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='eventos_ts_id_idx'),
+            models.Index(fields=['sensor', 'timestamp'], name='eventos_sensor_ts_idx'),
+            models.Index(fields=['tipo', 'timestamp'], name='eventos_tipo_ts_idx'),
+            models.Index(fields=['barrera', 'timestamp'], name='eventos_barrera_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.tipo} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class ResumenEvento(models.Model):
+    """
+    Conteo pre-agregado de eventos por periodo, tipo, sensor, barrera y departamento.
+    barrera_id y departamento_id usan 0 cuando el evento no tiene esa relacion.
+    """
+    GRANULARIDAD_CHOICES = [
+        ('minuto', 'Minuto'),
+        ('hora', 'Hora'),
+        ('dia', 'Dia'),
+    ]
+
+    granularidad = models.CharField(max_length=10, choices=GRANULARIDAD_CHOICES)
+    periodo = models.DateTimeField()
+    tipo = models.CharField(max_length=30, choices=Evento.TIPO_CHOICES)
+    sensor_id = models.BigIntegerField()
+    barrera_id = models.BigIntegerField(default=0)
+    departamento_id = models.BigIntegerField(default=0)
+    total = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'resumenes_eventos'
+        ordering = ['granularidad', 'periodo']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularidad', 'periodo', 'tipo', 'sensor_id', 'barrera_id', 'departamento_id'],
+                name='resumenes_eventos_clave_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['granularidad', 'sensor_id', 'periodo'], name='resumenes_sensor_idx'),
+            models.Index(fields=['granularidad', 'barrera_id', 'periodo'], name='resumenes_barrera_idx'),
+            models.Index(fields=['granularidad', 'departamento_id', 'periodo'], name='resumenes_depto_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.granularidad} {self.periodo:%Y-%m-%d %H:%M} {self.tipo}: {self.total}"
+
+
+class MarcaAgua(models.Model):
+    """Ultimo punto procesado por una tarea incremental (p. ej. deteccion de sensores sin lectura)"""
+    nombre = models.CharField(max_length=50, unique=True)
+    valor = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'marcas_agua'
+
+    def __str__(self):
+        return f"{self.nombre}: {self.valor}"
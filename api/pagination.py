@@ -0,0 +1,171 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import archivo, shards
+
+
+def filtro_keyset(campo, valor, pk):
+    """Filas estrictamente posteriores a (valor, pk) en orden (campo, id) descendente"""
+    return Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor, 'id__lt': pk})
+
+
+def iterar_por_keyset(queryset, campo, chunk_size=2000):
+    """
+    Recorre un queryset de .values() en bloques de chunk_size ordenados por (campo, id)
+    descendente. Cada bloque es una consulta independiente con LIMIT, asi la memoria
+    queda acotada aunque el driver (mysqlclient) cargue el resultado completo.
+    """
+    queryset = queryset.order_by(f'-{campo}', '-id')
+    siguiente = queryset
+    while True:
+        bloque = list(siguiente[:chunk_size])
+        yield from bloque
+        if len(bloque) < chunk_size:
+            return
+        ultima = bloque[-1]
+        siguiente = queryset.filter(filtro_keyset(campo, ultima[campo], ultima['id']))
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Paginacion por pagina con modo keyset opcional.
+
+    Si la peticion incluye ?cursor= (vacio para la primera pagina) se pagina
+    por (keyset_field, id) descendente, sin COUNT ni OFFSET, de modo que
+    una pagina profunda cuesta lo mismo que la primera.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    keyset_field = 'timestamp'
+    invalid_cursor_message = 'Cursor invalido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        filas = list(self._keyset_queryset(queryset, request))
+        return self._pagina_keyset(filas)
+
+    async def apaginate_queryset(self, queryset, request):
+        """Variante async de paginate_queryset para las vistas ASGI (api.views_async)"""
+        if isinstance(queryset, shards.Repartida):
+            # Los shards se consultan en paralelo desde hilos con el ORM sincronico
+            return await sync_to_async(self.paginate_queryset)(queryset, request)
+        self.keyset = self.cursor_query_param in request.query_params
+        if self.keyset:
+            filas = [fila async for fila in self._keyset_queryset(queryset, request)]
+            return self._pagina_keyset(filas)
+
+        self.request = request
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        paginator.count = await queryset.acount()
+        try:
+            self.page = paginator.page(self.get_page_number(request, paginator))
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=request.query_params.get(self.page_query_param, 1), message=str(exc)
+            ))
+        self.page.object_list = [fila async for fila in self.page.object_list]
+        return list(self.page)
+
+    def _keyset_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(f'-{self.keyset_field}', '-id')
+
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            valor, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(filtro_keyset(self.keyset_field, valor, pk))
+        return queryset[:self.page_size + 1]
+
+    def _pagina_keyset(self, filas):
+        self.has_next = len(filas) > self.page_size
+        self.page = filas[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        return super().get_page_size(request) or self.max_page_size
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        ultima = self.page[-1]
+        if isinstance(ultima, dict):
+            valor, pk = ultima[self.keyset_field], ultima['id']
+        else:
+            valor, pk = getattr(ultima, self.keyset_field), ultima.pk
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(valor, pk))
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return None
+
+    def encode_cursor(self, valor, pk):
+        # Las filas ya serializadas (archivo de eventos) traen el valor en ISO 8601
+        valor = valor if isinstance(valor, str) else valor.isoformat()
+        return urlsafe_b64encode(f'{valor}|{pk}'.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            valor, pk = urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+            return datetime.fromisoformat(valor), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class EventoPagination(KeysetPagination):
+    """
+    Si la consulta alcanza meses archivados (api.archivo) las paginas continuan con
+    esos eventos despues de los de la tabla, tanto por pagina como por cursor.
+    """
+    keyset_field = 'timestamp'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if not archivo.consultar(params):
+            return super().paginate_queryset(queryset, request, view)
+        if self.cursor_query_param not in params:
+            return super().paginate_queryset(archivo.ConArchivo(queryset, params), request, view)
+
+        self.keyset = True
+        filas = list(self._keyset_queryset(queryset, request))
+        faltan = self.page_size + 1 - len(filas)
+        if faltan > 0:
+            cursor = params[self.cursor_query_param]
+            antes = self.decode_cursor(cursor) if cursor else None
+            filas += islice(archivo.filas(params, antes), faltan)
+        return self._pagina_keyset(filas)
+
+    async def apaginate_queryset(self, queryset, request):
+        if archivo.consultar(request.query_params):
+            return await sync_to_async(self.paginate_queryset)(queryset, request)
+        return await super().apaginate_queryset(queryset, request)
+
+
+class SensorPagination(KeysetPagination):
+    keyset_field = 'created_at'
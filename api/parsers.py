@@ -0,0 +1,52 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+_cargar_json = orjson.loads if orjson is not None else json.loads
+
+
+class RapidoJSONParser(JSONParser):
+    """
+    JSONParser que usa orjson cuando esta instalado y el de DRF en caso contrario.
+    orjson rechaza NaN e Infinity igual que el modo estricto de DRF.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parser para flujos NDJSON (un objeto JSON por linea)
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        filas = []
+        for numero, linea in enumerate(stream, start=1):
+            linea = linea.decode(encoding).strip()
+            if not linea:
+                continue
+            try:
+                filas.append(_cargar_json(linea))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON invalido en linea {numero}: {exc}')
+        return filas
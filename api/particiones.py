@@ -0,0 +1,129 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connections, router
+from django.db.models import Min
+
+from .models import Evento
+
+TABLA = Evento._meta.db_table
+
+
+def inicio_mes(fecha):
+    """Primer instante (UTC) del mes de fecha. Las particiones y archivos son por mes UTC."""
+    fecha = fecha.astimezone(dt_timezone.utc)
+    return datetime(fecha.year, fecha.month, 1, tzinfo=dt_timezone.utc)
+
+
+def mes_siguiente(mes):
+    return mes.replace(year=mes.year + mes.month // 12, month=mes.month % 12 + 1)
+
+
+def nombre_particion(mes):
+    return f'p{mes:%Y%m}'
+
+
+def mes_de_particion(nombre):
+    return datetime(int(nombre[1:5]), int(nombre[5:7]), 1, tzinfo=dt_timezone.utc)
+
+
+def _conexion():
+    # La del shard elegido (api.shards), o default
+    return connections[router.db_for_write(Evento)]
+
+
+def particiones():
+    """Nombres de las particiones de eventos en orden (MariaDB), o [] si no esta particionada"""
+    connection = _conexion()
+    if connection.vendor != 'mysql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT PARTITION_NAME FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL '
+            'ORDER BY PARTITION_ORDINAL_POSITION',
+            [TABLA]
+        )
+        return [nombre for nombre, in cursor.fetchall()]
+
+
+def definicion_particion(mes):
+    return f"PARTITION {nombre_particion(mes)} VALUES LESS THAN (TO_DAYS('{mes_siguiente(mes):%Y-%m-%d}'))"
+
+
+def asegurar_particiones(meses_adelante=2, ahora=None):
+    """
+    Crea las particiones mensuales que faltan hasta `meses_adelante` meses despues del
+    actual, separandolas de pmax (REORGANIZE; si pmax esta vacia no copia filas).
+    Devuelve los nombres creados; en otros motores no hace nada.
+    """
+    existentes = particiones()
+    if not existentes:
+        return []
+
+    mensuales = [nombre for nombre in existentes if nombre != 'pmax']
+    hasta = inicio_mes(ahora or datetime.now(dt_timezone.utc))
+    for _ in range(meses_adelante):
+        hasta = mes_siguiente(hasta)
+    # Desde el mes siguiente a la ultima particion mensual, sin dejar huecos
+    # (las filas de un mes sin particion propia quedan en pmax y se reubican)
+    mes = mes_siguiente(mes_de_particion(mensuales[-1])) if mensuales else inicio_mes(
+        ahora or datetime.now(dt_timezone.utc)
+    )
+    nuevas = []
+    while mes <= hasta:
+        nuevas.append(mes)
+        mes = mes_siguiente(mes)
+    if not nuevas:
+        return []
+
+    definiciones = ', '.join(definicion_particion(mes) for mes in nuevas)
+    connection = _conexion()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE {connection.ops.quote_name(TABLA)} REORGANIZE PARTITION pmax INTO '
+            f'({definiciones}, PARTITION pmax VALUES LESS THAN MAXVALUE)'
+        )
+    return [nombre_particion(mes) for mes in nuevas]
+
+
+def meses_con_eventos(antes_de):
+    """Meses (UTC) con eventos anteriores a antes_de, del mas antiguo al mas nuevo"""
+    primero = Evento.objects.filter(timestamp__lt=antes_de).aggregate(primero=Min('timestamp'))['primero']
+    if primero is None:
+        return []
+    meses = []
+    mes = inicio_mes(primero)
+    while mes < antes_de:
+        if Evento.objects.filter(timestamp__gte=mes, timestamp__lt=mes_siguiente(mes)).exists():
+            meses.append(mes)
+        mes = mes_siguiente(mes)
+    return meses
+
+
+def eliminar_mes(mes, esperadas, chunk_size=5000):
+    """
+    Quita de la tabla los eventos del mes. En MariaDB, si el mes es la particion mas
+    antigua y tiene exactamente las filas archivadas, hace DROP PARTITION (instantaneo
+    y sin fragmentar la tabla); si no, y en SQLite, borra el rango por bloques de ids.
+    Devuelve la cantidad de filas quitadas.
+    """
+    nombre = nombre_particion(mes)
+    existentes = particiones()
+    connection = _conexion()
+    tabla = connection.ops.quote_name(TABLA)
+    if existentes and existentes[0] == nombre:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {tabla} PARTITION ({nombre})')
+            filas, = cursor.fetchone()
+            if filas == esperadas:
+                cursor.execute(f'ALTER TABLE {tabla} DROP PARTITION {nombre}')
+                return filas
+
+    eventos = Evento.objects.filter(timestamp__gte=mes, timestamp__lt=mes_siguiente(mes))
+    eliminadas = 0
+    while True:
+        ids = list(eventos.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return eliminadas
+        # Nada referencia a eventos: delete() es un unico DELETE sin cargar instancias
+        eliminadas += Evento.objects.filter(id__in=ids).delete()[0]
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from .roles import obtener_rol
+
 class IsAdminUser(permissions.BasePermission):
     """
     Permiso personalizado: Solo permite acceso a usuarios con rol 'admin'
@@ -11,8 +13,5 @@ class IsAdminUser(permissions.BasePermission):
         if request.user.is_superuser:
             return True
         
-        try:
-            usuario = request.user.usuario
-            return usuario.rol == 'admin' and usuario.activo
-        except:
-            return False
+        perfil = obtener_rol(request)
+        return perfil.rol == 'admin' and perfil.activo
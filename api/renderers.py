@@ -0,0 +1,69 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+
+class RapidoJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer que usa orjson cuando esta instalado y el de DRF en caso contrario.
+
+    Produce el mismo JSON compacto que DRF: datetime en ISO 8601 con 'Z' para UTC,
+    y Decimal, UUID, timedelta y demas tipos no nativos pasan por el encoder de DRF.
+    Las respuestas con indentacion (API navegable, ?indent) usan el renderer de DRF.
+    """
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        contenido = orjson.dumps(
+            data, default=self.encoder.default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        )
+        # Igual que DRF: U+2028/U+2029 escapados para poder incrustar el JSON en <script>
+        return contenido.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Renderer para negociar ?format= en exportaciones. El contenido se envia con
+    StreamingHttpResponse; render() solo se usa para respuestas de error.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=DjangoJSONEncoder).encode(self.charset)
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class PrometheusRenderer(BaseRenderer):
+    """Formato de exposicion de texto de Prometheus para /api/metrics/"""
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Respuestas de error (401, 403)
+        return json.dumps(data).encode(self.charset)
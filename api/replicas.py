@@ -0,0 +1,179 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+METODOS_SEGUROS = ('GET', 'HEAD', 'OPTIONS')
+
+# Cookie que fija las lecturas de un cliente a la primaria despues de escribir
+COOKIE = 'db_primaria'
+
+
+class Estado:
+    """Decision de la peticion en curso: si puede leer de una replica y de cual"""
+
+    def __init__(self, lectura_en_replica):
+        self.lectura_en_replica = lectura_en_replica
+        self.escribio = False
+        self.alias = None
+
+
+# ContextVar para que las consultas de vistas async en hilos de sync_to_async
+# usen la decision de su peticion
+_estado = ContextVar('replicas_estado', default=None)
+
+# alias: (momento de la medicion, disponible); por proceso
+_mediciones = {}
+_lock = threading.Lock()
+
+
+def retraso(alias):
+    """
+    Segundos de atraso de la replica, o None si la replicacion esta detenida.
+    En MariaDB usa SHOW SLAVE STATUS (requiere el privilegio SLAVE MONITOR o
+    REPLICATION CLIENT); un servidor que no es replica y otros motores valen 0.
+    """
+    conexion = connections[alias]
+    if conexion.vendor != 'mysql':
+        return 0
+    with conexion.cursor() as cursor:
+        cursor.execute('SHOW SLAVE STATUS')
+        fila = cursor.fetchone()
+        if fila is None:
+            return 0
+        columnas = [columna[0] for columna in cursor.description]
+        return dict(zip(columnas, fila))['Seconds_Behind_Master']
+
+
+def disponible(alias):
+    """
+    True si la replica responde y su atraso no supera REPLICAS_RETRASO_MAXIMO.
+    Se mide a lo sumo cada REPLICAS_INTERVALO_RETRASO segundos por proceso.
+    """
+    intervalo = getattr(settings, 'REPLICAS_INTERVALO_RETRASO', 2)
+    medicion = _mediciones.get(alias)
+    if medicion is not None and time.monotonic() - medicion[0] < intervalo:
+        return medicion[1]
+
+    with _lock:
+        medicion = _mediciones.get(alias)
+        if medicion is not None and time.monotonic() - medicion[0] < intervalo:
+            return medicion[1]
+        try:
+            segundos = retraso(alias)
+        except Exception:
+            logger.warning('Replica %s no responde; se lee de la primaria', alias, exc_info=True)
+            segundos = None
+        sana = segundos is not None and segundos <= getattr(settings, 'REPLICAS_RETRASO_MAXIMO', 5)
+        if not sana and (medicion is None or medicion[1]):
+            logger.warning('Replica %s fuera de servicio (atraso: %s s)', alias, segundos)
+        _mediciones[alias] = (time.monotonic(), sana)
+        return sana
+
+
+class ReplicasRouter:
+    """
+    Envia las lecturas de peticiones GET/HEAD/OPTIONS a una replica de REPLICAS y todo
+    lo demas a default: escrituras, management commands, hilos en segundo plano,
+    lecturas dentro de una transaccion o despues de escribir en la misma peticion,
+    y clientes que escribieron hace menos de REPLICAS_FIJAR_SEGUNDOS (cookie).
+    Si ninguna replica esta disponible se lee de default.
+    """
+
+    def db_for_read(self, model, **hints):
+        estado = _estado.get()
+        if estado is None or not estado.lectura_en_replica:
+            return None
+        if estado.escribio or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if estado.alias is None:
+            # Una sola replica por peticion: paginas y conteos consistentes entre si
+            sanas = [alias for alias in settings.REPLICAS if disponible(alias)]
+            estado.alias = random.choice(sanas) if sanas else DEFAULT_DB_ALIAS
+        return estado.alias
+
+    def db_for_write(self, model, **hints):
+        estado = _estado.get()
+        if estado is not None:
+            estado.escribio = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas y primaria tienen los mismos datos
+        misma_base = {DEFAULT_DB_ALIAS, *getattr(settings, 'REPLICAS', [])}
+        if obj1._state.db in misma_base and obj2._state.db in misma_base:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in getattr(settings, 'REPLICAS', []):
+            return False
+        return None
+
+
+def _leer_en_contexto(contenido, estado):
+    # Las respuestas streaming (export) consultan al iterarse, despues del middleware
+    anterior = _estado.get()
+    _estado.set(estado)
+    try:
+        yield from contenido
+    finally:
+        _estado.set(anterior)
+
+
+class ReplicasMiddleware:
+    """
+    Decide por peticion si sus lecturas pueden ir a una replica (ver ReplicasRouter)
+    y, si la peticion escribio o no es de lectura, fija al cliente a la primaria
+    con una cookie por REPLICAS_FIJAR_SEGUNDOS para que lea sus propias escrituras.
+    Sin REPLICAS se descarta al iniciar.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REPLICAS', None):
+            raise MiddlewareNotUsed()
+        self.fijar = getattr(settings, 'REPLICAS_FIJAR_SEGUNDOS', 15)
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def estado(self, request):
+        return Estado(request.method in METODOS_SEGUROS and COOKIE not in request.COOKIES)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        estado = self.estado(request)
+        token = _estado.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self.procesar(request, response, estado)
+
+    async def __acall__(self, request):
+        estado = self.estado(request)
+        token = _estado.set(estado)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self.procesar(request, response, estado)
+
+    def procesar(self, request, response, estado):
+        if estado.escribio or request.method not in METODOS_SEGUROS:
+            response.set_cookie(COOKIE, '1', max_age=self.fijar, httponly=True, samesite='Lax')
+        if response.streaming and not response.is_async:
+            response.streaming_content = _leer_en_contexto(response.streaming_content, estado)
+        return response
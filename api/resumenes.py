@@ -0,0 +1,192 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+from .models import Sensor, Evento, ResumenEvento
+
+TRUNCADORES = {
+    'minuto': lambda ts: ts.replace(second=0, microsecond=0),
+    'hora': lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    'dia': lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+FUNCIONES_TRUNC = {
+    'minuto': TruncMinute,
+    'hora': TruncHour,
+    'dia': TruncDay,
+}
+
+
+def registrar_eventos(eventos):
+    """
+    Incrementa los resumenes para eventos recien insertados.
+    Agrupa el lote por clave y aplica todos los incrementos con pocas consultas
+    independientes del tamano del lote: un SELECT de las filas existentes, un
+    UPDATE por cada incremento distinto y un INSERT de las claves nuevas.
+    """
+    if not eventos:
+        return
+
+    departamentos = dict(
+        Sensor.objects.filter(pk__in={e.sensor_id for e in eventos})
+        .values_list('id', 'departamento_id')
+    )
+
+    conteos = Counter()
+    for evento in eventos:
+        local = timezone.localtime(evento.timestamp)
+        for granularidad, truncar in TRUNCADORES.items():
+            conteos[(
+                granularidad,
+                truncar(local),
+                evento.tipo,
+                evento.sensor_id,
+                evento.barrera_id or 0,
+                departamentos.get(evento.sensor_id) or 0,
+            )] += 1
+
+    with transaction.atomic(using=router.db_for_write(ResumenEvento)):
+        existentes = _resumenes_existentes(conteos)
+        # Un UPDATE por cada incremento distinto (casi siempre uno solo: +1)
+        por_incremento = defaultdict(list)
+        for clave, resumen_id in existentes.items():
+            por_incremento[conteos[clave]].append(resumen_id)
+        for incremento, ids in por_incremento.items():
+            ResumenEvento.objects.filter(pk__in=ids).update(total=F('total') + incremento)
+
+        nuevas = [clave for clave in conteos if clave not in existentes]
+        if not nuevas:
+            return
+        try:
+            with transaction.atomic(using=router.db_for_write(ResumenEvento)):
+                ResumenEvento.objects.bulk_create([
+                    ResumenEvento(total=conteos[clave], **_filtro(clave)) for clave in nuevas
+                ])
+        except IntegrityError:
+            # Otra peticion creo alguna de las filas: se resuelve clave por clave
+            for clave in nuevas:
+                _incrementar(clave, conteos[clave])
+
+
+def _filtro(clave):
+    granularidad, periodo, tipo, sensor_id, barrera_id, departamento_id = clave
+    return dict(
+        granularidad=granularidad, periodo=periodo, tipo=tipo, sensor_id=sensor_id,
+        barrera_id=barrera_id, departamento_id=departamento_id,
+    )
+
+
+def _resumenes_existentes(conteos):
+    """Ids de las filas de resumen ya creadas para las claves del lote, indexados por clave"""
+    candidatas = ResumenEvento.objects.filter(
+        granularidad__in={clave[0] for clave in conteos},
+        periodo__in={clave[1] for clave in conteos},
+        tipo__in={clave[2] for clave in conteos},
+        sensor_id__in={clave[3] for clave in conteos},
+        barrera_id__in={clave[4] for clave in conteos},
+        departamento_id__in={clave[5] for clave in conteos},
+    ).values_list('id', 'granularidad', 'periodo', 'tipo', 'sensor_id', 'barrera_id', 'departamento_id')
+    existentes = {}
+    for resumen_id, *clave in candidatas:
+        clave = tuple(clave)
+        # El filtro por columnas puede traer combinaciones que no estan en el lote
+        if clave in conteos:
+            existentes[clave] = resumen_id
+    return existentes
+
+
+def _incrementar(clave, total):
+    filtro = _filtro(clave)
+    if ResumenEvento.objects.filter(**filtro).update(total=F('total') + total):
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(ResumenEvento)):
+            ResumenEvento.objects.create(total=total, **filtro)
+    except IntegrityError:
+        # Otra peticion creo la fila entre el UPDATE y el INSERT
+        ResumenEvento.objects.filter(**filtro).update(total=F('total') + total)
+
+
+def recalcular(desde=None, batch_size=1000):
+    """
+    Reconstruye los resumenes a partir de la tabla eventos (desde una fecha opcional).
+    Devuelve la cantidad de filas de resumen creadas.
+    """
+    creadas = 0
+    with transaction.atomic(using=router.db_for_write(ResumenEvento)):
+        resumenes = ResumenEvento.objects.all()
+        eventos = Evento.objects.order_by()
+        if desde is not None:
+            # Se recalculan dias completos para no dejar periodos parciales
+            desde = TRUNCADORES['dia'](timezone.localtime(desde))
+            resumenes = resumenes.filter(periodo__gte=desde)
+            eventos = eventos.filter(timestamp__gte=desde)
+        resumenes.delete()
+
+        for granularidad, trunc in FUNCIONES_TRUNC.items():
+            filas = (
+                eventos
+                .annotate(periodo=trunc('timestamp'))
+                .values('periodo', 'tipo', 'sensor_id', 'barrera_id', 'sensor__departamento_id')
+                .annotate(total=Count('id'))
+                .iterator(chunk_size=batch_size)
+            )
+            lote = []
+            for fila in filas:
+                lote.append(ResumenEvento(
+                    granularidad=granularidad,
+                    periodo=fila['periodo'],
+                    tipo=fila['tipo'],
+                    sensor_id=fila['sensor_id'],
+                    barrera_id=fila['barrera_id'] or 0,
+                    departamento_id=fila['sensor__departamento_id'] or 0,
+                    total=fila['total'],
+                ))
+                if len(lote) >= batch_size:
+                    ResumenEvento.objects.bulk_create(lote)
+                    creadas += len(lote)
+                    lote = []
+            ResumenEvento.objects.bulk_create(lote)
+            creadas += len(lote)
+    return creadas
+
+
+def estadisticas(granularidad, desde, hasta, agrupar=None, **filtros):
+    """
+    Totales por periodo y tipo leidos solo de los resumenes.
+    agrupar puede ser 'sensor', 'barrera' o 'departamento'.
+    """
+    queryset = ResumenEvento.objects.filter(
+        granularidad=granularidad, periodo__gte=desde, periodo__lt=hasta
+    )
+    for dimension in ('sensor', 'barrera', 'departamento'):
+        valor = filtros.get(dimension)
+        if valor is not None:
+            queryset = queryset.filter(**{f'{dimension}_id': valor})
+    if filtros.get('tipo__in'):
+        queryset = queryset.filter(tipo__in=filtros['tipo__in'])
+
+    campos = ['periodo', 'tipo']
+    if agrupar:
+        campos.append(f'{agrupar}_id')
+    return list(
+        queryset.values(*campos).annotate(total=Sum('total')).order_by(*campos)
+    )
+
+
+def combinar(partes):
+    """Suma resultados de estadisticas() de varios shards, en el mismo orden"""
+    if len(partes) == 1:
+        return partes[0]
+    totales = {}
+    for parte in partes:
+        for fila in parte:
+            clave = tuple(valor for campo, valor in fila.items() if campo != 'total')
+            if clave in totales:
+                totales[clave]['total'] += fila['total']
+            else:
+                totales[clave] = dict(fila)
+    return [totales[clave] for clave in sorted(totales)]
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from .models import Usuario
+
+Rol = namedtuple('Rol', ['rol', 'activo'])
+
+_SIN_PERFIL = Rol(None, False)
+
+
+class CacheTTL:
+    """Cache en memoria del proceso con expiracion por entrada"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return None
+        expira, valor = entrada
+        if expira < time.monotonic():
+            with self._lock:
+                self._datos.pop(clave, None)
+            return None
+        return valor
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+
+    def delete(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+cache_roles = CacheTTL(getattr(settings, 'ROLES_CACHE_TTL', 60))
+
+
+def _rol_desde_token(request):
+    token = getattr(request, 'auth', None)
+    if token is None or not hasattr(token, 'get'):
+        return None
+    if 'rol' not in token.payload:
+        return None
+    return Rol(token.get('rol'), bool(token.get('activo')))
+
+
+def _rol_desde_bd(user_id):
+    rol = cache_roles.get(user_id)
+    if rol is None:
+        fila = Usuario.objects.filter(user_id=user_id).values_list('rol', 'activo').first()
+        rol = Rol(*fila) if fila else _SIN_PERFIL
+        cache_roles.set(user_id, rol)
+    return rol
+
+
+async def _arol_desde_bd(user_id):
+    rol = cache_roles.get(user_id)
+    if rol is None:
+        fila = await Usuario.objects.filter(user_id=user_id).values_list('rol', 'activo').afirst()
+        rol = Rol(*fila) if fila else _SIN_PERFIL
+        cache_roles.set(user_id, rol)
+    return rol
+
+
+def obtener_rol(request):
+    """
+    Devuelve el Rol del usuario autenticado, resuelto una sola vez por peticion.
+    Con ROLES_DESDE_JWT se usan los claims del token sin consultar la base de datos.
+    """
+    rol = getattr(request, '_rol_resuelto', None)
+    if rol is None:
+        if getattr(settings, 'ROLES_DESDE_JWT', False):
+            rol = _rol_desde_token(request)
+        if rol is None:
+            rol = _rol_desde_bd(request.user.pk)
+        request._rol_resuelto = rol
+    return rol
+
+
+async def aobtener_rol(request):
+    """Variante async de obtener_rol para las vistas ASGI"""
+    rol = getattr(request, '_rol_resuelto', None)
+    if rol is None:
+        if getattr(settings, 'ROLES_DESDE_JWT', False):
+            rol = _rol_desde_token(request)
+        if rol is None:
+            rol = await _arol_desde_bd(request.user.pk)
+        request._rol_resuelto = rol
+    return rol
+
+
+def invalidar(user_id):
+    cache_roles.delete(user_id)
@@ -1,15 +1,59 @@
+import re
+
+from django.db import models
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Sensor, Departamento, Usuario, Evento, Barrera
+from . import metricas
+from .campos import FilaSerializada, campos_de_peticion, podar_campos, podar_fila
+
+MAC_REGEX = re.compile(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$')
+
+
+def validar_mac(value):
+    if not MAC_REGEX.match(value):
+        raise serializers.ValidationError("Formato de MAC address inválido")
+    return value.upper()
+
+
+class CamposDinamicosMixin:
+    """
+    Permite elegir los campos de la respuesta en GET con ?fields=a,b u ?omit=c.
+    Los nombres desconocidos se ignoran. Ver api.campos.CamposDinamicosViewMixin
+    para la poda de la consulta.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and request.method == 'GET':
+            podar_campos(self.fields, *campos_de_peticion(request.query_params))
+
+    def to_representation(self, instance):
+        # Por objeto, para cubrir list, retrieve y las respuestas de escritura
+        return metricas.medir_serializacion(super().to_representation, instance)
+
+
+class ConFilasSerializadasListSerializer(serializers.ListSerializer):
+    """ListSerializer que acepta, junto a instancias, filas ya serializadas (FilaSerializada)"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return [
+            podar_fila(item, self.child) if isinstance(item, FilaSerializada)
+            else self.child.to_representation(item)
+            for item in iterable
+        ]
 
-class UserSerializer(serializers.ModelSerializer):
+
+class UserSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
         read_only_fields = ['id']
 
 
-class DepartamentoSerializer(serializers.ModelSerializer):
+class DepartamentoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     total_sensores = serializers.SerializerMethodField()
     
     class Meta:
@@ -18,10 +62,14 @@ class DepartamentoSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_total_sensores(self, obj):
-        return obj.sensores.count()
+        # DepartamentoViewSet anota total_sensores; el fallback cubre instancias sin anotar
+        total = getattr(obj, 'total_sensores', None)
+        if total is None:
+            return obj.sensores.count()
+        return total
 
 
-class SensorSerializer(serializers.ModelSerializer):
+class SensorSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     departamento_nombre = serializers.CharField(source='departamento.nombre', read_only=True)
     
     class Meta:
@@ -31,13 +79,10 @@ class SensorSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def validate_mac_address(self, value):
-        import re
-        if not re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', value):
-            raise serializers.ValidationError("Formato de MAC address inválido")
-        return value.upper()
+        return validar_mac(value)
 
 
-class UsuarioSerializer(serializers.ModelSerializer):
+class UsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     username = serializers.CharField(write_only=True)
     password = serializers.CharField(write_only=True, style={'input_type': 'password'})
@@ -65,7 +110,7 @@ class UsuarioSerializer(serializers.ModelSerializer):
         return usuario
 
 
-class BarreraSerializer(serializers.ModelSerializer):
+class BarreraSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     sensor_nombre = serializers.CharField(source='sensor.nombre', read_only=True)
     departamento_nombre = serializers.CharField(source='departamento.nombre', read_only=True)
     
@@ -76,7 +121,7 @@ class BarreraSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class EventoSerializer(serializers.ModelSerializer):
+class EventoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     sensor_nombre = serializers.CharField(source='sensor.nombre', read_only=True)
     barrera_nombre = serializers.CharField(source='barrera.nombre', read_only=True)
     usuario_nombre = serializers.CharField(source='usuario.user.username', read_only=True)
@@ -87,3 +132,41 @@ class EventoSerializer(serializers.ModelSerializer):
                   'barrera', 'barrera_nombre', 'usuario', 'usuario_nombre',
                   'timestamp', 'metadata']
         read_only_fields = ['id', 'timestamp']
+        # Las paginas pueden incluir eventos leidos del archivo (api.archivo)
+        list_serializer_class = ConFilasSerializadasListSerializer
+
+
+class EventoIngestaSerializer(serializers.Serializer):
+    """
+    Validacion de filas para la ingesta masiva de eventos.
+    Las FK se reciben como ids y se resuelven por lote en la vista.
+    """
+    tipo = serializers.ChoiceField(choices=Evento.TIPO_CHOICES)
+    descripcion = serializers.CharField()
+    sensor = serializers.IntegerField()
+    barrera = serializers.IntegerField(required=False, allow_null=True)
+    usuario = serializers.IntegerField(required=False, allow_null=True)
+    metadata = serializers.JSONField(required=False, default=dict)
+
+
+class BarreraComandoSerializer(serializers.Serializer):
+    """Comando masivo sobre barreras: lista de ids o departamento completo"""
+    accion = serializers.ChoiceField(choices=['abrir', 'cerrar'])
+    barreras = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=1000
+    )
+    departamento = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if 'barreras' not in data and 'departamento' not in data:
+            raise serializers.ValidationError('Indique barreras o departamento')
+        return data
+
+
+class LatidoSerializer(serializers.Serializer):
+    """Latido de un sensor, opcionalmente con cambio de estado"""
+    mac_address = serializers.CharField(max_length=17)
+    estado = serializers.ChoiceField(choices=Sensor.ESTADO_CHOICES, required=False)
+
+    def validate_mac_address(self, value):
+        return validar_mac(value)
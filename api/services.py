@@ -0,0 +1,309 @@
+from collections import namedtuple
+
+from django.db import router, transaction
+from django.utils import timezone
+
+from . import cache, diario, shards, tiempo_real
+from .models import Sensor, Usuario, Barrera, Evento, MarcaAgua
+from .serializers import EventoIngestaSerializer
+from .resumenes import registrar_eventos
+from .pagination import iterar_por_keyset
+
+BULK_CHUNK_SIZE = 500
+
+# accion: (estado destino, estado de origen, tipo de evento)
+TRANSICIONES_BARRERA = {
+    'abrir': ('abierta', 'cerrada', 'apertura'),
+    'cerrar': ('cerrada', 'abierta', 'cierre'),
+}
+
+MARCA_SENSORES_SIN_LECTURA = 'sensores_sin_lectura'
+
+Transicion = namedtuple('Transicion', ['barrera_id', 'nombre', 'estado', 'estado_anterior', 'evento'])
+
+
+class BarreraBloqueada(Exception):
+    pass
+
+
+def ingerir_eventos(filas, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Valida e inserta un lote de eventos.
+
+    Devuelve (eventos_creados, errores) donde errores es una lista de
+    {'indice': i, 'errores': {...}}. Las filas invalidas no detienen el lote.
+    Con SHARDS el lote se separa por el shard del sensor de cada fila.
+    """
+    grupos = shards.agrupar(
+        filas, lambda fila: shards.alias_de_id(fila.get('sensor') if isinstance(fila, dict) else None)
+    )
+    if len(grupos) > 1:
+        creados, errores = [], []
+        for alias, items in grupos.items():
+            with shards.usar(alias):
+                creados_shard, errores_shard = _ingerir_eventos([fila for _, fila in items], chunk_size)
+            creados += creados_shard
+            errores += [{**error, 'indice': items[error['indice']][0]} for error in errores_shard]
+        errores.sort(key=lambda error: error['indice'])
+        return creados, errores
+    with shards.usar(next(iter(grupos), None)):
+        return _ingerir_eventos(filas, chunk_size)
+
+
+def _ingerir_eventos(filas, chunk_size):
+    validas = []
+    errores = []
+    for indice, fila in enumerate(filas):
+        serializer = EventoIngestaSerializer(data=fila)
+        if serializer.is_valid():
+            validas.append((indice, serializer.validated_data))
+        else:
+            errores.append({'indice': indice, 'errores': serializer.errors})
+
+    # Una consulta por modelo relacionado para todo el lote
+    sensores = Sensor.objects.only('id').in_bulk(
+        {datos['sensor'] for _, datos in validas}
+    )
+    barreras = Barrera.objects.only('id').in_bulk(
+        {datos['barrera'] for _, datos in validas if datos.get('barrera')}
+    )
+    usuarios = Usuario.objects.only('id').in_bulk(
+        {datos['usuario'] for _, datos in validas if datos.get('usuario')}
+    )
+
+    eventos = []
+    for indice, datos in validas:
+        fila_errores = {}
+        if datos['sensor'] not in sensores:
+            fila_errores['sensor'] = ['Sensor no existe']
+        if datos.get('barrera') and datos['barrera'] not in barreras:
+            fila_errores['barrera'] = ['Barrera no existe']
+        if datos.get('usuario') and datos['usuario'] not in usuarios:
+            fila_errores['usuario'] = ['Usuario no existe']
+        if fila_errores:
+            errores.append({'indice': indice, 'errores': fila_errores})
+            continue
+
+        eventos.append(Evento(
+            tipo=datos['tipo'],
+            descripcion=datos['descripcion'],
+            sensor_id=datos['sensor'],
+            barrera_id=datos.get('barrera'),
+            usuario_id=datos.get('usuario'),
+            metadata=datos.get('metadata', {}),
+        ))
+
+    errores.sort(key=lambda error: error['indice'])
+    if not eventos:
+        return [], errores
+
+    with transaction.atomic(using=router.db_for_write(Evento)):
+        creados = Evento.objects.bulk_create(eventos, batch_size=chunk_size)
+        # La lectura mas reciente de cada sensor (no la del lote): un solo UPDATE con CASE
+        lecturas = {}
+        for evento in creados:
+            previa = lecturas.get(evento.sensor_id)
+            if previa is None or evento.timestamp > previa:
+                lecturas[evento.sensor_id] = evento.timestamp
+        Sensor.objects.bulk_update(
+            [Sensor(pk=pk, ultima_lectura=timestamp) for pk, timestamp in lecturas.items()],
+            ['ultima_lectura'], batch_size=chunk_size
+        )
+        registrar_eventos(creados)
+        tiempo_real.publicar_eventos(creados)
+    # update() no emite post_save: ultima_lectura cambio en los sensores del lote
+    cache.invalidar_modelo(Sensor)
+
+    return creados, errores
+
+
+def transicion_barrera(barrera_id, accion):
+    """
+    Abre o cierra una barrera con UPDATE condicionales, sin leer el estado antes.
+
+    El estado anterior se deduce de que UPDATE afecto una fila: primero
+    WHERE estado = <origen> (transicion real) y si no, WHERE estado = <destino>
+    (la barrera ya estaba asi). Si ninguno afecta filas la barrera esta
+    bloqueada o no existe. El evento se inserta en la misma transaccion, con el
+    lock de fila tomado por el UPDATE, por lo que peticiones concurrentes sobre
+    la misma barrera quedan serializadas y cada evento registra el estado real.
+    Con EVENTOS_DIARIO el evento se guarda en el diario local antes del COMMIT y
+    se inserta despues de confirmar (ver diario.guardar_eventos); el evento devuelto no tiene pk.
+
+    Lanza Barrera.DoesNotExist o BarreraBloqueada.
+    """
+    destino, origen, tipo_evento = TRANSICIONES_BARRERA[accion]
+    barreras = Barrera.objects.filter(pk=barrera_id)
+
+    with transaction.atomic(using=router.db_for_write(Barrera)):
+        ahora = timezone.now()
+        if barreras.filter(estado=origen).update(estado=destino, updated_at=ahora):
+            estado_anterior = origen
+        elif barreras.filter(estado=destino).update(updated_at=ahora):
+            estado_anterior = destino
+        elif barreras.exists():
+            raise BarreraBloqueada()
+        else:
+            raise Barrera.DoesNotExist()
+
+        nombre, sensor_id, departamento_id = barreras.values_list(
+            'nombre', 'sensor_id', 'departamento_id'
+        ).get()
+        evento, = diario.guardar_eventos([Evento(
+            tipo=tipo_evento,
+            descripcion=f'Barrera {nombre} {destino}',
+            barrera_id=barrera_id,
+            sensor_id=sensor_id,
+            metadata={'estado_anterior': estado_anterior}
+        )])
+
+        # update() no emite post_save
+        cache.invalidar_modelo(Barrera)
+        tiempo_real.publicar_estado('barrera', barrera_id, departamento_id, destino, estado_anterior)
+
+    return Transicion(barrera_id, nombre, destino, estado_anterior, evento)
+
+
+def transicion_barreras(accion, ids=None, departamento_id=None):
+    """
+    Abre o cierra varias barreras (por ids o por departamento) con un numero fijo
+    de consultas: SELECT ... FOR UPDATE de las filas, un UPDATE para todas las que
+    no estan bloqueadas y un bulk_create de los eventos.
+
+    Devuelve una lista de resultados por barrera con 'resultado' igual a
+    'ok', 'bloqueada', 'sin_sensor' (no se puede registrar el evento) o
+    'no_existe' (solo para ids pedidos explicitamente).
+    """
+    if shards.activos():
+        return _transicion_barreras_repartida(accion, ids, departamento_id)
+    return _transicion_barreras(accion, ids, departamento_id)
+
+
+def _transicion_barreras_repartida(accion, ids, departamento_id):
+    # Una transaccion por shard: las barreras de un departamento estan en el suyo
+    if ids is None:
+        alias = shards.alias_de_departamento(departamento_id) if departamento_id is not None else None
+        aliases = [alias] if alias is not None else shards.todos()
+        resultados = []
+        for alias in aliases:
+            with shards.usar(alias):
+                resultados += _transicion_barreras(accion, ids, departamento_id)
+        return resultados
+
+    por_id = {}
+    for alias, items in shards.agrupar(dict.fromkeys(ids), shards.alias_de_id).items():
+        with shards.usar(alias):
+            for resultado in _transicion_barreras(accion, [pk for _, pk in items], departamento_id):
+                por_id[resultado['id']] = resultado
+    return [por_id[barrera_id] for barrera_id in dict.fromkeys(ids)]
+
+
+def _transicion_barreras(accion, ids, departamento_id):
+    destino, _, tipo_evento = TRANSICIONES_BARRERA[accion]
+    barreras = Barrera.objects.all()
+    if ids is not None:
+        barreras = barreras.filter(pk__in=ids)
+    if departamento_id is not None:
+        barreras = barreras.filter(departamento_id=departamento_id)
+
+    resultados = {}
+    eventos = []
+    cambios = []
+    with transaction.atomic(using=router.db_for_write(Barrera)):
+        # El lock de fila evita que una transicion individual cambie el estado
+        # entre la lectura y el UPDATE
+        filas = barreras.select_for_update().order_by('id').values_list(
+            'id', 'nombre', 'estado', 'sensor_id', 'departamento_id'
+        )
+        for barrera_id, nombre, estado, sensor_id, departamento_id_fila in filas:
+            if estado == 'bloqueada':
+                resultados[barrera_id] = {'id': barrera_id, 'resultado': 'bloqueada', 'estado': estado}
+                continue
+            if sensor_id is None:
+                resultados[barrera_id] = {'id': barrera_id, 'resultado': 'sin_sensor', 'estado': estado}
+                continue
+            resultados[barrera_id] = {
+                'id': barrera_id, 'resultado': 'ok', 'estado': destino, 'estado_anterior': estado
+            }
+            cambios.append((barrera_id, departamento_id_fila, estado))
+            eventos.append(Evento(
+                tipo=tipo_evento,
+                descripcion=f'Barrera {nombre} {destino}',
+                barrera_id=barrera_id,
+                sensor_id=sensor_id,
+                metadata={'estado_anterior': estado}
+            ))
+
+        if eventos:
+            Barrera.objects.filter(pk__in=[barrera_id for barrera_id, _, _ in cambios]).update(
+                estado=destino, updated_at=timezone.now()
+            )
+            diario.guardar_eventos(eventos)
+            for barrera_id, departamento_id_fila, estado_anterior in cambios:
+                tiempo_real.publicar_estado(
+                    'barrera', barrera_id, departamento_id_fila, destino, estado_anterior
+                )
+            # update() no emite post_save
+            cache.invalidar_modelo(Barrera)
+
+    if ids is None:
+        return list(resultados.values())
+    return [
+        resultados.get(barrera_id, {'id': barrera_id, 'resultado': 'no_existe'})
+        for barrera_id in dict.fromkeys(ids)
+    ]
+
+
+def alertar_sensores_sin_lectura(umbral, ahora=None, chunk_size=BULK_CHUNK_SIZE, reiniciar=False):
+    """
+    Crea un evento 'alerta' por cada sensor activo cuya ultima_lectura paso a ser
+    mas antigua que ahora - umbral desde la ejecucion anterior.
+
+    Cada ejecucion recorre solo el rango [limite anterior, limite actual) de
+    ultima_lectura sobre el indice (estado, ultima_lectura) y guarda el limite
+    como marca de agua. Un sensor que vuelve a reportar sale del rango y, si deja
+    de reportar otra vez, su nueva ultima_lectura cae en un rango posterior, por lo
+    que se alerta una vez por cada corte. Los sensores que nunca reportaron se ignoran.
+    Devuelve la cantidad de alertas creadas.
+    """
+    limite = (ahora or timezone.now()) - umbral
+    creadas = 0
+
+    with transaction.atomic(using=router.db_for_write(MarcaAgua)):
+        # El lock de la marca evita que dos ejecuciones simultaneas dupliquen alertas
+        marca, _ = MarcaAgua.objects.select_for_update().get_or_create(nombre=MARCA_SENSORES_SIN_LECTURA)
+        desde = None if reiniciar else marca.valor
+        if desde is not None and limite <= desde:
+            return 0
+
+        sensores = Sensor.objects.filter(estado='activo', ultima_lectura__lt=limite)
+        if desde is not None:
+            sensores = sensores.filter(ultima_lectura__gte=desde)
+
+        eventos = []
+        filas = sensores.values('id', 'nombre', 'ultima_lectura')
+        for fila in iterar_por_keyset(filas, 'ultima_lectura', chunk_size):
+            ultima_lectura = timezone.localtime(fila['ultima_lectura'])
+            eventos.append(Evento(
+                tipo='alerta',
+                descripcion=f'Sensor {fila["nombre"]} sin lecturas desde {ultima_lectura:%Y-%m-%d %H:%M:%S}',
+                sensor_id=fila['id'],
+                metadata={'motivo': 'sin_lectura', 'ultima_lectura': ultima_lectura.isoformat()}
+            ))
+            if len(eventos) == chunk_size:
+                creadas += _insertar_alertas(eventos)
+                eventos = []
+        if eventos:
+            creadas += _insertar_alertas(eventos)
+
+        marca.valor = limite
+        marca.save(update_fields=['valor', 'updated_at'])
+
+    return creadas
+
+
+def _insertar_alertas(eventos):
+    creados = Evento.objects.bulk_create(eventos)
+    registrar_eventos(creados)
+    tiempo_real.publicar_eventos(creados)
+    return len(creados)
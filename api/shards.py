@@ -0,0 +1,400 @@
+import contextvars
+import copy
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, models, transaction
+from rest_framework.exceptions import ValidationError
+
+# Modelos cuyas filas viven en el shard de su departamento. El resto (Departamento,
+# User, Usuario) es el directorio: se escribe en default y se copia a cada shard.
+MODELOS_REPARTIDOS = {'api.Sensor', 'api.Barrera', 'api.Evento', 'api.ResumenEvento', 'api.MarcaAgua'}
+
+# Los ids de los modelos repartidos empiezan en numero_de_shard << BITS_ID en cada
+# shard (ver preparar_shards), asi el id indica el shard y es unico entre todos
+BITS_ID = 40
+
+# Shard de la operacion en curso (None: sin shard elegido, se usa default)
+_shard = contextvars.ContextVar('shard', default=None)
+
+# (momento de carga, {departamento_id: alias}); por proceso
+_mapa = (0, {})
+_lock = threading.Lock()
+_ejecutor = None
+
+
+def todos():
+    """Aliases de todos los shards; default es el shard 0"""
+    return [DEFAULT_DB_ALIAS, *getattr(settings, 'SHARDS', [])]
+
+
+def activos():
+    return bool(getattr(settings, 'SHARDS', None))
+
+
+def actual():
+    return _shard.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def usar(alias):
+    """Dirige las consultas de los modelos repartidos al shard alias (None: default)"""
+    token = _shard.set(alias)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def alias_de_id(pk):
+    """Shard de un Sensor, Barrera o Evento por su id (default si el id no es valido)"""
+    try:
+        numero = int(pk) >> BITS_ID
+    except (TypeError, ValueError):
+        return DEFAULT_DB_ALIAS
+    aliases = todos()
+    return aliases[numero] if 0 <= numero < len(aliases) else DEFAULT_DB_ALIAS
+
+
+def primer_id(alias):
+    return todos().index(alias) << BITS_ID
+
+
+def _cargar_mapa():
+    global _mapa
+    from .models import Departamento
+
+    filas = Departamento.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'shard')
+    _mapa = (time.monotonic(), {pk: shard or DEFAULT_DB_ALIAS for pk, shard in filas})
+    return _mapa[1]
+
+
+def alias_de_departamento(departamento_id):
+    """
+    Shard de un departamento segun Departamento.shard, leido de default y guardado
+    por proceso SHARDS_MAPA_TTL segundos (un departamento nuevo recarga el mapa).
+    """
+    if not activos():
+        return DEFAULT_DB_ALIAS
+    try:
+        departamento_id = int(departamento_id)
+    except (TypeError, ValueError):
+        return DEFAULT_DB_ALIAS
+    momento, mapa = _mapa
+    if departamento_id not in mapa or time.monotonic() - momento > getattr(settings, 'SHARDS_MAPA_TTL', 60):
+        with _lock:
+            mapa = _cargar_mapa()
+    return mapa.get(departamento_id, DEFAULT_DB_ALIAS)
+
+
+def invalidar_mapa():
+    global _mapa
+    _mapa = (0, {})
+
+
+def elegir_shard():
+    """Shard para un departamento nuevo: el que tiene menos departamentos"""
+    from .models import Departamento
+
+    conteos = dict.fromkeys(todos(), 0)
+    for shard, total in Departamento.objects.using(DEFAULT_DB_ALIAS).values_list('shard').annotate(
+        total=models.Count('id')
+    ):
+        conteos[shard or DEFAULT_DB_ALIAS] = conteos.get(shard or DEFAULT_DB_ALIAS, 0) + total
+    return min(todos(), key=lambda alias: conteos[alias])
+
+
+class ShardsRouter:
+    """
+    Con un shard elegido (usar()) las consultas de MODELOS_REPARTIDOS van a ese shard;
+    el directorio y todo lo demas sigue en default (y sus replicas).
+    """
+
+    def _alias(self, model):
+        alias = _shard.get()
+        if alias in getattr(settings, 'SHARDS', []) and model._meta.label in MODELOS_REPARTIDOS:
+            return alias
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._alias(model)
+
+    def db_for_write(self, model, **hints):
+        return self._alias(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # El directorio esta copiado en cada shard
+        bases = {*todos(), *getattr(settings, 'REPLICAS', [])}
+        if activos() and obj1._state.db in bases and obj2._state.db in bases:
+            return True
+        return None
+
+
+def replicar(instancia, using):
+    """Copia una fila del directorio guardada en default a todos los shards (al confirmar)"""
+    if using != DEFAULT_DB_ALIAS or not activos():
+        return
+    copia = copy.copy(instancia)
+
+    def copiar():
+        for alias in settings.SHARDS:
+            # raw: mismos valores (auto_now incluido) y sin logica de save()
+            models.Model.save_base(copia, using=alias, raw=True)
+
+    transaction.on_commit(copiar, using=using)
+
+
+def eliminar_replica(instancia, using):
+    if using != DEFAULT_DB_ALIAS or not activos():
+        return
+    modelo, pk = type(instancia), instancia.pk
+
+    def eliminar():
+        for alias in settings.SHARDS:
+            # delete() aplica CASCADE/SET_NULL tambien dentro del shard
+            modelo.objects.using(alias).filter(pk=pk).delete()
+
+    transaction.on_commit(eliminar, using=using)
+
+
+def _get_ejecutor():
+    global _ejecutor
+    if _ejecutor is None:
+        with _lock:
+            if _ejecutor is None:
+                _ejecutor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'SHARDS_HILOS', 8), thread_name_prefix='shards'
+                )
+    return _ejecutor
+
+
+def _en_shard(alias, funcion):
+    with usar(alias):
+        return funcion()
+
+
+def _en_hilo(alias, funcion):
+    # Hilos del pool: mismas reglas de CONN_MAX_AGE que un worker entre peticiones
+    close_old_connections()
+    return _en_shard(alias, funcion)
+
+
+def en_paralelo(tareas):
+    """
+    Ejecuta {alias: funcion} cada una con su shard elegido y devuelve {alias: resultado}.
+    Con mas de una tarea y SHARDS_HILOS > 0 corren en paralelo; el contexto de la
+    peticion (metricas, replicas) pasa a cada hilo.
+    """
+    if len(tareas) == 1 or not getattr(settings, 'SHARDS_HILOS', 8):
+        return {alias: _en_shard(alias, funcion) for alias, funcion in tareas.items()}
+    futuros = {
+        alias: _get_ejecutor().submit(contextvars.copy_context().run, _en_hilo, alias, funcion)
+        for alias, funcion in tareas.items()
+    }
+    return {alias: futuro.result() for alias, futuro in futuros.items()}
+
+
+def en_todos(funcion):
+    """Resultados de funcion() en cada shard, en el orden de todos()"""
+    return list(en_paralelo({alias: funcion for alias in todos()}).values())
+
+
+class _Orden:
+    """Valor de un campo de orden; con descendente invierte la comparacion. NULL va primero en ASC."""
+    __slots__ = ('valor', 'descendente')
+
+    def __init__(self, valor, descendente):
+        self.valor = valor
+        self.descendente = descendente
+
+    def __eq__(self, otro):
+        return self.valor == otro.valor
+
+    def __lt__(self, otro):
+        a, b = (otro.valor, self.valor) if self.descendente else (self.valor, otro.valor)
+        if a is None or b is None:
+            return a is None and b is not None
+        return a < b
+
+
+def _valor(fila, campo):
+    if isinstance(fila, dict):
+        return fila[campo]
+    for parte in campo.split('__'):
+        fila = getattr(fila, parte) if fila is not None else None
+    return fila
+
+
+def clave_de_orden(orden):
+    campos = [(campo.lstrip('-'), campo.startswith('-')) for campo in orden]
+    return lambda fila: tuple(_Orden(_valor(fila, campo), descendente) for campo, descendente in campos)
+
+
+class Repartida:
+    """
+    El mismo queryset en varios shards ({alias: queryset}), con lo que usan el Paginator
+    de Django, KeysetPagination e iterar_por_keyset: filter, order_by, values, count y
+    slices. Un slice [a:b] pide las primeras b filas a cada shard en paralelo y las
+    mezcla por el orden del queryset (cada shard ya las devuelve ordenadas). Los
+    textos se comparan en Python, no con la collation de la base.
+    """
+    ordered = True
+
+    def __init__(self, querysets, orden=None, campos=None):
+        self.querysets = querysets
+        primero = next(iter(querysets.values()))
+        self.model = primero.model
+        self.orden = list(orden or primero.query.order_by or primero.model._meta.ordering)
+        self.campos = campos
+
+    def _aplicar(self, metodo, *args, **kwargs):
+        return Repartida(
+            {alias: getattr(queryset, metodo)(*args, **kwargs) for alias, queryset in self.querysets.items()},
+            self.orden, self.campos
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._aplicar('filter', *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._aplicar('exclude', *args, **kwargs)
+
+    def order_by(self, *campos):
+        repartida = self._aplicar('order_by', *campos)
+        repartida.orden = list(campos)
+        return repartida
+
+    def values(self, *campos):
+        repartida = self._aplicar('values', *campos)
+        repartida.campos = campos
+        return repartida
+
+    def _con_campos_de_orden(self):
+        # Las filas de values() necesitan los campos del orden para mezclarlas
+        faltan = [campo.lstrip('-') for campo in self.orden if campo.lstrip('-') not in (self.campos or ())]
+        if self.campos is None or not faltan:
+            return self.querysets
+        return {alias: queryset.values(*self.campos, *faltan) for alias, queryset in self.querysets.items()}
+
+    def count(self):
+        return sum(en_paralelo({
+            alias: queryset.count for alias, queryset in self.querysets.items()
+        }).values())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, indice):
+        if not isinstance(indice, slice):
+            return self[indice:indice + 1][0]
+        if indice.stop is None or indice.step:
+            raise TypeError('Repartida solo admite slices con fin y sin paso')
+        inicio = indice.start or 0
+        partes = en_paralelo({
+            alias: (lambda queryset=queryset: list(queryset[:indice.stop]))
+            for alias, queryset in self._con_campos_de_orden().items()
+        })
+        return list(islice(heapq.merge(*partes.values(), key=clave_de_orden(self.orden)), inicio, indice.stop))
+
+    def __iter__(self):
+        return heapq.merge(
+            *(queryset.iterator() for queryset in self._con_campos_de_orden().values()),
+            key=clave_de_orden(self.orden)
+        )
+
+
+def repartir(queryset, alias=None, filtrar=None):
+    """
+    El queryset en el shard alias o, con alias None, en todos (Repartida). Sin SHARDS
+    lo devuelve igual. filtrar(queryset, alias) restringe cada shard a sus filas.
+    Fija la base con using() para poder evaluarse fuera del contexto (streaming).
+    """
+    if not activos():
+        return queryset
+    aliases = todos() if alias is None else [alias]
+    querysets = {}
+    for alias in aliases:
+        # default sin using(): lo decide el router (puede ir a una replica)
+        parte = queryset if alias == DEFAULT_DB_ALIAS else queryset.using(alias)
+        querysets[alias] = filtrar(parte, alias) if filtrar else parte
+    return querysets[aliases[0]] if len(aliases) == 1 else Repartida(querysets)
+
+
+def agrupar(items, alias_de_item):
+    """{alias: [(indice, item)]} conservando el orden"""
+    grupos = {}
+    for indice, item in enumerate(items):
+        grupos.setdefault(alias_de_item(item), []).append((indice, item))
+    return grupos
+
+
+def alias_de_params(params, nombres):
+    """Shard indicado por el primer parametro de nombres presente (departamento o ids), o None"""
+    for nombre in nombres:
+        if params.get(nombre):
+            return alias_de_departamento(params[nombre]) if nombre == 'departamento' else alias_de_id(params[nombre])
+    return None
+
+
+class RepartidoViewMixin:
+    """
+    Elige el shard de cada peticion: detalle por el id, create por `campo_shard` del
+    cuerpo y list por alguno de `params_shard` si la vista filtra por ellos. list sin
+    shard elegido consulta todos en paralelo y mezcla por el orden de la lista.
+    Sin SHARDS no hace nada.
+    """
+    campo_shard = 'departamento'
+    params_shard = ()
+
+    def alias_de_valor(self, campo, valor):
+        if campo == 'departamento':
+            return alias_de_departamento(valor)
+        return alias_de_id(valor)
+
+    def alias_de_pk(self, pk):
+        return alias_de_id(pk)
+
+    def shard_de_peticion(self, request, kwargs):
+        if 'pk' in kwargs:
+            return self.alias_de_pk(kwargs['pk'])
+        if self.action == 'create':
+            datos = request.data if isinstance(request.data, dict) else {}
+            return self.alias_de_valor(self.campo_shard, datos.get(self.campo_shard)) if self.campo_shard else None
+        return alias_de_params(request.query_params, self.params_shard)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.shard = self.shard_de_peticion(request, kwargs) if activos() else None
+        self._token_shard = _shard.set(self.shard)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_token_shard', None)
+        if token is not None:
+            _shard.reset(token)
+            self._token_shard = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def filtrar_shard(self, queryset, alias):
+        return queryset
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if getattr(self, 'shard', None) not in (None, DEFAULT_DB_ALIAS):
+            queryset = queryset.using(self.shard)
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        if activos() and self.shard is None and self.action == 'list':
+            queryset = repartir(queryset, filtrar=self.filtrar_shard)
+        return super().paginate_queryset(queryset)
+
+    def perform_update(self, serializer):
+        nuevo = serializer.validated_data.get(self.campo_shard) if self.campo_shard else None
+        if activos() and nuevo is not None and self.alias_de_valor(self.campo_shard, nuevo.pk) != self.shard:
+            raise ValidationError({self.campo_shard: 'No se puede mover a otro shard'})
+        super().perform_update(serializer)
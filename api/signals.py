@@ -0,0 +1,70 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, roles, shards, tiempo_real
+from .authentication import revocar_tokens
+from .models import Departamento, Sensor, Usuario, Barrera, Evento
+from .resumenes import registrar_eventos
+
+
+@receiver(post_save, sender=Evento)
+def actualizar_resumenes(sender, instance, created, raw=False, **kwargs):
+    """Mantiene los resumenes al crear eventos uno a uno (bulk_create llama a registrar_eventos)"""
+    if created and not raw:
+        registrar_eventos([instance])
+        tiempo_real.publicar_eventos([instance])
+
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def invalidar_rol_perfil(sender, instance, **kwargs):
+    roles.invalidar(instance.user_id)
+    # rol, activo y departamento viajan como claims en los tokens
+    revocar_tokens(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidar_rol_user(sender, instance, update_fields=None, **kwargs):
+    roles.invalidar(instance.pk)
+    # El login de sesion (admin) solo guarda last_login: los claims no cambian
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        revocar_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Departamento)
+@receiver(post_delete, sender=Departamento)
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+@receiver(post_save, sender=Barrera)
+@receiver(post_delete, sender=Barrera)
+def invalidar_respuestas(sender, using, **kwargs):
+    cache.invalidar_modelo(sender, using=using)
+
+
+@receiver(pre_save, sender=Departamento)
+def asignar_shard(sender, instance, raw=False, **kwargs):
+    if not raw and not instance.shard and shards.activos():
+        instance.shard = shards.elegir_shard()
+
+
+@receiver(post_save, sender=Departamento)
+@receiver(post_delete, sender=Departamento)
+def invalidar_mapa_shards(sender, **kwargs):
+    shards.invalidar_mapa()
+
+
+@receiver(post_save, sender=Departamento)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Usuario)
+def replicar_directorio(sender, instance, using, **kwargs):
+    """Copia el directorio a cada shard (los datos repartidos tienen FK a el)"""
+    shards.replicar(instance, using)
+
+
+@receiver(post_delete, sender=Departamento)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Usuario)
+def eliminar_de_shards(sender, instance, using, **kwargs):
+    shards.eliminar_replica(instance, using)
@@ -0,0 +1,219 @@
+import random
+import re
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import cache, resumenes, shards
+from .models import Departamento, Sensor, Usuario, Barrera, Evento
+
+# Bit "administrado localmente" del primer octeto: no choca con MAC reales
+PREFIJO_MAC = (0x02, 0x53, 0x43)
+
+# tipo: peso relativo
+TIPOS_EVENTO = {
+    'apertura': 45,
+    'cierre': 45,
+    'alerta': 7,
+    'acceso_denegado': 3,
+}
+
+COLUMNAS_EVENTO = ['tipo', 'descripcion', 'sensor', 'barrera', 'usuario', 'timestamp', 'metadata']
+
+DESCRIPCIONES = {
+    'apertura': 'Barrera {} abierta',
+    'cierre': 'Barrera {} cerrada',
+    'alerta': 'Alerta en {}',
+    'acceso_denegado': 'Acceso denegado en {}',
+}
+
+
+def mac_sintetica(numero):
+    """MAC 02:53:43:XX:XX:XX para el sensor numero (hasta 2**24), en el formato de validar_mac"""
+    if not 0 <= numero < 1 << 24:
+        raise ValueError('numero de sensor fuera de rango')
+    octetos = (*PREFIJO_MAC, numero >> 16, (numero >> 8) & 0xFF, numero & 0xFF)
+    return ':'.join(f'{octeto:02X}' for octeto in octetos)
+
+
+def _nombres(prefijo, tipo):
+    """
+    Regex de los nombres que crea sembrar: {prefijo}-{tipo}-{d} o {prefijo}-{tipo}-{d}-{n}.
+    Otros datos con el mismo prefijo (p. ej. bench-latidos) no coinciden.
+    """
+    return rf'^{re.escape(prefijo)}-{tipo}-[0-9]+(-[0-9]+)?$'
+
+
+def _sensores(prefijo):
+    return Sensor.objects.filter(
+        nombre__regex=_nombres(prefijo, 'sensor'), mac_address__startswith=mac_sintetica(0)[:9]
+    )
+
+
+def _insertar_eventos(filas):
+    """
+    INSERT directo de tuplas (tipo, descripcion, sensor_id, barrera_id, usuario_id,
+    timestamp, metadata) con executemany, en el shard de cada sensor. bulk_create
+    prepara cada valor por separado y con millones de filas es varias veces mas lento.
+    """
+    campos = [Evento._meta.get_field(nombre) for nombre in COLUMNAS_EVENTO]
+    timestamp, metadata = campos[5], campos[6]
+    for alias, items in shards.agrupar(filas, lambda fila: shards.alias_de_id(fila[2])).items():
+        with shards.usar(alias):
+            conexion = connections[router.db_for_write(Evento)]
+        tabla = conexion.ops.quote_name(Evento._meta.db_table)
+        columnas = ', '.join(conexion.ops.quote_name(campo.column) for campo in campos)
+        sql = f'INSERT INTO {tabla} ({columnas}) VALUES ({", ".join(["%s"] * len(campos))})'
+        # Un lote por transaccion: en autocommit SQLite confirmaria fila por fila
+        with transaction.atomic(using=conexion.alias), conexion.cursor() as cursor:
+            cursor.executemany(sql, [
+                (*fila[:5], timestamp.get_db_prep_save(fila[5], conexion),
+                 metadata.get_db_prep_save(fila[6], conexion))
+                for _, fila in items
+            ])
+
+
+def limpiar(prefijo='sim'):
+    """Borra los datos que creo sembrar con el prefijo indicado, en todos los shards"""
+    with transaction.atomic():
+        for alias in shards.todos():
+            with shards.usar(alias), transaction.atomic(using=router.db_for_write(Evento)):
+                sensores = _sensores(prefijo)
+                Evento.objects.filter(sensor__in=sensores).delete()
+                Barrera.objects.filter(nombre__regex=_nombres(prefijo, 'barrera')).delete()
+                sensores.delete()
+        User.objects.filter(username__regex=_nombres(prefijo, 'operador')).delete()
+        Departamento.objects.filter(nombre__regex=_nombres(prefijo, 'depto')).delete()
+    for modelo in (Departamento, Sensor, Barrera):
+        cache.invalidar_modelo(modelo)
+
+
+def sembrar(departamentos=5, sensores=20, barreras=5, usuarios=3, eventos=100000, dias=30,
+            seed=0, prefijo='sim', batch_size=5000, recalcular_resumenes=True, progreso=None):
+    """
+    Crea datos sinteticos reproducibles: `departamentos` departamentos, cada uno con
+    `sensores` sensores, `barreras` barreras (con sensor) y `usuarios` operadores,
+    y `eventos` eventos repartidos en los ultimos `dias` dias. La misma seed genera
+    los mismos datos. Devuelve un dict con la cantidad creada por modelo.
+
+    Los eventos se insertan en lotes de batch_size sin pasar por registrar_eventos; con recalcular_resumenes se reconstruyen los resumenes al final.
+    """
+    if Departamento.objects.filter(nombre__regex=_nombres(prefijo, 'depto')).exists():
+        raise ValueError(f'Ya hay datos sinteticos con prefijo {prefijo!r}')
+
+    aleatorio = random.Random(seed)
+    ahora = timezone.now()
+    inicio = ahora - timedelta(days=dias)
+    # Numeracion de MAC a continuacion de las ya usadas por otros prefijos
+    ultima_mac = Sensor.objects.filter(
+        mac_address__startswith=mac_sintetica(0)[:9]
+    ).order_by('-mac_address').values_list('mac_address', flat=True).first()
+    primera_mac = int(ultima_mac[9:].replace(':', ''), 16) + 1 if ultima_mac else 0
+
+    with transaction.atomic():
+        Departamento.objects.bulk_create(
+            Departamento(nombre=f'{prefijo}-depto-{d}', descripcion=f'Sitio sintetico {d}')
+            for d in range(departamentos)
+        )
+        deptos = list(Departamento.objects.filter(nombre__regex=_nombres(prefijo, 'depto')).order_by('id'))
+
+        Sensor.objects.bulk_create(
+            (
+                Sensor(
+                    mac_address=mac_sintetica(primera_mac + d * sensores + s),
+                    nombre=f'{prefijo}-sensor-{d}-{s}',
+                    estado=aleatorio.choices(['activo', 'inactivo', 'mantenimiento'], [90, 5, 5])[0],
+                    departamento=depto,
+                    ultima_lectura=ahora - timedelta(seconds=aleatorio.uniform(0, 600)),
+                )
+                for d, depto in enumerate(deptos)
+                for s in range(sensores)
+            ),
+            batch_size=batch_size
+        )
+        sensores_por_depto = {}
+        for pk, departamento_id in _sensores(prefijo).order_by('id').values_list('id', 'departamento_id'):
+            sensores_por_depto.setdefault(departamento_id, []).append(pk)
+
+        if sensores:
+            Barrera.objects.bulk_create(
+                (
+                    Barrera(
+                        nombre=f'{prefijo}-barrera-{d}-{b}',
+                        ubicacion=f'Acceso {b + 1}',
+                        estado=aleatorio.choice(['abierta', 'cerrada']),
+                        sensor_id=sensores_por_depto[depto.pk][b % len(sensores_por_depto[depto.pk])],
+                        departamento=depto,
+                    )
+                    for d, depto in enumerate(deptos)
+                    for b in range(barreras)
+                ),
+                batch_size=batch_size
+            )
+        barreras_creadas = list(
+            Barrera.objects.filter(nombre__regex=_nombres(prefijo, 'barrera')).order_by('id').values_list(
+                'id', 'nombre', 'sensor_id', 'departamento_id'
+            )
+        )
+
+        User.objects.bulk_create(
+            (
+                User(username=f'{prefijo}-operador-{d}-{u}', email=f'{prefijo}-operador-{d}-{u}@example.com')
+                for d in range(departamentos)
+                for u in range(usuarios)
+            ),
+            batch_size=batch_size
+        )
+        users = User.objects.filter(username__regex=_nombres(prefijo, 'operador')).order_by('id')
+        Usuario.objects.bulk_create(
+            (
+                Usuario(user=user, departamento=deptos[i // usuarios], telefono=f'+5690000{i:04d}')
+                for i, user in enumerate(users)
+            ),
+            batch_size=batch_size
+        )
+        usuarios_por_depto = {}
+        for pk, departamento_id in Usuario.objects.filter(
+            user__username__regex=_nombres(prefijo, 'operador')
+        ).values_list('id', 'departamento_id'):
+            usuarios_por_depto.setdefault(departamento_id, []).append(pk)
+
+    creados = 0
+    if barreras_creadas:
+        tipos = list(TIPOS_EVENTO)
+        pesos = list(TIPOS_EVENTO.values())
+        segundos = dias * 86400
+        while creados < eventos:
+            lote = []
+            for _ in range(min(batch_size, eventos - creados)):
+                barrera_id, nombre, sensor_id, departamento_id = aleatorio.choice(barreras_creadas)
+                tipo = aleatorio.choices(tipos, pesos)[0]
+                operadores = usuarios_por_depto.get(departamento_id)
+                lote.append((
+                    tipo,
+                    DESCRIPCIONES[tipo].format(nombre),
+                    sensor_id,
+                    barrera_id,
+                    aleatorio.choice(operadores) if operadores and tipo != 'alerta' else None,
+                    inicio + timedelta(seconds=aleatorio.uniform(0, segundos)),
+                    {'estado_anterior': 'cerrada' if tipo == 'apertura' else 'abierta'},
+                ))
+            _insertar_eventos(lote)
+            creados += len(lote)
+            if progreso is not None:
+                progreso(creados)
+
+        if recalcular_resumenes:
+            resumenes.recalcular(desde=inicio)
+
+    for modelo in (Departamento, Sensor, Barrera):
+        cache.invalidar_modelo(modelo)
+    return {
+        'departamentos': len(deptos),
+        'sensores': sum(len(pks) for pks in sensores_por_depto.values()),
+        'barreras': len(barreras_creadas),
+        'usuarios': sum(len(pks) for pks in usuarios_por_depto.values()),
+        'eventos': creados,
+    }
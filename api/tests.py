@@ -1,3 +1,1595 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, router, transaction
+from django.db.models import Count
+from django.http import HttpResponse, QueryDict
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.utils import json as drf_json
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Departamento, Sensor, Usuario, Barrera, Evento, ResumenEvento, MarcaAgua
+from .serializers import BarreraSerializer, EventoSerializer, SensorSerializer
+from .services import MARCA_SENSORES_SIN_LECTURA, alertar_sensores_sin_lectura, transicion_barrera, BarreraBloqueada
+from .tokens import SmartTokenObtainPairSerializer, StreamToken
+from .sinteticos import mac_sintetica, sembrar, limpiar
+from .campos import columnas_de_lectura, rutas_de_lectura, serializar_filas
+from .pagination import EventoPagination, iterar_por_keyset
+from .parsers import RapidoJSONParser
+from .renderers import RapidoJSONRenderer
+from .views import EventoViewSet
+from .management.commands.perfil_arranque import leer_importtime
+from . import archivo, arranque, diario, exportacion, latidos, metricas, particiones, renderers, replicas, resumenes, roles, shards, sinteticos, tiempo_real, views, views_async
+
+
+def crear_datos(n, prefijo='x'):
+    """Crea n departamentos con sensor, barrera, usuario y evento asociados"""
+    for i in range(n):
+        departamento = Departamento.objects.create(nombre=f'{prefijo}-dep-{i}')
+        sensor = Sensor.objects.create(
+            mac_address=f'{prefijo[:2].upper()}:00:00:00:{i // 256:02X}:{i % 256:02X}',
+            nombre=f'{prefijo}-sensor-{i}',
+            departamento=departamento
+        )
+        barrera = Barrera.objects.create(
+            nombre=f'{prefijo}-barrera-{i}', ubicacion='Acceso', sensor=sensor,
+            departamento=departamento
+        )
+        user = User.objects.create(username=f'{prefijo}-user-{i}')
+        usuario = Usuario.objects.create(user=user, departamento=departamento)
+        Evento.objects.create(
+            tipo='apertura', descripcion='Evento de prueba', sensor=sensor,
+            barrera=barrera, usuario=usuario
+        )
+
+
+class QueryCountTests(TestCase):
+    """Cada endpoint de lista y detalle usa un numero fijo de consultas"""
+
+    # recurso: (modelo, consultas en lista, consultas en detalle)
+    endpoints = {
+        'departamentos': (Departamento, 2, 1),
+        'sensores': (Sensor, 2, 1),
+        'usuarios': (Usuario, 2, 1),
+        'barreras': (Barrera, 2, 1),
+        'eventos': (Evento, 2, 1),
+    }
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@test.cl', 'Admin2024!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def contar_consultas(self, url):
+        # Sin COMMIT (TestCase) las escrituras no invalidan la cache de respuestas
+        caches['respuestas'].clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(ctx.captured_queries)
+
+    def test_listas_no_crecen_con_el_tamano_de_pagina(self):
+        crear_datos(1, prefijo='aa')
+        pocos = {nombre: self.contar_consultas(f'/api/{nombre}/') for nombre in self.endpoints}
+
+        crear_datos(19, prefijo='bb')
+        muchos = {nombre: self.contar_consultas(f'/api/{nombre}/') for nombre in self.endpoints}
+
+        for nombre, (_, esperadas, _) in self.endpoints.items():
+            self.assertEqual(pocos[nombre], esperadas, nombre)
+            self.assertEqual(muchos[nombre], esperadas, nombre)
+
+    def test_detalle(self):
+        crear_datos(3)
+        for nombre, (modelo, _, esperadas) in self.endpoints.items():
+            pk = modelo.objects.values_list('pk', flat=True).first()
+            self.assertEqual(self.contar_consultas(f'/api/{nombre}/{pk}/'), esperadas, nombre)
+
+    def test_sensores_de_departamento(self):
+        crear_datos(1)
+        departamento = Departamento.objects.get()
+        for i in range(10):
+            Sensor.objects.create(
+                mac_address=f'CC:00:00:00:00:{i:02X}', nombre=f'extra-{i}',
+                departamento=departamento
+            )
+        url = f'/api/departamentos/{departamento.pk}/sensores/'
+        self.assertEqual(self.contar_consultas(url), 2)
+
+
+class IngestaEventosTests(TestCase):
+    def setUp(self):
+        crear_datos(2)
+        self.sensores = list(Sensor.objects.order_by('id').values_list('id', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def test_filas_invalidas_no_detienen_el_lote(self):
+        filas = [
+            {'tipo': 'alerta', 'descripcion': 'ok', 'sensor': self.sensores[0]},
+            {'tipo': 'otro', 'descripcion': 'tipo invalido', 'sensor': self.sensores[0]},
+            {'tipo': 'alerta', 'descripcion': 'sin sensor', 'sensor': 999999},
+            {'tipo': 'cierre', 'descripcion': 'ok', 'sensor': self.sensores[1], 'metadata': {'a': 1}},
+        ]
+        response = self.client.post('/api/eventos/bulk/', filas, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recibidos'], 4)
+        self.assertEqual(response.data['creados'], 2)
+        self.assertEqual([error['indice'] for error in response.data['errores']], [1, 2])
+        self.assertIn('tipo', response.data['errores'][0]['errores'])
+        self.assertEqual(response.data['errores'][1]['errores'], {'sensor': ['Sensor no existe']})
+        self.assertEqual(Evento.objects.filter(descripcion='ok').count(), 2)
+
+        response = self.client.post('/api/eventos/bulk/', filas[1:3], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['creados'], 0)
+
+    def test_ultima_lectura_por_sensor(self):
+        inicio = timezone.now()
+        momentos = iter([inicio + timedelta(seconds=s) for s in (1, 5, 3)])
+        filas = [
+            {'tipo': 'alerta', 'descripcion': 'x', 'sensor': sensor}
+            for sensor in (self.sensores[0], self.sensores[0], self.sensores[1])
+        ]
+        # default de Evento.timestamp (timezone.now guardado en el campo)
+        with mock.patch.object(Evento._meta.get_field('timestamp'), '_get_default', side_effect=lambda: next(momentos)):
+            response = self.client.post('/api/eventos/bulk/', filas, format='json')
+        self.assertEqual(response.data['creados'], 3)
+        lecturas = dict(Sensor.objects.values_list('id', 'ultima_lectura'))
+        self.assertEqual(lecturas[self.sensores[0]], inicio + timedelta(seconds=5))
+        self.assertEqual(lecturas[self.sensores[1]], inicio + timedelta(seconds=3))
+
+    def test_solo_admin_y_limite_de_filas(self):
+        operador = User.objects.get(username='x-user-0')
+        self.client.force_authenticate(operador)
+        fila = {'tipo': 'alerta', 'descripcion': 'x', 'sensor': self.sensores[0]}
+        self.assertEqual(self.client.post('/api/eventos/bulk/', [fila], format='json').status_code, 403)
+
+        self.client.force_authenticate(User.objects.get(username='admin'))
+        with mock.patch.object(EventoViewSet, 'bulk_max_filas', 2):
+            response = self.client.post('/api/eventos/bulk/', [fila] * 3, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Maximo 2', response.data['error'])
+        response = self.client.post('/api/eventos/bulk/', fila, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Evento.objects.filter(tipo='alerta').count(), 0)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        crear_datos(1)
+        sensor = Sensor.objects.get()
+        for i in range(7):
+            Evento.objects.create(tipo='alerta', descripcion=f'extra-{i}', sensor=sensor)
+        # Empates de timestamp: el orden lo decide el id
+        Evento.objects.filter(descripcion__in=['extra-2', 'extra-3', 'extra-4', 'extra-5']).update(
+            timestamp=Evento.objects.get(descripcion='extra-2').timestamp
+        )
+        self.ids = list(Evento.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def recorrer(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [evento['id'] for evento in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_recorrido_con_empates(self):
+        self.assertEqual(len(self.ids), 8)
+        for page_size in (1, 2, 3, 8):
+            self.assertEqual(self.recorrer(f'/api/eventos/?cursor=&page_size={page_size}'), self.ids)
+
+    def test_max_page_size_y_cursor_invalido(self):
+        with mock.patch.object(EventoPagination, 'max_page_size', 3):
+            response = self.client.get('/api/eventos/?cursor=&page_size=1000')
+        self.assertEqual([evento['id'] for evento in response.data['results']], self.ids[:3])
+        self.assertIsNotNone(response.data['next'])
+
+        for cursor in ('no-es-base64', 'eHx5', EventoPagination().encode_cursor('2024-01-01T00:00:00', 'x')):
+            response = self.client.get(f'/api/eventos/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+class FiltrosEventosTests(TestCase):
+    def setUp(self):
+        crear_datos(3)
+        self.sensores = list(Sensor.objects.order_by('id').values_list('id', flat=True))
+        Evento.objects.create(
+            tipo='alerta', descripcion='con metadata', sensor_id=self.sensores[0],
+            metadata={'estado_anterior': 'cerrada', 'motivo': 'prueba'}
+        )
+        Evento.objects.filter(descripcion='Evento de prueba', sensor_id=self.sensores[2]).update(
+            timestamp=timezone.now() - timedelta(days=10)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def ids(self, consulta):
+        response = self.client.get(f'/api/eventos/?{consulta}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(evento['sensor'] for evento in response.data['results'])
+
+    def test_filtros(self):
+        s0, s1, s2 = self.sensores
+        self.assertEqual(self.ids(f'sensor__in={s0},{s2}'), [s0, s0, s2])
+        self.assertEqual(self.ids('tipo__in=alerta,cierre'), [s0])
+        self.assertEqual(self.ids(f'desde={(timezone.now() - timedelta(days=1)).isoformat()[:19]}'), [s0, s0, s1])
+        self.assertEqual(self.ids(f'hasta={(timezone.now() - timedelta(days=1)).isoformat()[:19]}'), [s2])
+        self.assertEqual(self.ids('metadata__motivo=prueba'), [s0])
+        self.assertEqual(self.ids('metadata__estado_anterior=cerrada'), [s0])
+
+    def test_parametros_invalidos(self):
+        for consulta, param in [
+            ('desde=2024-13-01T00:00', 'desde'),
+            ('hasta=2024-02-30T00:00:00', 'hasta'),
+            ('desde=ayer', 'desde'),
+            ('tipo__in=alerta,otro', 'tipo__in'),
+            ('sensor__in=1,x', 'sensor__in'),
+            ('metadata__motivo__regex=.*', 'metadata__motivo__regex'),
+            ('metadata__motivo__gt=a', 'metadata__motivo__gt'),
+            ('metadata___x=a', 'metadata___x'),
+        ]:
+            response = self.client.get(f'/api/eventos/?{consulta}')
+            self.assertEqual(response.status_code, 400, consulta)
+            self.assertIn(param, response.data, consulta)
+
+    def test_metadata_siempre_filtra_por_clave(self):
+        s0, s1, _ = self.sensores
+        Evento.objects.create(
+            tipo='alerta', descripcion='claves con nombre de lookup', sensor_id=s1,
+            metadata={'isnull': 'a', 'contains': 'b', 'gt': 'c', 'regex': '.*', 'has_key': 'd'}
+        )
+        for consulta, esperados in [
+            ('metadata__isnull=a', [s1]),
+            ('metadata__isnull=true', []),
+            ('metadata__contains=b', [s1]),
+            ('metadata__contains=a', []),
+            ('metadata__gt=c', [s1]),
+            ('metadata__gt=a', []),
+            ('metadata__regex=.*', [s1]),
+            ('metadata__regex=a', []),
+            ('metadata__has_key=d', [s1]),
+            ('metadata__has_key=motivo', []),
+        ]:
+            self.assertEqual(self.ids(consulta), esperados, consulta)
+
+        # El archivo aplica las mismas condiciones
+        fila = {'metadata': {'isnull': 'a'}}
+        for consulta, cumple in [('metadata__isnull=a', True), ('metadata__contains=a', False)]:
+            condiciones = archivo._condiciones(QueryDict(consulta))
+            self.assertEqual(all(condicion(fila) for condicion in condiciones), cumple, consulta)
+
+
+class CamposDinamicosTests(TestCase):
+    """?fields= / ?omit= y la serializacion desde .values() frente al serializer"""
+
+    def setUp(self):
+        crear_datos(3)
+        # Relaciones nulas: la ruta .values() debe omitir los mismos campos que DRF
+        sensor = Sensor.objects.create(mac_address='FA:00:00:00:00:01', nombre='sin depto')
+        Barrera.objects.create(nombre='sin sensor', ubicacion='X')
+        Evento.objects.create(tipo='alerta', descripcion='solo sensor', sensor=sensor, metadata={'a': [1, 2]})
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def test_values_igual_al_serializer(self):
+        request = Request(RequestFactory().get('/'))
+        for serializer_class, queryset in [
+            (EventoSerializer, Evento.objects.order_by('id')),
+            (SensorSerializer, Sensor.objects.order_by('id')),
+            (BarreraSerializer, Barrera.objects.order_by('id')),
+        ]:
+            serializer = serializer_class(context={'request': request})
+            rutas = rutas_de_lectura(serializer)
+            self.assertIsNotNone(rutas, serializer_class.__name__)
+            filas = queryset.values(*columnas_de_lectura(rutas))
+            self.assertEqual(
+                serializar_filas(filas, serializer, rutas),
+                serializer_class(queryset, many=True, context={'request': request}).data,
+                serializer_class.__name__
+            )
+
+    def test_fields_y_omit(self):
+        for recurso in ['eventos', 'sensores', 'barreras', 'departamentos', 'usuarios']:
+            completos = self.client.get(f'/api/{recurso}/?page_size=100').json()['results']
+            # Las filas con relaciones nulas omiten algunos campos
+            campos = list(dict.fromkeys(campo for fila in completos for campo in fila))
+            elegidos, omitidos = campos[1:3], campos[:2]
+            for consulta, esperados in [
+                (f'fields={",".join(elegidos)},no_existe', elegidos),
+                (f'omit={",".join(omitidos)}', campos[2:]),
+                (f'fields={",".join(elegidos)}&omit={elegidos[0]}', elegidos[1:]),
+            ]:
+                resultados = self.client.get(f'/api/{recurso}/?page_size=100&{consulta}').json()['results']
+                self.assertEqual(
+                    resultados, [{c: fila[c] for c in esperados if c in fila} for fila in completos],
+                    f'{recurso}?{consulta}'
+                )
+
+            pk = completos[0]['id']
+            detalle = self.client.get(f'/api/{recurso}/{pk}/?fields={elegidos[0]}').json()
+            self.assertEqual(detalle, {elegidos[0]: completos[0][elegidos[0]]})
+
+    def test_poda_la_consulta(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/eventos/?fields=id,tipo')
+        self.assertEqual(response.status_code, 200)
+        consulta = next(q['sql'] for q in ctx.captured_queries if 'FROM "eventos"' in q['sql'] and 'COUNT' not in q['sql'])
+        self.assertNotIn('JOIN', consulta)
+        self.assertNotIn('metadata', consulta)
+
+
+class JSONRapidoTests(SimpleTestCase):
+    """RapidoJSONRenderer y RapidoJSONParser producen lo mismo que el JSON de DRF"""
+
+    datos = {
+        'texto': 'año ✓ 🚧 "comillas" \\ \n', 'separadores': 'a\u2028b\u2029c',
+        'enteros': [0, -1, 2 ** 53], 'reales': [0.1, 1.5, -2.25], 'nulo': None, 'bool': [True, False],
+        'utc': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'local': datetime(2024, 5, 1, 9, 30, tzinfo=dt_timezone(timedelta(hours=-3))),
+        'ingenua': datetime(2024, 5, 1, 9, 30), 'fecha': date(2024, 5, 1), 'hora': time(8, 15, 30),
+        'decimal': Decimal('12.50'), 'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'duracion': timedelta(hours=1, seconds=5), 1: 'clave entera',
+        'anidado': [{'a': {'b': []}}, []],
+    }
+
+    def test_renderer(self):
+        rapido = RapidoJSONRenderer()
+        drf = JSONRenderer()
+        self.assertIsNotNone(renderers.orjson)
+        for data in [self.datos, [self.datos], {}, [], 'texto', 5, None]:
+            self.assertEqual(rapido.render(data), drf.render(data), data)
+
+        # Con indentacion se delega en DRF
+        contexto = {'indent': 2}
+        self.assertEqual(rapido.render(self.datos, renderer_context=contexto), drf.render(self.datos, renderer_context=contexto))
+
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(rapido.render(self.datos), drf.render(self.datos))
+
+    def test_parser(self):
+        rapido = RapidoJSONParser()
+        drf = JSONParser()
+
+        def parsear(parser, contenido, **contexto):
+            return parser.parse(io.BytesIO(contenido), 'application/json', contexto)
+
+        contenido = drf_json.dumps({'a': 'año ✓', 'b': [1, 2.5, None, True], 'c': {'d': 'x\u2028'}}).encode()
+        self.assertEqual(parsear(rapido, contenido), parsear(drf, contenido))
+        latin = '{"a": "año"}'.encode('latin-1')
+        self.assertEqual(parsear(rapido, latin, encoding='latin-1'), {'a': 'año'})
+
+        for invalido in [b'{"a": NaN}', b'[Infinity]', b'{"a": 1', b'']:
+            with self.assertRaises(ParseError):
+                parsear(drf, invalido)
+            with self.assertRaises(ParseError):
+                parsear(rapido, invalido)
+
+
+class EstadisticasTests(TestCase):
+    """Los totales de estadisticas (resumenes) coinciden con contar la tabla eventos"""
+
+    def setUp(self):
+        sembrar(departamentos=2, sensores=3, barreras=2, usuarios=1, eventos=400, dias=5)
+        self.barrera = Barrera.objects.filter(nombre__startswith='sim-').first()
+        # Se agregan por el camino de las peticiones (transicion y post_save)
+        transicion_barrera(self.barrera.pk, 'cerrar')
+        transicion_barrera(self.barrera.pk, 'abrir')
+        Evento.objects.create(tipo='alerta', descripcion='x', sensor_id=self.barrera.sensor_id)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def estadisticas(self, consulta):
+        desde = (timezone.now() - timedelta(days=30)).isoformat()[:19]
+        response = self.client.get(f'/api/eventos/estadisticas/?granularidad=dia&desde={desde}{consulta}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['resultados']
+
+    def test_totales_como_la_tabla(self):
+        por_tipo = {}
+        for fila in self.estadisticas(''):
+            por_tipo[fila['tipo']] = por_tipo.get(fila['tipo'], 0) + fila['total']
+        tabla = dict(Evento.objects.order_by().values_list('tipo').annotate(total=Count('id')))
+        self.assertEqual(por_tipo, tabla)
+
+        sensor = self.barrera.sensor_id
+        por_sensor = sum(fila['total'] for fila in self.estadisticas(f'&sensor={sensor}&agrupar=sensor'))
+        self.assertEqual(por_sensor, Evento.objects.filter(sensor_id=sensor).count())
+        departamento = self.barrera.departamento_id
+        self.assertEqual(
+            sum(fila['total'] for fila in self.estadisticas(f'&departamento={departamento}&tipo__in=alerta')),
+            Evento.objects.filter(sensor__departamento_id=departamento, tipo='alerta').count()
+        )
+
+        # recalcular reconstruye los mismos resumenes desde la tabla
+        antes = self.estadisticas('&agrupar=barrera')
+        resumenes.recalcular()
+        self.assertEqual(self.estadisticas('&agrupar=barrera'), antes)
+
+    def test_rango_y_granularidad_invalidos(self):
+        response = self.client.get('/api/eventos/estadisticas/?granularidad=minuto&desde=2000-01-01T00:00:00')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/eventos/estadisticas/?granularidad=semana')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportacionTests(TestCase):
+    def setUp(self):
+        crear_datos(3)
+        sensor = Sensor.objects.order_by('id').first()
+        Evento.objects.create(
+            tipo='alerta', descripcion='coma, "comillas"\ny salto', sensor=sensor,
+            metadata={'motivo': 'ñandú'}
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def exportar(self, consulta):
+        response = self.client.get(f'/api/eventos/export/?{consulta}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_y_ndjson(self):
+        esperados = list(Evento.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+        response, contenido = self.exportar('format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('eventos.csv', response['Content-Disposition'])
+        filas = list(csv.DictReader(io.StringIO(contenido)))
+        self.assertEqual([int(fila['id']) for fila in filas], esperados)
+        alerta = next(fila for fila in filas if fila['tipo'] == 'alerta')
+        self.assertEqual(alerta['descripcion'], 'coma, "comillas"\ny salto')
+        self.assertEqual(json.loads(alerta['metadata']), {'motivo': 'ñandú'})
+        self.assertEqual(alerta['barrera'], '')
+
+        response, contenido = self.exportar('format=ndjson&tipo=apertura')
+        filas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(len(filas), 3)
+        evento = Evento.objects.select_related('sensor', 'barrera').get(pk=filas[0]['id'])
+        self.assertEqual(filas[0]['sensor_nombre'], evento.sensor.nombre)
+        self.assertEqual(filas[0]['barrera_nombre'], evento.barrera.nombre)
+        self.assertEqual(filas[0]['timestamp'], timezone.localtime(evento.timestamp).isoformat())
+
+    def test_bloques_con_empates(self):
+        Evento.objects.update(timestamp=timezone.now())
+        esperados = list(Evento.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        filas = [json.loads(linea) for linea in exportacion.eventos_ndjson(Evento.objects.all(), chunk_size=2)]
+        self.assertEqual([fila['id'] for fila in filas], esperados)
+
+
+class CacheRolesTests(TestCase):
+    def setUp(self):
+        roles.cache_roles.clear()
+        self.addCleanup(roles.cache_roles.clear)
+        crear_datos(1)
+        self.usuario = Usuario.objects.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario.user)
+
+    def crear_departamento(self):
+        return self.client.post('/api/departamentos/', {'nombre': f'nuevo-{Departamento.objects.count()}'}).status_code
+
+    def test_invalidacion_al_cambiar_el_perfil(self):
+        self.assertEqual(self.crear_departamento(), 403)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.crear_departamento(), 403)
+        self.assertFalse(any('usuarios' in q['sql'] for q in ctx.captured_queries))
+
+        self.usuario.rol = 'admin'
+        self.usuario.save()
+        self.assertEqual(self.crear_departamento(), 201)
+
+        self.usuario.activo = False
+        self.usuario.save()
+        self.assertEqual(self.crear_departamento(), 403)
+
+        self.usuario.activo = True
+        self.usuario.save()
+        self.usuario.delete()
+        self.assertEqual(self.crear_departamento(), 403)
+
+
+class CacheRespuestasTests(TestCase):
+    def setUp(self):
+        caches['respuestas'].clear()
+        crear_datos(2)
+        self.barrera = Barrera.objects.order_by('id').first()
+        self.admin = User.objects.create_superuser('admin', 'admin@test.cl', 'x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url, client=None, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = (client or self.client).get(url, headers=headers)
+        return response, len(ctx.captured_queries)
+
+    def test_etag_y_304(self):
+        url = f'/api/barreras/{self.barrera.pk}/'
+        response, consultas = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(consultas, 0)
+        etag = response['ETag']
+
+        response, consultas = self.get(url, **{'If-None-Match': etag})
+        self.assertEqual((response.status_code, consultas), (304, 0))
+        self.assertEqual(response['ETag'], etag)
+        response, consultas = self.get(url, **{'If-None-Match': '"otro"'})
+        self.assertEqual((response.status_code, consultas), (200, 0))
+        self.assertEqual(response.data['estado'], 'cerrada')
+
+    def test_clave_por_usuario(self):
+        self.get('/api/barreras/')
+        otro = APIClient()
+        otro.force_authenticate(User.objects.get(username='x-user-0'))
+        response, consultas = self.get('/api/barreras/', client=otro)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(consultas, 0)
+        self.assertEqual(self.get('/api/barreras/')[1], 0)
+
+    def test_invalidacion_al_confirmar(self):
+        url = f'/api/barreras/{self.barrera.pk}/'
+        etag = self.get(url)[0]['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.client.post(f'{url}abrir/').status_code, 200)
+            # Antes del COMMIT sigue la version anterior
+            response, consultas = self.get(url, **{'If-None-Match': etag})
+            self.assertEqual((response.status_code, consultas), (304, 0))
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+
+        response, _ = self.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['estado'], 'abierta')
+        self.assertNotEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/barreras/comando/', {'accion': 'cerrar', 'barreras': [self.barrera.pk]}, format='json')
+        self.assertEqual(self.get(url)[0].data['estado'], 'cerrada')
+        lista = self.get('/api/barreras/')[0].data['results']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{url}abrir/')
+        self.assertNotEqual(self.get('/api/barreras/')[0].data['results'], lista)
+
+
+class AutenticacionJWTTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        crear_datos(1)
+        self.usuario = Usuario.objects.select_related('user').get()
+        self.usuario.rol = 'admin'
+        self.usuario.save()
+        self.user = self.usuario.user
+
+    def get(self, token, url='/api/departamentos/'):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        return response.status_code, [q['sql'] for q in ctx.captured_queries]
+
+    def refrescar(self, refresh):
+        return APIClient().post('/api/token/refresh/', {'refresh': str(refresh)}).status_code
+
+    def test_claims_sin_consultar_usuario(self):
+        refresh = SmartTokenObtainPairSerializer.get_token(self.user)
+        codigo, consultas = self.get(refresh.access_token)
+        self.assertEqual(codigo, 200)
+        self.assertFalse(any('auth_user' in sql for sql in consultas))
+        self.assertEqual(self.refrescar(refresh), 200)
+
+    def test_token_sin_claims_usa_la_bd(self):
+        token = AccessToken.for_user(self.user)
+        codigo, consultas = self.get(token)
+        self.assertEqual(codigo, 200)
+        self.assertTrue(any('auth_user' in sql for sql in consultas))
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get(token)[0], 401)
+
+    def test_revocacion_al_cambiar_user_o_perfil(self):
+        refresh = SmartTokenObtainPairSerializer.get_token(self.user)
+        # Solo last_login (login de sesion): los tokens siguen validos
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(self.get(refresh.access_token)[0], 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.usuario.rol = 'operador'
+            self.usuario.save()
+        self.assertEqual(self.get(refresh.access_token)[0], 401)
+        # El refresh token llevaria los claims viejos al nuevo access token
+        self.assertEqual(self.refrescar(refresh), 401)
+
+        nuevo = SmartTokenObtainPairSerializer.get_token(self.user)
+        self.assertEqual(nuevo.access_token['rol'], 'operador')
+        self.assertEqual(self.get(nuevo.access_token)[0], 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get(nuevo.access_token)[0], 401)
+        self.assertEqual(self.get(AccessToken.for_user(self.user))[0], 401)
+
+
+class StreamTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        crear_datos(1)
+        self.user = User.objects.get()
+        self.departamento = Departamento.objects.get().pk
+        # Broker propio: las suscripciones del test no quedan para los demas
+        parche = mock.patch.object(tiempo_real, '_broker', None)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    async def abrir(self, consulta, **headers):
+        request = AsyncRequestFactory().get(f'/api/stream/?{consulta}', headers=headers)
+        return await views.stream(request)
+
+    def test_token_de_stream(self):
+        client = APIClient()
+        self.assertEqual(client.post('/api/stream/token/').status_code, 401)
+        client.force_authenticate(self.user)
+        response = client.post('/api/stream/token/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['expira_en'], 60)
+        self.assertEqual(StreamToken(response.data['token'])['user_id'], self.user.pk)
+
+    async def test_autenticacion(self):
+        refresh = await sync_to_async(SmartTokenObtainPairSerializer.get_token)(self.user)
+        # Un access token solo se acepta en el header, no en la URL (log de accesos)
+        self.assertEqual((await self.abrir(f'token={refresh.access_token}')).status_code, 401)
+        self.assertEqual((await self.abrir('token=basura')).status_code, 401)
+        self.assertEqual((await self.abrir('')).status_code, 401)
+        response = await self.abrir('', Authorization=f'Bearer {refresh.access_token}')
+        self.assertEqual(response.status_code, 200)
+        await response.streaming_content.aclose()
+
+    async def test_formato_sse(self):
+        token = StreamToken.for_user(self.user)
+        response = await self.abrir(f'token={token}&departamento={self.departamento}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        contenido = response.streaming_content
+        self.assertEqual(await anext(contenido), b'retry: 3000\n\n')
+
+        broker = tiempo_real.get_broker()
+        self.assertTrue(broker.tiene_suscriptores())
+        mensaje = {'tipo': 'barrera', 'id': 1, 'departamento': self.departamento, 'estado': 'abierta'}
+        broker.publicar({**mensaje, 'departamento': self.departamento + 1})
+        broker.publicar(mensaje)
+        self.assertEqual(
+            await anext(contenido), f'event: barrera\ndata: {json.dumps(mensaje)}\n\n'.encode()
+        )
+        await contenido.aclose()
+
+
+    async def test_redis_reparte_entre_workers(self):
+        cliente = RedisFalso()
+        modulo = SimpleNamespace(Redis=SimpleNamespace(from_url=lambda url: cliente), RedisError=ConnectionError)
+        with mock.patch.object(tiempo_real, 'redis', modulo), override_settings(TIEMPO_REAL_REDIS_URL='redis://x'):
+            # Un broker por worker: el cliente esta conectado al primero
+            conectado, otro = tiempo_real.RedisBroker(), tiempo_real.RedisBroker()
+            self.assertFalse(otro.tiene_suscriptores())
+            suscripcion = conectado.suscribir(self.departamento)
+            otro._oyentes = (0, float('-inf'))
+            self.assertTrue(otro.tiene_suscriptores())
+            mensaje = {'tipo': 'barrera', 'id': 1, 'departamento': self.departamento, 'estado': 'abierta'}
+            otro.publicar({**mensaje, 'departamento': self.departamento + 1})
+            otro.publicar(mensaje)
+            self.assertEqual(await suscripcion.siguiente(timeout=5), mensaje)
+
+
+class RedisFalso:
+    """Pub/sub de redis en memoria, compartido por los brokers de un test"""
+
+    def __init__(self):
+        self.colas = []
+
+    def publish(self, canal, datos):
+        for cola in self.colas:
+            cola.put({'type': 'message', 'channel': canal, 'data': datos})
+        return len(self.colas)
+
+    def pubsub_numsub(self, canal):
+        return [(canal, len(self.colas))]
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        cola = queue.Queue()
+        return SimpleNamespace(
+            subscribe=lambda canal: self.colas.append(cola),
+            listen=lambda: iter(cola.get, None),
+            close=lambda: None,
+        )
+
+
+class LatidosTests(TestCase):
+    """Los latidos se acumulan en el buffer del proceso y se escriben juntos al vaciarlo"""
+
+    def setUp(self):
+        self.sensores = [
+            Sensor.objects.create(mac_address=f'EE:00:00:00:00:0{i}', nombre=f'latido-{i}') for i in range(3)
+        ]
+        self.buffer = latidos.BufferLatidos(ventana=60, maximo=100)
+        patcher = mock.patch.object(latidos, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.buffer.vaciar)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('latidos', password='x'))
+
+    def enviar(self, filas):
+        return self.client.post('/api/sensores/latidos/', filas, format='json')
+
+    def test_acumula_hasta_vaciar(self):
+        response = self.enviar([
+            {'mac_address': 'EE:00:00:00:00:00'},
+            {'mac_address': 'EE:00:00:00:00:01', 'estado': 'mantenimiento'},
+            {'mac_address': 'no-es-mac'},
+        ])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['aceptados'], 2)
+        self.assertEqual([e['indice'] for e in response.json()['errores']], [2])
+        # Nada se escribe hasta el vaciado
+        self.assertFalse(Sensor.objects.filter(ultima_lectura__isnull=False).exists())
+
+        with self.assertNumQueries(5):
+            # SELECT de los sensores y un UPDATE por grupo (mas SAVEPOINT/RELEASE del atomic)
+            self.assertEqual(self.buffer.vaciar(), 2)
+        estados = dict(Sensor.objects.filter(ultima_lectura__isnull=False).values_list('mac_address', 'estado'))
+        self.assertEqual(estados, {'EE:00:00:00:00:00': 'activo', 'EE:00:00:00:00:01': 'mantenimiento'})
+        self.assertEqual(self.buffer.vaciar(), 0)
+
+    def test_agrupa_latidos_del_mismo_sensor(self):
+        mac = self.sensores[0].mac_address
+        ahora = timezone.now()
+        self.buffer.registrar([
+            (mac, 'inactivo', ahora - timedelta(seconds=5)),
+            (mac, None, ahora),
+            (mac, None, ahora - timedelta(seconds=10)),
+        ])
+        self.assertEqual(len(self.buffer._pendientes), 1)
+        self.assertEqual(self.buffer.vaciar(), 1)
+        sensor = Sensor.objects.get(pk=self.sensores[0].pk)
+        # Un latido sin estado no descarta el cambio informado antes en la ventana
+        self.assertEqual((sensor.estado, sensor.ultima_lectura), ('inactivo', ahora))
+
+    def test_vacia_al_llegar_al_maximo(self):
+        self.buffer.maximo = 2
+        self.enviar([{'mac_address': self.sensores[0].mac_address}])
+        self.assertFalse(Sensor.objects.filter(ultima_lectura__isnull=False).exists())
+        self.enviar([{'mac_address': self.sensores[1].mac_address}])
+        self.assertEqual(Sensor.objects.filter(ultima_lectura__isnull=False).count(), 2)
+        self.assertEqual(self.buffer._pendientes, {})
+
+    def test_ventana_cero_escribe_de_inmediato(self):
+        self.buffer.ventana = 0
+        with self.assertLogs('api.latidos', 'WARNING'):
+            self.enviar([{'mac_address': self.sensores[2].mac_address}, {'mac_address': 'EE:00:00:00:00:FF'}])
+        self.assertIsNotNone(Sensor.objects.get(pk=self.sensores[2].pk).ultima_lectura)
+        self.assertIsNone(self.buffer._timer)
+
+
+class AlertasSinLecturaTests(TestCase):
+    """alertar_sensores_sin_lectura avanza una marca de agua y alerta una vez por corte"""
+
+    umbral = timedelta(minutes=10)
+
+    def setUp(self):
+        self.ahora = timezone.now()
+        self.viejo = Sensor.objects.create(
+            mac_address='EF:00:00:00:00:01', nombre='viejo', ultima_lectura=self.ahora - timedelta(hours=1)
+        )
+        self.reciente = Sensor.objects.create(
+            mac_address='EF:00:00:00:00:02', nombre='reciente', ultima_lectura=self.ahora - timedelta(minutes=5)
+        )
+        Sensor.objects.create(mac_address='EF:00:00:00:00:03', nombre='nunca')
+        Sensor.objects.create(
+            mac_address='EF:00:00:00:00:04', nombre='inactivo', estado='inactivo',
+            ultima_lectura=self.ahora - timedelta(hours=1)
+        )
+
+    def alertar(self, minutos=0, **kwargs):
+        return alertar_sensores_sin_lectura(self.umbral, ahora=self.ahora + timedelta(minutes=minutos), **kwargs)
+
+    def alertados(self):
+        return list(Evento.objects.filter(tipo='alerta').order_by('id').values_list('sensor__nombre', flat=True))
+
+    def test_segunda_ejecucion_no_repite(self):
+        self.assertEqual(self.alertar(), 1)
+        self.assertEqual(self.alertar(), 0)
+        self.assertEqual(self.alertar(minutos=1), 0)
+        self.assertEqual(self.alertados(), ['viejo'])
+        marca = MarcaAgua.objects.get(nombre=MARCA_SENSORES_SIN_LECTURA)
+        self.assertEqual(marca.valor, self.ahora + timedelta(minutes=1) - self.umbral)
+
+    def test_sensor_que_vence_despues(self):
+        self.assertEqual(self.alertar(), 1)
+        # La lectura de 'reciente' cae en el rango de la siguiente ejecucion
+        self.assertEqual(self.alertar(minutos=6), 1)
+        self.assertEqual(self.alertados(), ['viejo', 'reciente'])
+
+        # Vuelve a reportar y se corta otra vez: nueva alerta en un rango posterior
+        Sensor.objects.filter(pk=self.viejo.pk).update(ultima_lectura=self.ahora + timedelta(minutes=7))
+        self.assertEqual(self.alertar(minutos=8), 0)
+        self.assertEqual(self.alertar(minutos=20), 1)
+        self.assertEqual(self.alertados(), ['viejo', 'reciente', 'viejo'])
+
+        # reiniciar ignora la marca y recorre todo el historial
+        self.assertEqual(self.alertar(minutos=20, reiniciar=True), 2)
+
+    def test_marca_avanza_solo_con_commit(self):
+        with mock.patch('api.services.registrar_eventos', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.alertar(minutos=6, chunk_size=1)
+        # El rollback descarta las alertas y deja la marca donde estaba
+        self.assertFalse(MarcaAgua.objects.exists())
+        self.assertEqual(self.alertados(), [])
+
+        self.assertEqual(self.alertar(minutos=6, chunk_size=1), 2)
+        self.assertEqual(sorted(self.alertados()), ['reciente', 'viejo'])
+
+
+@override_settings(METRICAS_ACTIVAS=True)
+class MetricasTests(TestCase):
+    """MetricasMiddleware y /api/metrics/"""
+
+    linea = re.compile(r'^(?P<metrica>[a-z_]+)(?:\{(?P<etiquetas>[^}]*)\})? (?P<valor>[0-9.e+-]+)$')
+
+    def setUp(self):
+        metricas.registro.reiniciar()
+        self.addCleanup(metricas.registro.reiniciar)
+        crear_datos(2)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def series(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        series = {}
+        for linea in response.content.decode().splitlines():
+            if linea.startswith('#'):
+                continue
+            match = self.linea.match(linea)
+            self.assertIsNotNone(match, linea)
+            etiquetas = dict(re.findall(r'(\w+)="([^"]*)"', match['etiquetas'] or ''))
+            # Cada serie lleva el pid del worker
+            self.assertEqual(etiquetas.pop('pid', None), str(os.getpid()), linea)
+            series[(match['metrica'], tuple(sorted(etiquetas.items())))] = float(match['valor'])
+        return series
+
+    def test_series_por_vista(self):
+        self.client.get('/api/sensores/')
+        self.client.get('/api/eventos/?fields=id,tipo')
+        series = self.series()
+        vista = (('metodo', 'GET'), ('vista', 'sensor-list'))
+        self.assertEqual(series[('api_peticiones_total', (('estado', '200'), *vista))], 1)
+        for metrica in ['api_peticion_segundos', 'api_db_consultas', 'api_db_segundos',
+                        'api_serializacion_segundos', 'api_render_segundos']:
+            self.assertEqual(series[(f'{metrica}_count', vista)], 1, metrica)
+            self.assertEqual(series[(f'{metrica}_bucket', (('le', '+Inf'), *vista))], 1, metrica)
+        self.assertGreater(series[('api_db_consultas_sum', vista)], 0)
+        self.assertGreater(series[('api_serializacion_segundos_sum', vista)], 0)
+        # La ruta .values() tambien mide la serializacion
+        self.assertGreater(series[('api_serializacion_segundos_sum', (('metodo', 'GET'), ('vista', 'evento-list')))], 0)
+
+    def test_serializacion_descuenta_consultas(self):
+        medicion = metricas.Medicion(RequestFactory().get('/'), None)
+        token = metricas._medicion_actual.set(medicion)
+        self.addCleanup(metricas._medicion_actual.reset, token)
+
+        def serializar():
+            medicion.db += 10
+            # Anidada: no se cuenta dos veces
+            return metricas.medir_serializacion(lambda: 'ok')
+
+        self.assertEqual(metricas.medir_serializacion(serializar), 'ok')
+        self.assertLess(medicion.serializacion, 0.5)
+        self.assertFalse(medicion.serializando)
+
+    def test_autenticacion(self):
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, 401)
+        operador = APIClient()
+        operador.force_authenticate(User.objects.get(username='x-user-0'))
+        self.assertEqual(operador.get('/api/metrics/').status_code, 403)
+        with override_settings(METRICAS_ACTIVAS=False):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+
+class VistasAsyncTests(TestCase):
+    """Las vistas async (API_ASYNC) responden lo mismo que las de DRF"""
+
+    def setUp(self):
+        crear_datos(4)
+        self.admin = User.objects.create_superuser('admin', 'admin@test.cl', 'x')
+        self.token = SmartTokenObtainPairSerializer.get_token(self.admin).access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def async_(self, vista, metodo, url, token=None, **kwargs):
+        factory = AsyncRequestFactory()
+        headers = {'Authorization': f'Bearer {token or self.token}'} if token != '' else {}
+        if metodo == 'post':
+            request = factory.post(url, json.dumps(kwargs.pop('datos', {})), content_type='application/json', headers=headers)
+        else:
+            request = factory.get(url, headers=headers)
+        response = async_to_sync(vista)(request, **kwargs)
+        return response.status_code, json.loads(response.content)
+
+    def test_lista_de_eventos(self):
+        sensor = Sensor.objects.first().pk
+        for consulta in ['', '?page_size=2&page=2', '?cursor=&page_size=3', f'?sensor={sensor}',
+                         '?fields=id,tipo,sensor_nombre', '?omit=metadata&tipo__in=apertura', '?page=99', '?desde=x']:
+            sync = self.client.get(f'/api/eventos/{consulta}')
+            self.assertEqual(
+                self.async_(views_async.eventos, 'get', f'/api/eventos/{consulta}'),
+                (sync.status_code, sync.json()), consulta
+            )
+        # El siguiente cursor de la vista async sigue la misma secuencia
+        _, pagina = self.async_(views_async.eventos, 'get', '/api/eventos/?cursor=&page_size=3')
+        self.assertEqual(
+            self.async_(views_async.eventos, 'get', pagina['next'].replace('http://testserver', ''))[1],
+            self.client.get(pagina['next']).json()
+        )
+
+    def test_transiciones_y_errores(self):
+        barrera = Barrera.objects.first().pk
+        codigo, data = self.async_(views_async.barrera_abrir, 'post', '/', pk=barrera)
+        self.assertEqual(codigo, 200)
+        sync = self.client.post(f'/api/barreras/{barrera}/abrir/')
+        self.assertEqual((sync.status_code, sync.json()), (codigo, data))
+        self.assertEqual(self.async_(views_async.barrera_cerrar, 'post', '/', pk=barrera)[1]['estado'], 'cerrada')
+        self.assertEqual(self.async_(views_async.barrera_abrir, 'post', '/', pk=999999)[0], 404)
+        self.assertEqual(self.async_(views_async.barrera_abrir, 'get', '/', pk=barrera)[0], 405)
+        self.assertEqual(self.async_(views_async.eventos, 'get', '/', token='')[0], 401)
+
+        datos = {'tipo': 'alerta', 'descripcion': 'async', 'sensor': Sensor.objects.first().pk}
+        codigo, data = self.async_(views_async.eventos, 'post', '/', datos=datos)
+        self.assertEqual(codigo, 201)
+        self.assertEqual(data, self.client.get(f'/api/eventos/{data["id"]}/').json())
+        operador = SmartTokenObtainPairSerializer.get_token(User.objects.get(username='x-user-0')).access_token
+        self.assertEqual(self.async_(views_async.eventos, 'post', '/', token=operador, datos=datos)[0], 403)
+        self.assertEqual(self.async_(views_async.eventos, 'post', '/', datos={'tipo': 'x'})[0], 400)
+
+
+class VerificarIndicesTests(TestCase):
+    def test_sembrar_y_verificar(self):
+        salida = io.StringIO()
+        call_command('verificar_indices', seed=300, stdout=salida)
+        self.assertIn('OK eventos?sensor&desde&hasta', salida.getvalue())
+        primera = list(Evento.objects.order_by('id').values_list('tipo', 'sensor__nombre', 'barrera__nombre'))
+        # Misma seed: volver a sembrar reemplaza los datos por los mismos
+        call_command('verificar_indices', seed=300, stdout=io.StringIO())
+        self.assertEqual(
+            list(Evento.objects.order_by('id').values_list('tipo', 'sensor__nombre', 'barrera__nombre')), primera
+        )
+
+
+class TransicionConcurrenteTests(TransactionTestCase):
+    """Muchos hilos abriendo y cerrando la misma barrera"""
+
+    hilos = 8
+    iteraciones = 15
+
+    def setUp(self):
+        sensor = Sensor.objects.create(mac_address='DD:00:00:00:00:01', nombre='sensor')
+        self.barrera = Barrera.objects.create(nombre='barrera', ubicacion='Acceso', sensor=sensor)
+
+    def test_cada_evento_registra_el_estado_real(self):
+        # Se evalua aqui y no al importar: la base de pruebas recien existe ahora
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite en memoria bloquea la tabla completa entre hilos')
+        errores = []
+
+        def trabajador(numero):
+            try:
+                for i in range(self.iteraciones):
+                    transicion_barrera(self.barrera.pk, 'abrir' if (numero + i) % 2 else 'cerrar')
+            except Exception as exc:  # pragma: no cover - se reporta abajo
+                errores.append(exc)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajador, args=(n,)) for n in range(self.hilos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+
+        eventos = list(Evento.objects.filter(barrera=self.barrera).order_by('id'))
+        self.assertEqual(len(eventos), self.hilos * self.iteraciones)
+
+        # Cada evento debe partir del estado que dejo el anterior
+        estado = 'cerrada'
+        for evento in eventos:
+            self.assertEqual(evento.metadata['estado_anterior'], estado)
+            estado = 'abierta' if evento.tipo == 'apertura' else 'cerrada'
+
+        self.barrera.refresh_from_db()
+        self.assertEqual(self.barrera.estado, estado)
+
+    def test_barrera_bloqueada(self):
+        Barrera.objects.filter(pk=self.barrera.pk).update(estado='bloqueada')
+        with self.assertRaises(BarreraBloqueada):
+            transicion_barrera(self.barrera.pk, 'abrir')
+        self.assertFalse(Evento.objects.exists())
+
+
+class ComandoBarrerasTests(TestCase):
+    """POST /api/barreras/comando/ con ids validos, inexistentes, bloqueados y sin sensor"""
+
+    def setUp(self):
+        self.departamento = Departamento.objects.create(nombre='depto')
+        sensor = Sensor.objects.create(mac_address='DD:00:00:00:00:02', nombre='sensor', departamento=self.departamento)
+        self.cerrada = Barrera.objects.create(nombre='cerrada', ubicacion='A', sensor=sensor, departamento=self.departamento)
+        self.abierta = Barrera.objects.create(
+            nombre='abierta', ubicacion='B', sensor=sensor, departamento=self.departamento, estado='abierta'
+        )
+        self.bloqueada = Barrera.objects.create(
+            nombre='bloqueada', ubicacion='C', sensor=sensor, departamento=self.departamento, estado='bloqueada'
+        )
+        self.sin_sensor = Barrera.objects.create(nombre='sin sensor', ubicacion='D', departamento=self.departamento)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('operador', password='x'))
+
+    def comando(self, **datos):
+        return self.client.post('/api/barreras/comando/', datos, format='json')
+
+    def test_ids_mixtos(self):
+        ids = [self.bloqueada.pk, 999999, self.cerrada.pk, self.sin_sensor.pk, self.abierta.pk, self.cerrada.pk]
+        response = self.comando(accion='abrir', barreras=ids)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['aplicadas'], 2)
+        # Un resultado por id pedido, en el orden de la solicitud y sin duplicados
+        self.assertEqual([(r['id'], r['resultado'], r.get('estado')) for r in data['resultados']], [
+            (self.bloqueada.pk, 'bloqueada', 'bloqueada'),
+            (999999, 'no_existe', None),
+            (self.cerrada.pk, 'ok', 'abierta'),
+            (self.sin_sensor.pk, 'sin_sensor', 'cerrada'),
+            (self.abierta.pk, 'ok', 'abierta'),
+        ])
+        self.assertEqual(data['resultados'][2]['estado_anterior'], 'cerrada')
+        self.assertEqual(data['resultados'][4]['estado_anterior'], 'abierta')
+
+        estados = dict(Barrera.objects.values_list('pk', 'estado'))
+        self.assertEqual(estados, {
+            self.cerrada.pk: 'abierta', self.abierta.pk: 'abierta',
+            self.bloqueada.pk: 'bloqueada', self.sin_sensor.pk: 'cerrada',
+        })
+
+        # Exactamente un evento por barrera aplicada, aunque el id venga repetido
+        eventos = Evento.objects.filter(barrera__departamento=self.departamento).order_by('barrera_id')
+        self.assertEqual(
+            [(e.barrera_id, e.tipo, e.metadata) for e in eventos],
+            [(self.cerrada.pk, 'apertura', {'estado_anterior': 'cerrada'}),
+             (self.abierta.pk, 'apertura', {'estado_anterior': 'abierta'})]
+        )
+
+    def test_por_departamento(self):
+        otro = Barrera.objects.create(nombre='otra', ubicacion='E', sensor=self.cerrada.sensor)
+        response = self.comando(accion='cerrar', departamento=self.departamento.pk)
+        self.assertEqual(response.status_code, 200)
+        resultados = {r['id']: r['resultado'] for r in response.json()['resultados']}
+        self.assertEqual(resultados, {
+            self.cerrada.pk: 'ok', self.abierta.pk: 'ok',
+            self.bloqueada.pk: 'bloqueada', self.sin_sensor.pk: 'sin_sensor',
+        })
+        self.assertEqual(Evento.objects.filter(tipo='cierre').count(), 2)
+        self.assertFalse(Evento.objects.filter(barrera=otro).exists())
+
+    def test_validacion(self):
+        self.assertEqual(self.comando(accion='abrir').status_code, 400)
+        self.assertEqual(self.comando(accion='girar', barreras=[self.cerrada.pk]).status_code, 400)
+        self.assertEqual(self.comando(accion='abrir', barreras=[]).status_code, 400)
+        self.assertEqual(APIClient().post('/api/barreras/comando/', {}, format='json').status_code, 401)
+        self.assertFalse(Evento.objects.exists())
+
+
+class DatosSinteticosTests(TestCase):
+    def test_mac_valida_para_el_serializer(self):
+        for numero in (0, 255, 65535, (1 << 24) - 1):
+            serializer = SensorSerializer(data={'mac_address': mac_sintetica(numero), 'nombre': 'x'})
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(serializer.validated_data['mac_address'], mac_sintetica(numero))
+        with self.assertRaises(ValueError):
+            mac_sintetica(1 << 24)
+
+    def test_sembrar(self):
+        creados = sembrar(departamentos=2, sensores=3, barreras=2, usuarios=2, eventos=50, dias=7, batch_size=20)
+        self.assertEqual(creados, {
+            'departamentos': 2, 'sensores': 6, 'barreras': 4, 'usuarios': 4, 'eventos': 50,
+        })
+        eventos = Evento.objects.filter(sensor__nombre__startswith='sim-')
+        self.assertEqual(eventos.count(), 50)
+        # Los eventos quedan repartidos en el tiempo y con resumenes consistentes
+        self.assertGreater(eventos.values('timestamp__date').distinct().count(), 1)
+        total = sum(ResumenEvento.objects.filter(granularidad='dia').values_list('total', flat=True))
+        self.assertEqual(total, 50)
+
+        # Misma seed, mismos datos
+        primera = list(eventos.order_by('id').values_list('tipo', 'barrera__nombre'))
+        with self.assertRaises(ValueError):
+            sembrar(departamentos=2, sensores=3, barreras=2, usuarios=2, eventos=50)
+        limpiar()
+        self.assertFalse(Sensor.objects.filter(nombre__startswith='sim-').exists())
+        sembrar(departamentos=2, sensores=3, barreras=2, usuarios=2, eventos=50, dias=7, batch_size=20)
+        segunda = list(eventos.order_by('id').values_list('tipo', 'barrera__nombre'))
+        self.assertEqual(primera, segunda)
+
+
+    def test_limpiar_solo_lo_sembrado(self):
+        # Como el departamento de detectar_sensores_sin_lectura --sembrar
+        ajeno = Departamento.objects.create(nombre='bench-latidos')
+        sensor = Sensor.objects.create(mac_address='02:5E:00:00:00:00', nombre='bench-latido-0', departamento=ajeno)
+        Evento.objects.create(tipo='alerta', descripcion='sin lectura', sensor=sensor)
+        sembrar(departamentos=1, sensores=2, barreras=1, usuarios=1, eventos=10, prefijo='bench')
+
+        limpiar(prefijo='bench')
+        self.assertEqual(list(Departamento.objects.values_list('nombre', flat=True)), ['bench-latidos'])
+        self.assertEqual(list(Sensor.objects.values_list('nombre', flat=True)), ['bench-latido-0'])
+        self.assertEqual(Evento.objects.get().sensor, sensor)
+        # Y se puede volver a sembrar con el departamento ajeno presente
+        self.assertEqual(sembrar(departamentos=1, sensores=2, eventos=10, prefijo='bench')['departamentos'], 1)
+
+    def test_eventos_en_el_shard_del_sensor(self):
+        sensor = Sensor.objects.create(mac_address=mac_sintetica(0), nombre='sim-sensor-0-0').pk
+        # 'shard1' simulado sobre la misma base: se registra que conexion se pide
+        pedidas = []
+        conexiones = mock.MagicMock()
+        conexiones.__getitem__.side_effect = lambda alias: pedidas.append(alias) or connections['default']
+        with override_settings(SHARDS=['shard1']), mock.patch.object(sinteticos, 'connections', conexiones):
+            sinteticos._insertar_eventos([
+                ('alerta', 'x', pk, None, None, timezone.now(), {})
+                for pk in (sensor, shards.primer_id('shard1') + sensor)
+            ])
+        self.assertEqual(sorted(pedidas), ['default', 'shard1'])
+        self.assertEqual(Evento.objects.count(), 2)
+
+class BenchmarkApiTests(TestCase):
+    def setUp(self):
+        sembrar(departamentos=1, sensores=2, barreras=1, usuarios=1, eventos=20)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.base = os.path.join(directorio.name, 'linea_base.json')
+
+    def benchmark(self, **opciones):
+        call_command(
+            'benchmark_api', iteraciones=3, calentamiento=1, base=self.base,
+            stdout=io.StringIO(), **opciones
+        )
+
+    def test_guardar_y_comparar(self):
+        self.benchmark(guardar=True)
+        with open(self.base) as archivo:
+            base = json.load(archivo)
+        self.assertIn('barreras-abrir', base['escenarios'])
+        self.assertEqual(base['escenarios']['eventos-list']['consultas'], 2)
+        # Las escrituras del benchmark se revierten
+        self.assertEqual(Evento.objects.count(), 20)
+
+        self.benchmark(escenario=['eventos-list'], tolerancia=100)
+
+        base['escenarios']['eventos-list']['consultas'] = 1
+        with open(self.base, 'w') as archivo:
+            json.dump(base, archivo)
+        with self.assertRaisesMessage(CommandError, 'eventos-list 1 -> 2 consultas'):
+            self.benchmark(escenario=['eventos-list'], tolerancia=100)
+
+
+class ArchivoEventosTests(TestCase):
+    """Los meses archivados se siguen sirviendo igual que desde la tabla"""
+
+    # Los meses archivados se consultan solo con desde anterior al archivo
+    desde = '&desde=2000-01-01T00:00:00'
+    consultas = [
+        desde, f'{desde}&tipo=alerta', f'{desde}&departamento={{departamento}}',
+        f'{desde}&fields=id,timestamp,barrera_nombre',
+    ]
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(ARCHIVO_EVENTOS_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        sembrar(departamentos=2, sensores=2, barreras=2, usuarios=1, eventos=300, dias=100)
+        self.departamento = Departamento.objects.filter(nombre__startswith='sim-').first().pk
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@test.cl', 'x'))
+
+    def recorrer(self, consulta):
+        url = f'/api/eventos/?cursor=&page_size=40{consulta}'
+        resultados = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            resultados += response.data['results']
+            url = response.data['next']
+        return resultados
+
+    def respuestas(self, antiguo):
+        respuestas = {}
+        for consulta in self.consultas:
+            consulta = consulta.format(departamento=self.departamento)
+            respuestas[consulta] = self.recorrer(consulta)
+            paginas = self.client.get(f'/api/eventos/?page_size=40{consulta}').data['count'] // 40 + 1
+            for pagina in (1, paginas // 2, paginas):
+                respuestas[consulta, pagina] = self.client.get(
+                    f'/api/eventos/?page_size=40&page={pagina}{consulta}'
+                ).json()
+        respuestas['detalle'] = self.client.get(f'/api/eventos/{antiguo}/').json()
+        respuestas['csv'] = b''.join(
+            self.client.get(f'/api/eventos/export/?format=csv{self.desde}').streaming_content
+        )
+        return respuestas
+
+    def test_archivar_y_servir(self):
+        antiguo = Evento.objects.order_by('timestamp').values_list('id', flat=True).first()
+        antes = self.respuestas(antiguo)
+
+        call_command('archivar_eventos', dias=40, stdout=io.StringIO())
+        self.assertTrue(archivo.entradas())
+        limite = archivo.limite()
+        self.assertFalse(Evento.objects.filter(timestamp__lt=limite).exists())
+        self.assertEqual(
+            sum(entrada['filas'] for entrada in archivo.entradas()) + Evento.objects.count(), 300
+        )
+        self.assertEqual(self.respuestas(antiguo), antes)
+
+        with self.assertRaisesMessage(CommandError, 'archivados'):
+            call_command('recalcular_resumenes', stdout=io.StringIO())
+
+    def test_sin_desde_no_lee_el_archivo(self):
+        call_command('archivar_eventos', dias=40, stdout=io.StringIO())
+        en_tabla = Evento.objects.count()
+        with mock.patch.object(archivo, 'leer') as leer:
+            self.assertEqual(self.client.get(f'/api/eventos/?sensor={Sensor.objects.first().pk}').status_code, 200)
+            self.assertEqual(self.client.get('/api/eventos/').data['count'], en_tabla)
+            # Meses enteros sin filtros: el total sale del indice
+            self.assertEqual(self.client.get(f'/api/eventos/?{self.desde}').data['count'], 300)
+        leer.assert_not_called()
+
+    def test_detalle_descomprime_un_bloque(self):
+        mes = particiones.inicio_mes(Evento.objects.order_by('timestamp').first().timestamp)
+        ids = list(Evento.objects.filter(timestamp__lt=particiones.mes_siguiente(mes)).values_list('id', flat=True))
+        esperados = {pk: self.client.get(f'/api/eventos/{pk}/').json() for pk in ids[:3]}
+        entrada = archivo.archivar_mes(mes, chunk_size=10)
+        self.assertEqual(sum(1 for _ in archivo.leer(entrada)), len(ids))
+
+        with mock.patch.object(archivo, 'leer') as leer, mock.patch('gzip.decompress', wraps=gzip.decompress) as bloques:
+            for pk, esperado in esperados.items():
+                self.assertEqual(self.client.get(f'/api/eventos/{pk}/').json(), esperado)
+            self.assertEqual(self.client.get(f'/api/eventos/{max(ids) + 10**6}/').status_code, 404)
+        leer.assert_not_called()
+        self.assertLessEqual(bloques.call_count, len(esperados) * 2)
+
+    def test_reanudar_archivado_interrumpido(self):
+        mes = particiones.inicio_mes(Evento.objects.order_by('timestamp').first().timestamp)
+        entrada = archivo.archivar_mes(mes)
+        hasta = particiones.mes_siguiente(mes)
+        # Las filas reaparecen como si el borrado no hubiera terminado: no se duplican
+        Evento.objects.create(
+            tipo='alerta', descripcion='tardio', sensor=Sensor.objects.first(),
+        )
+        Evento.objects.filter(descripcion='tardio').update(timestamp=mes)
+        total = self.client.get(f'/api/eventos/?{self.desde}').data['count']
+        self.assertEqual(total, 300)
+
+        self.assertEqual(archivo.archivar_mes(mes), entrada)
+        self.assertFalse(Evento.objects.filter(timestamp__lt=hasta).exists())
+
+
+class DiarioEventosTests(TestCase):
+    """Con EVENTOS_DIARIO abrir/cerrar no insertan el evento en la peticion"""
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ruta = os.path.join(directorio.name, 'diario.sqlite3')
+        # Sin hilo de vaciado: el test llama a vaciar()
+        self.diario = diario.DiarioEventos(ruta, abandono=0)
+        ajustes = override_settings(EVENTOS_DIARIO=ruta)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        parche = mock.patch.object(diario, '_diario', self.diario)
+        parche.start()
+        self.addCleanup(parche.stop)
+        crear_datos(1)
+        self.barrera = Barrera.objects.get()
+
+    def test_vaciar_conserva_timestamp_y_resumenes(self):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            transicion = transicion_barrera(self.barrera.pk, 'abrir')
+        self.assertFalse(any('INSERT INTO "eventos"' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(Evento.objects.count(), 1)
+        self.assertEqual(self.diario.pendientes(), 1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.diario.vaciar(), 1)
+        # El timestamp va en el INSERT, sin UPDATE posterior
+        self.assertFalse(any(q['sql'].startswith('UPDATE "eventos"') for q in ctx.captured_queries))
+        evento = Evento.objects.get(tipo='apertura', barrera=self.barrera, metadata__estado_anterior='cerrada')
+        self.assertEqual(evento.timestamp, transicion.evento.timestamp)
+        self.assertEqual(
+            ResumenEvento.objects.filter(granularidad='dia', tipo='apertura').values_list('total', flat=True).get(), 2
+        )
+        self.assertEqual(self.diario.pendientes(), 0)
+        self.assertFalse(MarcaAgua.objects.exists())
+        self.assertIn('api_diario_eventos_total', metricas.registro.exportar())
+
+    def test_lote_ya_insertado_no_se_duplica(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            transicion_barrera(self.barrera.pk, 'abrir')
+        lote, filas = self.diario._reclamar()
+        # Caida entre el COMMIT en la base y el borrado del diario
+        with mock.patch.object(self.diario, '_transaccion', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.diario._escribir(lote, filas)
+        self.assertEqual(Evento.objects.count(), 2)
+
+        self.assertEqual(self.diario.vaciar(), 0)
+        self.assertEqual(Evento.objects.count(), 2)
+        self.assertEqual(self.diario.pendientes(), 0)
+
+    def test_diario_lleno_inserta_en_la_peticion(self):
+        self.diario.maximo = 0
+        transicion_barrera(self.barrera.pk, 'abrir')
+        self.assertEqual(Evento.objects.count(), 2)
+        self.assertEqual(self.diario.pendientes(), 0)
+
+    def test_guarda_antes_del_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            transicion = transicion_barrera(self.barrera.pk, 'abrir')
+        # Guardado antes del COMMIT pero sin confirmar: el vaciado no lo toma
+        self.assertEqual(self.diario.pendientes(), 1)
+        self.assertIsNotNone(transicion.evento.timestamp)
+        self.assertEqual(self.diario._reclamar()[1], [])
+        callbacks[0]()
+        self.assertEqual(self.diario.vaciar(), 1)
+        self.assertFalse(MarcaAgua.objects.exists())
+
+    def test_sin_confirmar_se_resuelve_con_la_marca(self):
+        # Proceso caido entre el COMMIT y la confirmacion: la marca esta en la base
+        with self.captureOnCommitCallbacks():
+            transicion_barrera(self.barrera.pk, 'abrir')
+        # Rollback de la accion: la marca tampoco llega a la base
+        with self.captureOnCommitCallbacks(), self.assertRaises(RuntimeError), transaction.atomic():
+            transicion_barrera(self.barrera.pk, 'cerrar')
+            raise RuntimeError
+        self.assertEqual(self.diario.pendientes(), 2)
+
+        self.assertEqual(self.diario.vaciar(), 1)
+        self.assertTrue(Evento.objects.filter(tipo='apertura').exists())
+        self.assertFalse(Evento.objects.filter(tipo='cierre').exists())
+        self.assertEqual(self.diario.pendientes(), 0)
+        self.assertFalse(MarcaAgua.objects.exists())
+
+    def test_marcas_huerfanas_se_barren(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            transicion_barrera(self.barrera.pk, 'abrir')
+        # Caida entre borrar el lote del diario y borrar su marca
+        with mock.patch.object(self.diario, '_borrar_marcas'):
+            self.assertEqual(self.diario.vaciar(), 1)
+        huerfana = MarcaAgua.objects.get().nombre
+        self.assertTrue(huerfana.startswith(diario.PREFIJO_MARCA + self.diario.id))
+
+        # Un lote en curso y las marcas de otro diario se conservan
+        self.agregar(self.barrera.sensor_id)
+        lote, _ = self.diario._reclamar()
+        MarcaAgua.objects.create(nombre=diario.PREFIJO_MARCA + lote)
+        MarcaAgua.objects.create(nombre=diario.PREFIJO_MARCA + 'f' * 32)
+        self.assertEqual(self.diario._barrer_marcas(), 1)
+        self.assertFalse(MarcaAgua.objects.filter(nombre=huerfana).exists())
+        self.assertEqual(MarcaAgua.objects.count(), 2)
+
+    def test_error_al_confirmar_no_falla_la_peticion(self):
+        with mock.patch.object(self.diario, 'confirmar', side_effect=sqlite3.OperationalError('disk I/O error')):
+            with self.assertLogs('api.diario', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+                transicion_barrera(self.barrera.pk, 'abrir')
+        self.assertEqual(self.diario.vaciar(), 1)
+
+    def agregar(self, *sensores):
+        self.diario.agregar([
+            Evento(tipo='alerta', descripcion=f'diario {i}', sensor_id=sensor) for i, sensor in enumerate(sensores)
+        ])
+
+    def intentos(self):
+        return [fila[0] for fila in self.diario._conexion().execute('SELECT intentos FROM pendientes ORDER BY id')]
+
+    def test_fila_invalida_se_descarta(self):
+        self.diario.intentos = 2
+        sensor = self.barrera.sensor_id
+        self.agregar(sensor, None, sensor)
+
+        with self.assertLogs('api.diario', 'ERROR'):
+            self.assertEqual(self.diario.vaciar(), 0)
+        self.assertEqual(self.intentos(), [1, 1, 1])
+        # Al segundo intento el lote se parte en filas y las validas se escriben
+        with self.assertLogs('api.diario', 'ERROR'):
+            self.assertEqual(self.diario.vaciar(), 0)
+        self.assertEqual(self.intentos(), [0, 0, 0])
+        with self.assertLogs('api.diario', 'ERROR'):
+            self.assertEqual(self.diario.vaciar(), 2)
+        self.assertEqual(self.intentos(), [1])
+        with self.assertLogs('api.diario', 'ERROR') as logs:
+            self.assertEqual(self.diario.vaciar(), 0)
+        self.assertIn('Evento descartado', logs.output[-1])
+
+        self.assertEqual(self.diario.pendientes(), 0)
+        self.assertEqual(
+            sorted(Evento.objects.filter(tipo='alerta').values_list('descripcion', flat=True)), ['diario 0', 'diario 2']
+        )
+        (datos, error), = self.diario.descartados()
+        self.assertEqual(json.loads(datos)['descripcion'], 'diario 1')
+        self.assertIn('IntegrityError', error)
+        self.assertFalse(MarcaAgua.objects.exists())
+        self.assertIn('api_diario_descartados_total', metricas.registro.exportar())
+
+        self.assertEqual(self.diario.reencolar_descartados(), 1)
+        self.assertEqual((self.diario.descartados(), self.intentos()), ([], [0]))
+
+    def test_base_no_disponible_no_cuenta_intentos(self):
+        self.diario.intentos = 1
+        self.agregar(self.barrera.sensor_id, self.barrera.sensor_id)
+        with mock.patch.object(Evento.objects, 'bulk_create', side_effect=OperationalError('sin conexion')):
+            for _ in range(3):
+                with self.assertRaises(OperationalError):
+                    self.diario.vaciar()
+        self.assertEqual(self.intentos(), [0, 0])
+        self.assertEqual(self.diario.vaciar(), 2)
+
+    def test_diario_anterior_se_migra(self):
+        ruta = os.path.join(os.path.dirname(self.diario.ruta), 'viejo.sqlite3')
+        conexion = sqlite3.connect(ruta)
+        conexion.execute(
+            'CREATE TABLE pendientes (id INTEGER PRIMARY KEY AUTOINCREMENT, lote TEXT, reclamado REAL, datos TEXT NOT NULL)'
+        )
+        conexion.execute('INSERT INTO pendientes (datos) VALUES (?)', diario._a_fila(
+            Evento(tipo='alerta', descripcion='vieja', sensor_id=self.barrera.sensor_id, timestamp=timezone.now())
+        ))
+        conexion.commit()
+        conexion.close()
+        self.assertEqual(diario.DiarioEventos(ruta, abandono=0).vaciar(), 1)
+
+
+@override_settings(REPLICAS=['replica1'])
+class ReplicasTests(SimpleTestCase):
+    """Decisiones de ReplicasRouter por peticion (sin consultar la replica)"""
+
+    def setUp(self):
+        replicas._mediciones.clear()
+        self.addCleanup(replicas._mediciones.clear)
+        parche = mock.patch.object(replicas, 'retraso', return_value=0)
+        self.retraso = parche.start()
+        self.addCleanup(parche.stop)
+
+    def alias(self, request, escribir=False):
+        """Alias de lectura antes y despues de escribir dentro de la peticion"""
+        elegidos = []
+
+        def vista(request):
+            elegidos.append(router.db_for_read(Evento))
+            if escribir:
+                router.db_for_write(Evento)
+                elegidos.append(router.db_for_read(Evento))
+            return HttpResponse()
+
+        response = replicas.ReplicasMiddleware(vista)(request)
+        return elegidos, response
+
+    def test_lecturas_a_replica_y_escrituras_a_primaria(self):
+        factory = RequestFactory()
+        elegidos, response = self.alias(factory.get('/api/eventos/'), escribir=True)
+        self.assertEqual(elegidos, ['replica1', 'default'])
+        # Escribio en un GET: el cliente queda fijado a la primaria
+        self.assertIn(replicas.COOKIE, response.cookies)
+
+        elegidos, response = self.alias(factory.post('/api/barreras/1/abrir/'))
+        self.assertEqual(elegidos, ['default'])
+        self.assertIn(replicas.COOKIE, response.cookies)
+
+        factory.cookies[replicas.COOKIE] = '1'
+        self.assertEqual(self.alias(factory.get('/api/eventos/'))[0], ['default'])
+        # Fuera de una peticion (commands, hilos) se usa default
+        self.assertEqual(Evento.objects.all().db, 'default')
+
+    def test_replica_atrasada_o_caida(self):
+        self.retraso.return_value = 60
+        self.assertEqual(self.alias(RequestFactory().get('/api/eventos/'))[0], ['default'])
+
+        replicas._mediciones.clear()
+        self.retraso.side_effect = ConnectionError
+        self.assertEqual(self.alias(RequestFactory().get('/api/eventos/'))[0], ['default'])
+
+
+@override_settings(SHARDS_HILOS=0)
+class ShardsTests(TestCase):
+    """Repartida con dos 'shards' simulados sobre la misma base"""
+
+    def setUp(self):
+        crear_datos(7)
+        self.eventos = Evento.objects.order_by('-timestamp', '-id')
+        self.repartida = shards.Repartida({
+            'pares': self.eventos.filter(id__iregex=r'[02468]$'),
+            'impares': self.eventos.exclude(id__iregex=r'[02468]$'),
+        })
+
+    def test_mezcla_por_orden(self):
+        ids = list(self.eventos.values_list('id', flat=True))
+        self.assertEqual(self.repartida.count(), 7)
+        self.assertEqual([evento.id for evento in self.repartida[2:6]], ids[2:6])
+        # values() sin los campos del orden: se agregan para mezclar
+        filas = self.repartida.values('id', 'tipo')[0:7]
+        self.assertEqual([fila['id'] for fila in filas], ids)
+        filas = iterar_por_keyset(self.repartida.values('id', 'timestamp'), 'timestamp', chunk_size=3)
+        self.assertEqual([fila['id'] for fila in filas], ids)
+
+    def test_alias_de_id_y_estadisticas(self):
+        with override_settings(SHARDS=['shard1']):
+            self.assertEqual(shards.alias_de_id(5), 'default')
+            self.assertEqual(shards.alias_de_id(shards.primer_id('shard1') + 3), 'shard1')
+            self.assertEqual(shards.alias_de_id(2 << shards.BITS_ID), 'default')
+            self.assertEqual(shards.alias_de_id('x'), 'default')
+        partes = [
+            [{'periodo': 1, 'tipo': 'alerta', 'total': 2}, {'periodo': 2, 'tipo': 'alerta', 'total': 1}],
+            [{'periodo': 1, 'tipo': 'alerta', 'total': 3}, {'periodo': 1, 'tipo': 'cierre', 'total': 1}],
+        ]
+        self.assertEqual(resumenes.combinar(partes), [
+            {'periodo': 1, 'tipo': 'alerta', 'total': 5},
+            {'periodo': 1, 'tipo': 'cierre', 'total': 1},
+            {'periodo': 2, 'tipo': 'alerta', 'total': 1},
+        ])
+
+
+class ArranqueTests(TestCase):
+    def test_calentar_sin_consultas(self):
+        # Se ejecuta en el master de gunicorn antes del fork
+        with self.assertNumQueries(0):
+            pasos = arranque.calentar()
+        self.assertEqual(list(pasos), list(arranque.PASOS))
+
+    def test_leer_importtime(self):
+        salida = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       150 |        150 |     api.campos\n'
+            'import time:      2000 |       2150 |   api.views\n'
+        )
+        self.assertEqual(leer_importtime(salida), {'api.campos': (0.15, 0.15), 'api.views': (2.0, 2.15)})
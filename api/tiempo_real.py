@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Sensor
+
+try:
+    import redis
+except ImportError:  # dependencia opcional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class Suscripcion:
+    """
+    Buffer acotado de un cliente. Si el cliente no consume a tiempo se descartan
+    los mensajes mas antiguos y se informa cuantos se perdieron, de modo que un
+    cliente lento nunca bloquea al publicador.
+    """
+
+    def __init__(self, departamento_id=None, maximo=100):
+        self.departamento_id = departamento_id
+        self.perdidos = 0
+        self._mensajes = deque(maxlen=maximo)
+        self._loop = asyncio.get_running_loop()
+        self._disponible = asyncio.Event()
+
+    def acepta(self, mensaje):
+        return self.departamento_id is None or mensaje.get('departamento') == self.departamento_id
+
+    def entregar(self, mensaje):
+        """Puede llamarse desde cualquier hilo"""
+        self._loop.call_soon_threadsafe(self._encolar, mensaje)
+
+    def _encolar(self, mensaje):
+        if len(self._mensajes) == self._mensajes.maxlen:
+            self.perdidos += 1
+        self._mensajes.append(mensaje)
+        self._disponible.set()
+
+    async def siguiente(self, timeout=None):
+        """Devuelve el proximo mensaje o None si vence el timeout"""
+        if not self._mensajes:
+            self._disponible.clear()
+            try:
+                await asyncio.wait_for(self._disponible.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        mensaje = self._mensajes.popleft()
+        if self.perdidos:
+            mensaje = {**mensaje, 'perdidos': self.perdidos}
+            self.perdidos = 0
+        return mensaje
+
+
+class MemoriaBroker:
+    """
+    Pub/sub en memoria del proceso. Solo llega a los clientes conectados al
+    mismo worker; con varios workers se debe usar RedisBroker (gunicorn.conf.py
+    no arranca mas de un worker con este broker).
+    """
+
+    def __init__(self):
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self, departamento_id=None):
+        suscripcion = Suscripcion(departamento_id, getattr(settings, 'TIEMPO_REAL_BUFFER', 100))
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def tiene_suscriptores(self):
+        return bool(self._suscripciones)
+
+    def publicar(self, mensaje):
+        with self._lock:
+            destinos = [s for s in self._suscripciones if s.acepta(mensaje)]
+        for suscripcion in destinos:
+            try:
+                suscripcion.entregar(mensaje)
+            except RuntimeError:
+                # El loop del cliente ya se cerro
+                self.desuscribir(suscripcion)
+
+
+class RedisBroker(MemoriaBroker):
+    """
+    Pub/sub compartido entre workers por un canal de Redis (TIEMPO_REAL_REDIS_URL).
+    publicar envia al canal; cada proceso con clientes conectados escucha el canal
+    en un hilo y reparte los mensajes a sus suscripciones como MemoriaBroker.
+    """
+
+    canal = 'tiempo_real'
+
+    def __init__(self):
+        if redis is None:
+            raise ImproperlyConfigured('RedisBroker requiere el paquete redis')
+        super().__init__()
+        self._redis = redis.Redis.from_url(settings.TIEMPO_REAL_REDIS_URL)
+        self._hilo = None
+        self._escuchando = threading.Event()
+        # (procesos escuchando el canal, momento de la consulta)
+        self._oyentes = (0, float('-inf'))
+
+    def suscribir(self, departamento_id=None):
+        suscripcion = super().suscribir(departamento_id)
+        with self._lock:
+            # El hilo se inicia en el worker (despues del fork), con el primer cliente
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._escuchar, name='tiempo-real-redis', daemon=True)
+                self._hilo.start()
+        self._escuchando.wait(5)
+        return suscripcion
+
+    def tiene_suscriptores(self):
+        # Se consulta a Redis a lo sumo una vez por segundo
+        oyentes, momento = self._oyentes
+        if time.monotonic() - momento > 1:
+            try:
+                oyentes = self._redis.pubsub_numsub(self.canal)[0][1]
+            except redis.RedisError:
+                oyentes = 0
+            self._oyentes = (oyentes, time.monotonic())
+        return bool(oyentes)
+
+    def publicar(self, mensaje):
+        # Se llama despues del COMMIT: sin Redis se pierde el aviso, no la peticion
+        try:
+            self._redis.publish(self.canal, json.dumps(mensaje))
+        except redis.RedisError:
+            logger.exception('No se pudo publicar en Redis')
+
+    def _escuchar(self):
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.canal)
+                self._escuchando.set()
+                for item in pubsub.listen():
+                    if item['type'] == 'message':
+                        super().publicar(json.loads(item['data']))
+            except redis.RedisError:
+                logger.exception('Se perdio la conexion con Redis; se reintenta')
+                time.sleep(1)
+            finally:
+                pubsub.close()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'TIEMPO_REAL_BROKER', 'api.tiempo_real.MemoriaBroker'))()
+    return _broker
+
+
+def _publicar(mensaje):
+    # Se publica al confirmar la transaccion para no anunciar cambios revertidos
+    transaction.on_commit(lambda: get_broker().publicar(mensaje))
+
+
+def publicar_eventos(eventos):
+    broker = get_broker()
+    if not eventos or not broker.tiene_suscriptores():
+        return
+    departamentos = dict(
+        Sensor.objects.filter(pk__in={e.sensor_id for e in eventos})
+        .values_list('id', 'departamento_id')
+    )
+    for evento in eventos:
+        _publicar({
+            'tipo': 'evento',
+            'id': evento.pk,
+            'evento': evento.tipo,
+            'descripcion': evento.descripcion,
+            'sensor': evento.sensor_id,
+            'barrera': evento.barrera_id,
+            'departamento': departamentos.get(evento.sensor_id),
+            'timestamp': evento.timestamp.isoformat(),
+        })
+
+
+def publicar_estado(recurso, objeto_id, departamento_id, estado, estado_anterior):
+    """recurso es 'barrera' o 'sensor'"""
+    broker = get_broker()
+    if not broker.tiene_suscriptores() or estado == estado_anterior:
+        return
+    _publicar({
+        'tipo': recurso,
+        'id': objeto_id,
+        'departamento': departamento_id,
+        'estado': estado,
+        'estado_anterior': estado_anterior,
+    })
@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import Token
+
+from .authentication import token_revocado
+from .models import Usuario
+
+
+class SmartTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Agrega los datos del usuario y de su perfil como claims, para que
+    StatelessJWTAuthentication e IsAdminUser (ROLES_DESDE_JWT = True)
+    no necesiten consultar la base de datos.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Momento de emision con fraccion de segundo (ver authentication.revocar_tokens)
+        token['emitido'] = time.time()
+        token['username'] = user.get_username()
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+
+        perfil = Usuario.objects.filter(user=user).values_list('rol', 'activo', 'departamento_id').first()
+        token['rol'], token['activo'], token['departamento'] = perfil if perfil else (None, False, None)
+        return token
+
+
+class SmartTokenRefreshSerializer(TokenRefreshSerializer):
+    """No emite access tokens desde un refresh token revocado (llevaria los claims viejos)"""
+
+    def validate(self, attrs):
+        if token_revocado(self.token_class(attrs['refresh'])):
+            raise InvalidToken('Token revocado')
+        return super().validate(attrs)
+
+
+class StreamToken(Token):
+    """
+    Token de corta duracion que solo sirve para abrir /api/stream/ con ?token=
+    (EventSource no puede enviar el header Authorization). Al ir en la URL queda en
+    el log de accesos; por eso no se acepta ahi un access token.
+    """
+    token_type = 'stream'
+    lifetime = getattr(settings, 'TIEMPO_REAL_TOKEN_VIDA', timedelta(seconds=60))
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['emitido'] = time.time()
+        return token
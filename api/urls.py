@@ -1,7 +1,8 @@
 
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, views_async
 
 # Crear router de DRF
 router = DefaultRouter()
@@ -18,6 +19,23 @@ urlpatterns = [
     # Información del estudiante (público)
     path('info/', views.info_estudiante, name='info-estudiante'),
     
+    # Metricas por vista en formato Prometheus (admin)
+    path('metrics/', views.metrics, name='metrics'),
+    
+    # Cambios de estado y eventos en vivo (Server-Sent Events, ASGI)
+    path('stream/', views.stream, name='stream'),
+    path('stream/token/', views.stream_token, name='stream-token'),
+]
+
+# Versiones async de los endpoints mas usados (servidor ASGI, ver start_gunicorn.sh)
+if settings.API_ASYNC:
+    urlpatterns += [
+        path('barreras/<int:pk>/abrir/', views_async.barrera_abrir, name='barrera-abrir-async'),
+        path('barreras/<int:pk>/cerrar/', views_async.barrera_cerrar, name='barrera-cerrar-async'),
+        path('eventos/', views_async.eventos, name='evento-list-async'),
+    ]
+
+urlpatterns += [
     # Incluir todas las rutas del router
     path('', include(router.urls)),
 ]
@@ -1,14 +1,36 @@
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from .models import Departamento, Sensor, Usuario, Barrera, Evento
 from .serializers import (
     DepartamentoSerializer, SensorSerializer, UsuarioSerializer,
-    BarreraSerializer, EventoSerializer
+    BarreraSerializer, EventoSerializer, BarreraComandoSerializer, LatidoSerializer
 )
 from .permissions import IsAdminUser
+from .cache import RespuestaCacheadaMixin
+from .campos import CamposDinamicosViewMixin, podar_fila
+from .shards import RepartidoViewMixin
+from .authentication import StatelessJWTAuthentication, atoken_revocado
+from .tokens import StreamToken
+from .parsers import RapidoJSONParser, NDJSONParser
+from .renderers import CSVRenderer, NDJSONRenderer, PrometheusRenderer
+from .pagination import EventoPagination, SensorPagination
+from .filters import filtrar_eventos, fecha_param, entero_param, tipos_param
+from . import archivo, resumenes, exportacion, tiempo_real, latidos, metricas, shards
+from .services import ingerir_eventos, transicion_barrera, transicion_barreras, BarreraBloqueada
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -30,6 +52,7 @@ def api_root(request):
                 'barreras': request.build_absolute_uri('/api/barreras/'),
                 'eventos': request.build_absolute_uri('/api/eventos/'),
                 'usuarios': request.build_absolute_uri('/api/usuarios/'),
+                'stream': request.build_absolute_uri('/api/stream/'),
             },
             'administracion': {
                 'panel_admin': request.build_absolute_uri('/admin/'),
@@ -76,11 +99,85 @@ def info_estudiante(request):
         }
     })
 
-class DepartamentoViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request):
+    """GET /api/metrics/ (formato Prometheus, requiere METRICAS_ACTIVAS)"""
+    if not getattr(settings, 'METRICAS_ACTIVAS', False):
+        raise Http404
+    return Response(metricas.registro.exportar())
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def stream_token(request):
+    """POST /api/stream/token/: token de corta duracion para ?token= de /api/stream/"""
+    token = StreamToken.for_user(request.user)
+    return Response({'token': str(token), 'expira_en': int(StreamToken.lifetime.total_seconds())})
+
+async def stream(request):
+    """
+    GET /api/stream/?departamento= con el header Authorization, o ?token= con un
+    token de POST /api/stream/token/ (Server-Sent Events, requiere ASGI)
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'El stream requiere un servidor ASGI'}, status=501)
+    
+    autenticacion = StatelessJWTAuthentication()
+    header = autenticacion.get_header(request)
+    try:
+        if header:
+            token = autenticacion.get_validated_token(autenticacion.get_raw_token(header))
+            await sync_to_async(autenticacion.get_user)(token)
+        else:
+            # Solo tokens de stream: un access token en la URL quedaria en el log de accesos
+            token = StreamToken(request.GET.get('token', ''))
+            if await atoken_revocado(token):
+                raise InvalidToken('Token revocado')
+    except (InvalidToken, TokenError):
+        return JsonResponse({'error': 'Token invalido'}, status=401)
+    
+    try:
+        departamento_id = int(request.GET['departamento']) if request.GET.get('departamento') else None
+    except ValueError:
+        return JsonResponse({'error': 'departamento debe ser un entero'}, status=400)
+    
+    broker = tiempo_real.get_broker()
+    suscripcion = broker.suscribir(departamento_id)
+    
+    async def mensajes():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                mensaje = await suscripcion.siguiente(timeout=15)
+                if mensaje is None:
+                    yield ': ping\n\n'
+                    continue
+                yield f"event: {mensaje['tipo']}\ndata: {json.dumps(mensaje)}\n\n"
+        finally:
+            broker.desuscribir(suscripcion)
+    
+    return StreamingHttpResponse(mensajes(), content_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+class DepartamentoViewSet(RespuestaCacheadaMixin, RepartidoViewMixin, CamposDinamicosViewMixin, viewsets.ModelViewSet):
     """ViewSet para gestionar Departamentos"""
-    queryset = Departamento.objects.all()
+    queryset = Departamento.objects.annotate(total_sensores=Count('sensores')).order_by('nombre')
     serializer_class = DepartamentoSerializer
     permission_classes = [IsAuthenticated]
+    cache_recurso = 'departamentos'
+    # total_sensores se cuenta en el shard de cada departamento (copia del directorio)
+    campo_shard = None
+    
+    def alias_de_pk(self, pk):
+        return shards.alias_de_departamento(pk)
+    
+    def filtrar_shard(self, queryset, alias):
+        if alias == DEFAULT_DB_ALIAS:
+            return queryset.filter(shard__in=['', alias])
+        return queryset.filter(shard=alias)
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -91,19 +188,25 @@ class DepartamentoViewSet(viewsets.ModelViewSet):
     def sensores(self, request, pk=None):
         """GET /api/departamentos/{id}/sensores/"""
         departamento = self.get_object()
-        sensores = Sensor.objects.filter(departamento=departamento)
+        sensores = Sensor.objects.filter(departamento=departamento).select_related('departamento')
         serializer = SensorSerializer(sensores, many=True)
         return Response({
             'departamento': departamento.nombre,
-            'total_sensores': sensores.count(),
+            'total_sensores': len(serializer.data),
             'sensores': serializer.data
         })
 
-class SensorViewSet(viewsets.ModelViewSet):
+class SensorViewSet(RespuestaCacheadaMixin, RepartidoViewMixin, CamposDinamicosViewMixin, viewsets.ModelViewSet):
     """ViewSet para gestionar Sensores"""
-    queryset = Sensor.objects.all()
+    queryset = Sensor.objects.select_related('departamento').only(
+        'id', 'mac_address', 'nombre', 'estado', 'departamento',
+        'departamento__nombre', 'ultima_lectura', 'created_at', 'updated_at'
+    )
     serializer_class = SensorSerializer
     permission_classes = [IsAuthenticated]
+    cache_recurso = 'sensores'
+    pagination_class = SensorPagination
+    latidos_max_filas = 10000
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -124,7 +227,8 @@ class SensorViewSet(viewsets.ModelViewSet):
         
         estado_anterior = sensor.estado
         sensor.estado = nuevo_estado
-        sensor.save()
+        sensor.save(update_fields=['estado', 'updated_at'])
+        tiempo_real.publicar_estado('sensor', sensor.pk, sensor.departamento_id, sensor.estado, estado_anterior)
         
         return Response({
             'mensaje': 'Estado cambiado exitosamente',
@@ -132,10 +236,50 @@ class SensorViewSet(viewsets.ModelViewSet):
             'estado_anterior': estado_anterior,
             'estado_nuevo': sensor.estado
         })
+    
+    @action(detail=False, methods=['post'])
+    def latidos(self, request):
+        """
+        POST /api/sensores/latidos/
+        [{"mac_address": "AA:BB:CC:DD:EE:FF", "estado": "activo"}, ...] (estado opcional)
+        """
+        filas = request.data
+        if not isinstance(filas, list):
+            return Response(
+                {'error': 'Se esperaba una lista de latidos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(filas) > self.latidos_max_filas:
+            return Response(
+                {'error': f'Maximo {self.latidos_max_filas} latidos por peticion'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        ahora = timezone.now()
+        validos = []
+        errores = []
+        for indice, fila in enumerate(filas):
+            serializer = LatidoSerializer(data=fila)
+            if serializer.is_valid():
+                datos = serializer.validated_data
+                validos.append((datos['mac_address'], datos.get('estado'), ahora))
+            else:
+                errores.append({'indice': indice, 'errores': serializer.errors})
+        latidos.get_buffer().registrar(validos)
+        
+        # Se escriben en el proximo vaciado del buffer (ver LATIDOS_VENTANA)
+        return Response({
+            'recibidos': len(filas),
+            'aceptados': len(validos),
+            'errores': errores
+        }, status=status.HTTP_202_ACCEPTED)
 
-class UsuarioViewSet(viewsets.ModelViewSet):
+class UsuarioViewSet(CamposDinamicosViewMixin, viewsets.ModelViewSet):
     """ViewSet para gestionar Usuarios"""
-    queryset = Usuario.objects.all()
+    queryset = Usuario.objects.select_related('user', 'departamento').only(
+        'id', 'rol', 'departamento', 'departamento__nombre', 'telefono', 'activo', 'created_at',
+        'user__id', 'user__username', 'user__email', 'user__first_name', 'user__last_name'
+    )
     serializer_class = UsuarioSerializer
     permission_classes = [IsAuthenticated]
     
@@ -144,11 +288,15 @@ class UsuarioViewSet(viewsets.ModelViewSet):
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
-class BarreraViewSet(viewsets.ModelViewSet):
+class BarreraViewSet(RespuestaCacheadaMixin, RepartidoViewMixin, CamposDinamicosViewMixin, viewsets.ModelViewSet):
     """ViewSet para gestionar Barreras"""
-    queryset = Barrera.objects.all()
+    queryset = Barrera.objects.select_related('sensor', 'departamento').only(
+        'id', 'nombre', 'ubicacion', 'estado', 'sensor', 'sensor__nombre',
+        'departamento', 'departamento__nombre', 'created_at', 'updated_at'
+    )
     serializer_class = BarreraSerializer
     permission_classes = [IsAuthenticated]
+    cache_recurso = 'barreras'
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -158,79 +306,174 @@ class BarreraViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def abrir(self, request, pk=None):
         """POST /api/barreras/{id}/abrir/"""
-        barrera = self.get_object()
-        
-        if barrera.estado == 'bloqueada':
-            return Response(
-                {'error': 'La barrera esta bloqueada'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        estado_anterior = barrera.estado
-        barrera.estado = 'abierta'
-        barrera.save()
+        return self._transicion(pk, 'abrir')
+    
+    @action(detail=True, methods=['post'])
+    def cerrar(self, request, pk=None):
+        """POST /api/barreras/{id}/cerrar/"""
+        return self._transicion(pk, 'cerrar')
+    
+    @action(detail=False, methods=['post'])
+    def comando(self, request):
+        """
+        POST /api/barreras/comando/
+        {"accion": "abrir"|"cerrar", "barreras": [ids]} o {"accion": ..., "departamento": id}
+        """
+        serializer = BarreraComandoSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        datos = serializer.validated_data
         
-        Evento.objects.create(
-            tipo='apertura',
-            descripcion=f'Barrera {barrera.nombre} abierta',
-            barrera=barrera,
-            sensor=barrera.sensor,
-            metadata={'estado_anterior': estado_anterior}
+        resultados = transicion_barreras(
+            datos['accion'],
+            ids=datos.get('barreras'),
+            departamento_id=datos.get('departamento')
         )
         
         return Response({
-            'mensaje': f'Barrera {barrera.nombre} abierta',
-            'estado': barrera.estado
+            'accion': datos['accion'],
+            'aplicadas': sum(1 for r in resultados if r['resultado'] == 'ok'),
+            'resultados': resultados
         })
     
-    @action(detail=True, methods=['post'])
-    def cerrar(self, request, pk=None):
-        """POST /api/barreras/{id}/cerrar/"""
-        barrera = self.get_object()
-        
-        if barrera.estado == 'bloqueada':
+    def _transicion(self, pk, accion):
+        try:
+            transicion = transicion_barrera(int(pk), accion)
+        except (Barrera.DoesNotExist, ValueError):
+            raise Http404
+        except BarreraBloqueada:
             return Response(
                 {'error': 'La barrera esta bloqueada'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        estado_anterior = barrera.estado
-        barrera.estado = 'cerrada'
-        barrera.save()
-        
-        Evento.objects.create(
-            tipo='cierre',
-            descripcion=f'Barrera {barrera.nombre} cerrada',
-            barrera=barrera,
-            sensor=barrera.sensor,
-            metadata={'estado_anterior': estado_anterior}
-        )
-        
         return Response({
-            'mensaje': f'Barrera {barrera.nombre} cerrada',
-            'estado': barrera.estado
+            'mensaje': f'Barrera {transicion.nombre} {transicion.estado}',
+            'estado': transicion.estado
         })
 
-class EventoViewSet(viewsets.ModelViewSet):
+class EventoViewSet(RepartidoViewMixin, CamposDinamicosViewMixin, viewsets.ModelViewSet):
     """ViewSet para gestionar Eventos"""
-    queryset = Evento.objects.all()
+    queryset = Evento.objects.select_related('sensor', 'barrera', 'usuario__user').only(
+        'id', 'tipo', 'descripcion', 'sensor', 'sensor__nombre', 'barrera', 'barrera__nombre',
+        'usuario', 'usuario__user', 'usuario__user__username', 'timestamp', 'metadata'
+    )
     serializer_class = EventoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = EventoPagination
+    campo_shard = 'sensor'
+    params_shard = ('departamento', 'sensor', 'barrera')
+    bulk_max_filas = 10000
     
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'bulk']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
     
-    def get_queryset(self):
-        queryset = Evento.objects.all()
+    @action(detail=False, methods=['post'], parser_classes=[RapidoJSONParser, NDJSONParser])
+    def bulk(self, request):
+        """POST /api/eventos/bulk/ (arreglo JSON o NDJSON)"""
+        filas = request.data
+        if not isinstance(filas, list):
+            return Response(
+                {'error': 'Se esperaba una lista de eventos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(filas) > self.bulk_max_filas:
+            return Response(
+                {'error': f'Maximo {self.bulk_max_filas} eventos por lote'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        creados, errores = ingerir_eventos(filas)
+        
+        return Response({
+            'recibidos': len(filas),
+            'creados': len(creados),
+            'errores': errores
+        }, status=status.HTTP_201_CREATED if creados else status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """GET /api/eventos/export/?format=csv|ndjson (acepta los mismos filtros que la lista)"""
+        queryset = archivo.sin_archivados(filtrar_eventos(Evento.objects.all(), request.query_params))
+        # Sin un shard en los filtros se exporta de todos, mezclados por timestamp
+        queryset = shards.repartir(queryset, self.shard)
+        # Los meses archivados se exportan a continuacion, leidos del archivo
+        archivados = archivo.filas(request.query_params) if archivo.consultar(request.query_params) else ()
+        renderer = request.accepted_renderer
+        if renderer.format == 'ndjson':
+            contenido = exportacion.eventos_ndjson(queryset, archivados=archivados)
+        else:
+            contenido = exportacion.eventos_csv(queryset, archivados=archivados)
+        
+        response = StreamingHttpResponse(contenido, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="eventos.{renderer.format}"'
+        return response
+    
+    # granularidad: (ventana por defecto, ventana maxima)
+    ventanas_estadisticas = {
+        'minuto': (timedelta(hours=1), timedelta(days=1)),
+        'hora': (timedelta(days=1), timedelta(days=31)),
+        'dia': (timedelta(days=30), timedelta(days=3660)),
+    }
+    
+    @action(detail=False, methods=['get'])
+    def estadisticas(self, request):
+        """GET /api/eventos/estadisticas/?granularidad=hora&desde=&hasta=&agrupar="""
+        params = request.query_params
+        granularidad = params.get('granularidad', 'hora')
+        if granularidad not in self.ventanas_estadisticas:
+            return Response(
+                {'error': 'Granularidad invalida (minuto, hora, dia)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        agrupar = params.get('agrupar') or None
+        if agrupar not in (None, 'sensor', 'barrera', 'departamento'):
+            return Response(
+                {'error': 'agrupar debe ser sensor, barrera o departamento'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        ventana, ventana_maxima = self.ventanas_estadisticas[granularidad]
+        hasta = fecha_param(params, 'hasta') or timezone.now()
+        desde = fecha_param(params, 'desde') or hasta - ventana
+        if hasta - desde > ventana_maxima:
+            return Response(
+                {'error': f'Rango maximo para {granularidad}: {ventana_maxima.days} dias'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        tipo = self.request.query_params.get('tipo', None)
-        if tipo:
-            queryset = queryset.filter(tipo=tipo)
+        filtros = dict(
+            sensor=entero_param(params, 'sensor'),
+            barrera=entero_param(params, 'barrera'),
+            departamento=entero_param(params, 'departamento'),
+            tipo__in=tipos_param(params, 'tipo__in'),
+        )
         
-        sensor_id = self.request.query_params.get('sensor', None)
-        if sensor_id:
-            queryset = queryset.filter(sensor_id=sensor_id)
+        def calcular():
+            return resumenes.estadisticas(granularidad, desde, hasta, agrupar=agrupar, **filtros)
         
-        return queryset
+        # Sin un shard en los filtros se suman los resumenes de todos
+        resultados = calcular() if self.shard is not None else resumenes.combinar(shards.en_todos(calcular))
+        return Response({
+            'granularidad': granularidad,
+            'desde': desde,
+            'hasta': hasta,
+            'resultados': resultados
+        })
+    
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Evento de un mes archivado: se lee del archivo (solo lectura)
+            try:
+                fila = archivo.buscar(int(kwargs['pk'])) if archivo.entradas() else None
+            except ValueError:
+                fila = None
+            if fila is None:
+                raise
+            return Response(podar_fila(fila, self.get_serializer()))
+    
+    def get_queryset(self):
+        return archivo.sin_archivados(filtrar_eventos(super().get_queryset(), self.request.query_params))
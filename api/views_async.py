@@ -0,0 +1,140 @@
+"""
+Vistas async para los endpoints mas usados, activas con API_ASYNC = True
+bajo un servidor ASGI (ver start_gunicorn.sh). Responden igual que las
+acciones equivalentes de los ViewSets de api.views.
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import archivo, metricas, shards
+from .authentication import StatelessJWTAuthentication
+from .campos import columnas_de_lectura, rutas_de_lectura, serializar_filas
+from .filters import filtrar_eventos
+from .models import Barrera
+from .pagination import EventoPagination
+from .roles import aobtener_rol
+from .serializers import EventoSerializer
+from .services import transicion_barrera, BarreraBloqueada
+from .views import EventoViewSet
+
+
+def _respuesta(data, status_code=status.HTTP_200_OK, headers=None):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    return HttpResponse(renderer.render(data), status=status_code, headers=headers, content_type=content_type)
+
+
+def _respuesta_error(exc):
+    if isinstance(exc, Http404):
+        exc = exceptions.NotFound()
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers['WWW-Authenticate'] = StatelessJWTAuthentication().authenticate_header(None)
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _respuesta(data, exc.status_code, headers)
+
+
+def vista_api(metodos, admin_metodos=()):
+    """
+    Autenticacion JWT, permisos (IsAuthenticated / IsAdminUser) y manejo de
+    errores equivalentes a DRF para vistas async.
+    """
+    def decorador(vista):
+        @csrf_exempt
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            try:
+                if request.method not in metodos:
+                    raise exceptions.MethodNotAllowed(request.method)
+
+                resultado = await StatelessJWTAuthentication().aauthenticate(request)
+                if resultado is None:
+                    raise exceptions.NotAuthenticated()
+                request.user, request.auth = resultado
+
+                if request.method in admin_metodos and not request.user.is_superuser:
+                    perfil = await aobtener_rol(request)
+                    if not (perfil.rol == 'admin' and perfil.activo):
+                        raise exceptions.PermissionDenied()
+
+                return await vista(request, *args, **kwargs)
+            except (exceptions.APIException, Http404) as exc:
+                return _respuesta_error(exc)
+        return envoltura
+    return decorador
+
+
+async def _transicion(pk, accion):
+    # transaction.atomic no existe en modo async: el servicio corre en un hilo
+    try:
+        with shards.usar(shards.alias_de_id(pk)):
+            transicion = await sync_to_async(transicion_barrera)(pk, accion)
+    except Barrera.DoesNotExist:
+        raise Http404
+    except BarreraBloqueada:
+        return _respuesta({'error': 'La barrera esta bloqueada'}, status.HTTP_400_BAD_REQUEST)
+
+    return _respuesta({
+        'mensaje': f'Barrera {transicion.nombre} {transicion.estado}',
+        'estado': transicion.estado
+    })
+
+
+@vista_api(metodos=['POST'])
+async def barrera_abrir(request, pk):
+    """POST /api/barreras/{id}/abrir/"""
+    return await _transicion(pk, 'abrir')
+
+
+@vista_api(metodos=['POST'])
+async def barrera_cerrar(request, pk):
+    """POST /api/barreras/{id}/cerrar/"""
+    return await _transicion(pk, 'cerrar')
+
+
+@vista_api(metodos=['GET', 'POST'], admin_metodos=['POST'])
+async def eventos(request):
+    """GET/POST /api/eventos/"""
+    if request.method == 'POST':
+        return await _crear_evento(request)
+
+    drf_request = Request(request)
+    queryset = archivo.sin_archivados(filtrar_eventos(EventoViewSet.queryset, drf_request.query_params))
+    queryset = shards.repartir(queryset, shards.alias_de_params(drf_request.query_params, EventoViewSet.params_shard))
+    paginator = EventoPagination()
+    serializer = EventoSerializer(context={'request': drf_request})
+    rutas = rutas_de_lectura(serializer)
+    if rutas is None:
+        pagina = await paginator.apaginate_queryset(queryset, drf_request)
+        data = EventoSerializer(pagina, many=True, context={'request': drf_request}).data
+    else:
+        filas = queryset.values(*columnas_de_lectura(rutas, (paginator.keyset_field,)))
+        pagina = await paginator.apaginate_queryset(filas, drf_request)
+        data = metricas.medir_serializacion(serializar_filas, pagina, serializer, rutas)
+    return _respuesta(paginator.get_paginated_response(data).data)
+
+
+async def _crear_evento(request):
+    try:
+        datos = json.loads(request.body or b'{}')
+    except ValueError as exc:
+        raise exceptions.ParseError(f'JSON parse error - {exc}')
+
+    def crear():
+        serializer = EventoSerializer(data=datos)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.data
+
+    with shards.usar(shards.alias_de_id(datos.get('sensor') if isinstance(datos, dict) else None)):
+        data = await sync_to_async(crear)()
+    return _respuesta(data, status.HTTP_201_CREATED)
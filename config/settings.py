@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -24,6 +25,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metricas.MetricasMiddleware',
+    'api.replicas.ReplicasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -62,6 +65,9 @@ DATABASES = {
         'PASSWORD': 'SmartPass2024!',
         'HOST': 'localhost',
         'PORT': '3306',
+        # Conexiones persistentes por worker (0 = una por peticion, recomendado con ASGI)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'charset': 'utf8mb4',
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
@@ -69,6 +75,92 @@ DATABASES = {
     }
 }
 
+# Base SQLite local para pruebas y benchmarks sin MariaDB (ver benchmark_api)
+if os.environ.get('SQLITE_PATH'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ['SQLITE_PATH'],
+        }
+    }
+
+# Replicas de lectura (api.replicas): DB_REPLICAS=host[:puerto],... agrega los alias
+# replica1..N con la configuracion de default. Con SQLITE_PATH, SQLITE_REPLICA_PATH
+# agrega una replica SQLite (una copia del archivo) para probar el enrutamiento
+if os.environ.get('SQLITE_PATH'):
+    _replicas = [
+        {**DATABASES['default'], 'NAME': ruta}
+        for ruta in filter(None, [os.environ.get('SQLITE_REPLICA_PATH')])
+    ]
+else:
+    _replicas = [
+        {
+            **DATABASES['default'],
+            'HOST': host.partition(':')[0],
+            'PORT': host.partition(':')[2] or DATABASES['default']['PORT'],
+            # Solo lecturas: conexiones de mayor duracion y que fallen rapido
+            'CONN_MAX_AGE': int(os.environ.get('DB_REPLICA_CONN_MAX_AGE', 300)),
+            'OPTIONS': {**DATABASES['default']['OPTIONS'], 'connect_timeout': 2},
+        }
+        for host in filter(None, os.environ.get('DB_REPLICAS', '').replace(' ', '').split(','))
+    ]
+for _numero, _replica in enumerate(_replicas, 1):
+    DATABASES[f'replica{_numero}'] = {**_replica, 'TEST': {'MIRROR': 'default'}}
+REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+REPLICAS_RETRASO_MAXIMO = 5  # segundos; una replica mas atrasada no recibe lecturas
+REPLICAS_INTERVALO_RETRASO = 2  # segundos entre mediciones del atraso por proceso
+REPLICAS_FIJAR_SEGUNDOS = 15  # lecturas a la primaria despues de escribir (cookie)
+
+# Shards por departamento (api.shards): DB_SHARDS=host[:puerto],... agrega los alias
+# shard1..N ademas de default (shard 0). Con SQLITE_PATH, SQLITE_SHARDS=ruta,... usa
+# archivos SQLite. El orden es parte del id de las filas: no reordenar ni quitar shards.
+if os.environ.get('SQLITE_PATH'):
+    _shards = [
+        {**DATABASES['default'], 'NAME': ruta}
+        for ruta in filter(None, os.environ.get('SQLITE_SHARDS', '').replace(' ', '').split(','))
+    ]
+else:
+    _shards = [
+        {
+            **DATABASES['default'],
+            'HOST': host.partition(':')[0],
+            'PORT': host.partition(':')[2] or DATABASES['default']['PORT'],
+        }
+        for host in filter(None, os.environ.get('DB_SHARDS', '').replace(' ', '').split(','))
+    ]
+for _numero, _shard in enumerate(_shards, 1):
+    DATABASES[f'shard{_numero}'] = _shard
+SHARDS = [alias for alias in DATABASES if alias.startswith('shard')]
+SHARDS_MAPA_TTL = 60  # segundos que cada proceso guarda el mapa departamento -> shard
+SHARDS_HILOS = 8  # consultas en paralelo a los shards (0 = en serie)
+
+DATABASE_ROUTERS = ['api.shards.ShardsRouter', 'api.replicas.ReplicasRouter']
+
+# default: tokens revocados (api.authentication) y conteos del archivo de eventos;
+# respuestas: cache de respuestas (api.cache). LocMem es por proceso: con varios
+# workers de gunicorn definir REDIS_URL (requiere el paquete redis) para compartirlas
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'respuestas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'respuestas',
+    },
+}
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        alias: {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': alias,
+        }
+        for alias in CACHES
+    }
+
+RESPUESTAS_CACHE_ALIAS = 'respuestas'
+RESPUESTAS_CACHE_TTL = 300  # segundos
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -88,13 +180,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Usan orjson si esta instalado (pip install orjson); si no, el JSON de DRF
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.RapidoJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.RapidoJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
@@ -103,8 +205,62 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'api.tokens.SmartTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.tokens.SmartTokenRefreshSerializer',
 }
 
+# StatelessJWTAuthentication arma el usuario (is_superuser, rol, activo) desde los
+# claims del token sin leer la BD, asi que un token seguiria valido con claims viejos
+# hasta expirar (ACCESS_TOKEN_LIFETIME). Para acotarlo, guardar o borrar un User o su
+# Usuario revoca los tokens emitidos hasta ese momento (api.authentication.revocar_tokens):
+# cada peticion hace una lectura de esta cache. Debe ser compartida entre workers
+# (REDIS_URL); con LocMem la revocacion solo llega al proceso que guardo el cambio
+TOKENS_REVOCADOS_CACHE_ALIAS = 'default'
+
+# Vistas async para abrir/cerrar barreras y listar/crear eventos (solo bajo ASGI)
+API_ASYNC = os.environ.get('API_ASYNC') == '1'
+
+# Stream en vivo (/api/stream/, requiere ASGI). El broker en memoria solo
+# reparte dentro de un proceso; con REDIS_URL los workers comparten un canal de Redis
+TIEMPO_REAL_REDIS_URL = os.environ.get('REDIS_URL')
+TIEMPO_REAL_BROKER = 'api.tiempo_real.RedisBroker' if TIEMPO_REAL_REDIS_URL else 'api.tiempo_real.MemoriaBroker'
+TIEMPO_REAL_BUFFER = 100  # mensajes por cliente antes de descartar los mas antiguos
+# Vida de los tokens de POST /api/stream/token/ (?token= del stream, queda en el log de accesos)
+TIEMPO_REAL_TOKEN_VIDA = timedelta(seconds=60)
+
+# Resolucion de roles para api.permissions.IsAdminUser
+ROLES_CACHE_TTL = 60  # segundos
+ROLES_DESDE_JWT = False  # True: usar los claims rol/activo del token sin consultar la BD
+
+# Metricas por vista (/api/metrics/, formato Prometheus). Desactivadas el
+# middleware se descarta al iniciar. METRICAS_CONSULTA_LENTA_MS registra en el
+# log (logger api.metricas) las consultas que superan el umbral
+METRICAS_ACTIVAS = os.environ.get('METRICAS_ACTIVAS') == '1'
+METRICAS_CONSULTA_LENTA_MS = None
+
+# Archivo de eventos antiguos (manage.py archivar_eventos): un NDJSON comprimido por
+# mes. Con varios servidores debe ser un directorio compartido
+ARCHIVO_EVENTOS_DIR = Path(os.environ.get('ARCHIVO_EVENTOS_DIR', BASE_DIR / 'archivo_eventos'))
+# Segundos que se cachea el conteo de un mes archivado con filtros (paginado por pagina)
+ARCHIVO_EVENTOS_CONTEO_TTL = 3600
+
+# Latidos de sensores (/api/sensores/latidos/): se acumulan por proceso y se
+# escriben juntos cada LATIDOS_VENTANA segundos (0 = escribir en cada peticion)
+LATIDOS_VENTANA = 2
+LATIDOS_MAX_PENDIENTES = 5000
+
+# Diario de eventos (write-behind): con una ruta, abrir/cerrar/comando guardan el
+# evento en ese SQLite local (con fsync) y un hilo por worker los inserta por lotes
+# cada EVENTOS_DIARIO_INTERVALO segundos. Lleno (EVENTOS_DIARIO_MAX) se inserta en la
+# peticion. Sin ruta el evento se inserta en la peticion. Un lote que falla por un
+# error que no es de conexion se parte en filas a los EVENTOS_DIARIO_INTENTOS y la
+# fila que los agota pasa a la tabla descartados del diario
+EVENTOS_DIARIO = os.environ.get('EVENTOS_DIARIO') or None
+EVENTOS_DIARIO_MAX = 100000
+EVENTOS_DIARIO_LOTE = 500
+EVENTOS_DIARIO_INTERVALO = 0.5
+EVENTOS_DIARIO_INTENTOS = 5
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
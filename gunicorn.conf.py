@@ -0,0 +1,56 @@
+"""
+Configuracion de gunicorn (start_gunicorn.sh). Con PRECARGA=1 (por defecto) la
+aplicacion se importa y se calienta una vez en el master (preload_app) y los workers
+la heredan al hacer fork: arrancan en milisegundos y comparten esas paginas de memoria.
+Con PRECARGA=0 cada worker importa la aplicacion y se calienta antes de atender.
+Los cambios de codigo con preload requieren reiniciar el master (no alcanza con HUP).
+"""
+import os
+
+preload_app = os.environ.get('PRECARGA', '1') == '1'
+
+
+def on_starting(server):
+    # La cache de respuestas y la de tokens revocados se invalidan en el worker que
+    # escribe: con LocMem (por proceso) los demas seguirian sirviendo datos viejos
+    if server.cfg.workers > 1:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+        from django.conf import settings
+
+        locales = [alias for alias, cache in settings.CACHES.items() if cache['BACKEND'].endswith('LocMemCache')]
+        if locales:
+            raise RuntimeError(
+                f'Las caches {", ".join(locales)} son LocMem (por proceso) y hay {server.cfg.workers} '
+                'workers: definir REDIS_URL o usar --workers 1'
+            )
+        # Igual con el stream en vivo: cada cliente solo recibiria lo publicado en su worker
+        if settings.TIEMPO_REAL_BROKER == 'api.tiempo_real.MemoriaBroker':
+            raise RuntimeError(
+                f'TIEMPO_REAL_BROKER es MemoriaBroker (por proceso) y hay {server.cfg.workers} '
+                'workers: definir REDIS_URL o usar --workers 1'
+            )
+
+
+def when_ready(server):
+    if preload_app:
+        from api import arranque
+
+        server.log.info('Aplicacion precargada; calentamiento (ms): %s', arranque.calentar())
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # Conexiones abiertas en el master (p. ej. por un AppConfig.ready) no se pueden
+        # compartir entre procesos: cada worker abre las suyas
+        from django.core.cache import caches
+        from django.db import connections
+
+        connections.close_all()
+        caches.close_all()
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        from api import arranque
+
+        worker.log.info('Calentamiento (ms): %s', arranque.calentar())
@@ -6,8 +6,26 @@ source /home/ec2-user/smartconnect/venv/bin/activate
 # Ir al directorio del proyecto
 cd /home/ec2-user/smartconnect
 
-# Iniciar Gunicorn
-gunicorn config.wsgi:application \
+# Cache compartida por los workers (respuestas y tokens revocados); gunicorn.conf.py
+# no arranca varios workers con caches en memoria de cada proceso
+export REDIS_URL=${REDIS_URL:-redis://127.0.0.1:6379/0}
+
+# MODO=asgi usa workers uvicorn y activa las vistas async (API_ASYNC=1)
+MODO=${MODO:-wsgi}
+if [ "$MODO" = "asgi" ]; then
+    export API_ASYNC=1
+    # Las conexiones persistentes no se reciclan bien entre los hilos de sync_to_async
+    export DB_CONN_MAX_AGE=${DB_CONN_MAX_AGE:-0}
+    APP=config.asgi:application
+    WORKER_CLASS="--worker-class uvicorn.workers.UvicornWorker"
+else
+    APP=config.wsgi:application
+    WORKER_CLASS=""
+fi
+
+# Iniciar Gunicorn; gunicorn.conf.py precarga la aplicacion en el master (PRECARGA=0 lo desactiva)
+gunicorn $APP $WORKER_CLASS \
+    --config gunicorn.conf.py \
     --bind 127.0.0.1:8000 \
     --workers 3 \
     --timeout 120 \
@@ -15,4 +33,4 @@ gunicorn config.wsgi:application \
     --error-logfile /home/ec2-user/smartconnect/gunicorn-error.log \
     --daemon
 
-echo "✅ Gunicorn iniciado en 127.0.0.1:8000"
+echo "✅ Gunicorn ($MODO) iniciado en 127.0.0.1:8000"
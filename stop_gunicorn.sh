@@ -1,4 +1,3 @@
 #!/bin/bash
-pkill -f 'gunicorn.*config.wsgi'
+pkill -f 'gunicorn.*config.[aw]sgi'
 echo "🛑 Gunicorn detenido"
-